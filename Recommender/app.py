@@ -1,229 +1,1144 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
 import pickle
-import os
 import json
+import os
+import hmac
+import queue
+import threading
+import time
+import uuid
 import numpy as np
-from collections import defaultdict
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from send_invoice import generate_invoice_pdf, send_invoice_via_twilio, upload_to_dropbox
+from collections import OrderedDict
+from scipy import sparse
+from invoice_jobs import InvoiceJobQueue
+from invoice_outbox import NotificationOutbox
+from catalog import ProductCatalog
+from serializer import RecordFragments
+import serializer
+from model_store import load_model_artifact
+from sharding import ShardPool
+from sales_counters import SalesCounters, TopSellingRanking
+import metrics
+from metrics import REQUEST_SECONDS, RECOMMEND_STAGE_SECONDS
 
 app = Flask(__name__)
 CORS(app)  
 
+# Model location, plus how often each worker polls it and the reload requests for
+# changes. With the watcher disabled (0), /admin/reload-model only reaches the worker
+# that received it.
+MODEL_PATH = os.environ.get('MODEL_PATH', 'recommender_model')
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 5))
+
+# /admin/reload-model writes its request here for the watchers of the other workers
+MODEL_RELOAD_PATH = os.environ.get('MODEL_RELOAD_PATH', 'model_reload.json')
+
+# Legacy pickled models run arbitrary code when loaded; they are refused unless this is
+# set to 1. Convert them instead with: python model_store.py recommender_model.pkl recommender_model
+ALLOW_PICKLE_MODEL = os.environ.get('ALLOW_PICKLE_MODEL') == '1'
+
+# Token required by the admin endpoints; without it they are disabled
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Upper bound on the elements of a dense similarity or query block scored at once
+DENSE_BLOCK_SIZE = 8_000_000
+
+# Largest number of carts accepted by /recommend/batch
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 1000))
+
+# Recommendation cache size and entry lifetime in seconds (size 0 disables it)
+RECOMMENDATION_CACHE_SIZE = int(os.environ.get('RECOMMENDATION_CACHE_SIZE', 4096))
+RECOMMENDATION_CACHE_TTL = float(os.environ.get('RECOMMENDATION_CACHE_TTL', 300))
+
+# Number of cart sessions kept for incremental scoring and their idle lifetime in seconds
+CART_SESSION_LIMIT = int(os.environ.get('CART_SESSION_LIMIT', 128))
+CART_SESSION_TTL = float(os.environ.get('CART_SESSION_TTL', 1800))
+# Memory the sessions of one process may take; large catalogs keep fewer sessions
+CART_SESSION_MAX_BYTES = int(os.environ.get('CART_SESSION_MAX_BYTES', 64 * 1024 * 1024))
+
+# Candidate window used by the diversity pass, as a multiple of the requested count
+OVERFETCH_FACTOR = 4
+
+# Similarity mode: 'exact' scores every catalog product, 'neighbors' merges the
+# precomputed top-M neighbor lists of the cart items
+SIMILARITY_MODE = os.environ.get('SIMILARITY_MODE', 'exact')
+NUM_NEIGHBORS = int(os.environ.get('NUM_NEIGHBORS', 50))
+
+# Worker processes that score row shards of the catalog in 'exact' mode (0 or 1 scores
+# in-process). Needs an artifact directory; each worker maps it and holds only its rows.
+SCORING_SHARDS = int(os.environ.get('SCORING_SHARDS', 0))
+
+# Number of sample carts used to check neighbor index recall at load time
+RECALL_SAMPLE_CARTS = 50
+
+# Top-selling products ranked and kept current as sales come in; the rest of the ranking is built on demand
+TOP_SELLING_RECORDS = 512
+
+def normalized_matrix(tfidf_matrix):
+    """Return the matrix as float32 CSR with unit-length rows, sharing its index arrays"""
+    tfidf_matrix = sparse.csr_matrix(tfidf_matrix)
+    row_lengths = np.diff(tfidf_matrix.indptr)
+    rows = np.repeat(np.arange(tfidf_matrix.shape[0]), row_lengths)
+    row_norms = np.sqrt(np.bincount(rows, weights=np.square(tfidf_matrix.data, dtype=np.float64),
+                                    minlength=tfidf_matrix.shape[0]))
+    # Rows without terms stay zero, as in sklearn's normalize
+    row_norms[row_norms == 0] = 1.0
+    data = (tfidf_matrix.data / row_norms[rows]).astype(np.float32)
+    return sparse.csr_matrix((data, tfidf_matrix.indices, tfidf_matrix.indptr), shape=tfidf_matrix.shape)
+
+def recency_weights(count):
+    """Recency bias - more recent cart items have higher weight; the weights sum to one"""
+    weights = np.linspace(0.8, 1.0, count)
+    return (weights / weights.sum()).astype(np.float32)
+
+def sigmoid_normalize(scores):
+    """Sigmoid normalization function to preserve meaningful score distribution"""
+    return 1 / (1 + np.exp(-5 * (scores - 0.5)))
+
+def top_k_positions(scores, k):
+    """Return the positions of the k highest scores, best first, ties by position"""
+    if k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    
+    partition = np.argpartition(-scores, k - 1)[:k]
+    threshold = scores[partition].min()
+    
+    # Resolve ties at the cut-off in favour of the lowest positions
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+    top = np.concatenate([above, ties])
+    return top[np.lexsort((top, -scores[top]))]
+
+def rank_within_groups(codes):
+    """Return how many earlier entries share each entry's code"""
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(codes)])
+    ranks = np.empty(len(codes), dtype=np.intp)
+    ranks[order] = np.arange(len(codes)) - np.repeat(group_starts, group_sizes)
+    return ranks
+
+class RecommendationCache:
+    """Thread-safe LRU cache with a time-to-live for recommendation results"""
+    def __init__(self, max_entries=RECOMMENDATION_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if time.monotonic() - stored_at < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'size': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl
+            }
+
+class CartSession:
+    """Running similarity sums of one shopper's cart, kept between scans"""
+    def __init__(self, num_products):
+        self.num_products = num_products
+        self.indices = []
+        self.lock = threading.Lock()
+        
+        # Running sums of the rows and of the rows times their cart position, which
+        # is all the linear recency weights need; the rows themselves aren't kept
+        self.total = np.zeros(num_products)
+        self.position_total = np.zeros(num_products)
+    
+    def update(self, cart_indices, compute_rows):
+        """Bring the session in line with the cart and return its weighted similarity"""
+        # Items appended to the previous cart only add their rows to the sums
+        common = 0
+        limit = min(len(self.indices), len(cart_indices))
+        while common < limit and self.indices[common] == cart_indices[common]:
+            common += 1
+        
+        if common < len(self.indices):
+            # Removed or reordered items: start over from the cart, so rounding errors
+            # can't build up either
+            self.indices = []
+            self.total = np.zeros(self.num_products)
+            self.position_total = np.zeros(self.num_products)
+            common = 0
+        
+        added = cart_indices[common:]
+        if added:
+            unique = list(dict.fromkeys(added))
+            rows = dict(zip(unique, compute_rows(unique)))
+            for idx in added:
+                self.total += rows[idx]
+                self.position_total += len(self.indices) * rows[idx]
+                self.indices.append(idx)
+        
+        return self.weighted_similarity()
+    
+    def weighted_similarity(self):
+        """Same weighting as np.linspace(0.8, 1.0, n), from the running sums"""
+        count = len(self.indices)
+        if count == 1:
+            return self.total.copy()
+        step = (1.0 - 0.8) / (count - 1)
+        weights_sum = np.linspace(0.8, 1.0, count).sum()
+        return (0.8 * self.total + step * self.position_total) / weights_sum
+
+class CartSessionStore:
+    """LRU store of cart sessions, bounded by count and memory, with an idle timeout"""
+    def __init__(self, max_sessions=CART_SESSION_LIMIT, ttl=CART_SESSION_TTL, max_bytes=CART_SESSION_MAX_BYTES):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, session_id, num_products):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None or now - entry[0] >= self.ttl:
+                entry = (now, CartSession(num_products))
+            self.sessions[session_id] = (now, entry[1])
+            self.sessions.move_to_end(session_id)
+            # Each session holds two float64 rows the length of the catalog
+            limit = min(self.max_sessions, max(1, self.max_bytes // (16 * max(num_products, 1))))
+            while len(self.sessions) > limit:
+                self.sessions.popitem(last=False)
+            return entry[1]
+
 class ProductRecommender:
     def __init__(self):
-        self.product_data = {}
         self.vectorizer = None
+        # Float32 TF-IDF rows scaled to unit length, so cosine similarity is a plain product
         self.tfidf_matrix = None
-        self.product_keys = []
-        self.product_idx_map = {}
+        
+        # Columnar product attributes and barcode index, aligned with the rows of tfidf_matrix
+        self.catalog = None
+        self.record_fragments = None
+        self.top_selling = None
+        self.top_selling_records = {}
+        
+        # The model's own units sold while live sales are added to catalog.units_sold
+        self.base_units_sold = None
+        
+        # Item-item neighbor index used by the 'neighbors' similarity mode
+        self.similarity_mode = 'exact'
+        self.neighbor_indices = None
+        self.neighbor_scores = None
+        
+        # Worker processes scoring row shards in 'exact' mode, when enabled
+        self.shards = None
+        
+        # Where the model came from and when it was loaded
+        self.model_path = None
+        self.model_version = None
+        self.signature = None
+        self.loaded_at = None
+        # When the export the model was built from was taken (seconds since the epoch);
+        # its units sold already include the sales recorded before then
+        self.sales_through = 0
+        self.load_duration = None
+        
+        # Results cache and cart sessions; every loaded model starts with empty ones
+        self.cache = RecommendationCache()
+        self.sessions = CartSessionStore()
+    
+    # Precompute the rankings and JSON fragments used by the scoring path
+    def build_product_arrays(self):
+        self.record_fragments = RecordFragments(self.catalog)
+        
+        # Top-selling ranking; catalog order decides between equal sales
+        self.top_selling = TopSellingRanking(self.catalog.units_sold, TOP_SELLING_RECORDS)
+        self.top_selling_records = {idx: self.product_record(idx, 0.5) for idx in self.top_selling.rows}
+    
+    # Add live sales, given as units sold per barcode since the model's export was taken,
+    # to the model's units sold and move the products up the top-selling ranking
+    def apply_sales(self, units):
+        catalog = self.catalog
+        if not units or catalog is None:
+            return
+        if self.base_units_sold is None:
+            # The artifact's column is read-only and shared; live counts go into a private copy
+            self.base_units_sold = catalog.units_sold
+            catalog.units_sold = np.array(catalog.units_sold, dtype=np.int64)
+        
+        rows, values = [], []
+        for barcode, sold in units.items():
+            idx = catalog.row(barcode)
+            if idx is not None:
+                rows.append(idx)
+                values.append(int(self.base_units_sold[idx]) + sold)
+        if not rows:
+            return
+        catalog.units_sold[rows] = values
+        
+        self.top_selling.update(catalog.units_sold, rows)
+        for idx in rows:
+            self.top_selling_records.pop(idx, None)
+        for idx in [idx for idx in self.top_selling_records if idx not in self.top_selling.members]:
+            self.top_selling_records.pop(idx, None)
+        if self.shards is not None:
+            self.shards.update_units_sold(rows, values)
+    
+    # Precompute each product's top-M TF-IDF neighbors and their cosine scores
+    def build_neighbor_index(self, num_neighbors=NUM_NEIGHBORS):
+        num_products = self.tfidf_matrix.shape[0]
+        num_neighbors = max(min(num_neighbors, num_products - 1), 0)
+        self.neighbor_indices = np.empty((num_products, num_neighbors), dtype=np.int32)
+        self.neighbor_scores = np.zeros((num_products, num_neighbors), dtype=np.float32)
+        
+        # Score the catalog in row blocks to bound the size of the dense blocks
+        block_size = max(1, DENSE_BLOCK_SIZE // max(num_products, self.tfidf_matrix.shape[1], 1))
+        for start in range(0, num_products, block_size):
+            stop = min(start + block_size, num_products)
+            rows = np.arange(start, stop)
+            # Sparse on both sides: for this many rows it beats a dense product
+            block = (self.tfidf_matrix[start:stop] @ self.tfidf_matrix.T).toarray()
+            block[rows - start, rows] = -np.inf
+            if num_neighbors == 0:
+                continue
+            
+            top = np.argpartition(-block, num_neighbors - 1, axis=1)[:, :num_neighbors]
+            top_scores = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            
+            # Unused slots point back at the product itself, which is always in the cart
+            empty = top_scores <= 0
+            top[empty] = np.broadcast_to(rows[:, None], top.shape)[empty]
+            top_scores[empty] = 0
+            
+            self.neighbor_indices[start:stop] = top
+            self.neighbor_scores[start:stop] = top_scores
+    
+    # Fraction of the exact top-N that the neighbor index also returns
+    def neighbor_recall(self, carts=None, num_recommendations=12):
+        if carts is None:
+            # Random sample carts of one to five catalog products
+            rng = np.random.default_rng(0)
+            carts = [
+                [self.catalog.barcode(i) for i in rng.choice(len(self.catalog), size)]
+                for size in rng.integers(1, 6, RECALL_SAMPLE_CARTS)
+            ]
+        
+        recalls = []
+        for cart in carts:
+            exact = self.get_similar_products(cart, num_recommendations, similarity_mode='exact')
+            approx = self.get_similar_products(cart, num_recommendations, similarity_mode='neighbors')
+            exact_barcodes = {rec['barcode'] for rec in exact}
+            if exact_barcodes:
+                hits = len(exact_barcodes.intersection(rec['barcode'] for rec in approx))
+                recalls.append(hits / len(exact_barcodes))
+        return float(np.mean(recalls)) if recalls else 1.0
+    
+    # Build the response record for the product at the given matrix row
+    def product_record(self, idx, similarity):
+        catalog = self.catalog
+        return self.record_fragments.record(idx, {
+            'barcode': catalog.barcode(idx),
+            'similarity': similarity,
+            'category': catalog.categories[catalog.category_codes[idx]],
+            'sub_category': catalog.sub_categories[catalog.sub_category_codes[idx]],
+            'price': catalog.price(idx),
+            'units_sold': int(catalog.units_sold[idx]),
+            'name': catalog.names[idx],
+            'imageUrl': catalog.image_urls[idx]
+        })
     
     def get_top_selling_products(self, num_recommendations=12, exclude_barcodes=None):
-        if exclude_barcodes is None:
-            exclude_barcodes = []
+        excluded = set(exclude_barcodes) if exclude_barcodes else set()
         
-        sorted_products = sorted(
-            [p for barcode, p in self.product_data.items() if barcode not in exclude_barcodes],
-            key=lambda x: x.get('units_sold', 0),
-            reverse=True
-        )
+        # Walk the live ranking, skipping excluded products; the rest of the catalog is
+        # only sorted if that runs out
+        ranking = self.top_selling.rows
+        def ranked_rows():
+            yield from ranking
+            if len(ranking) < len(self.catalog):
+                yield from np.argsort(-self.catalog.units_sold, kind='stable')[len(ranking):].tolist()
         
         recommendations = []
-        for product in sorted_products[:num_recommendations]:
-            recommendations.append({
-                'barcode': product['barcode'],
-                'similarity': 0.5,  
-                'category': product['category'],
-                'sub_category': product.get('sub_category', ''),
-                'price': product['price'],
-                'units_sold': product.get('units_sold', 0),
-                'name': product['name'],
-                'imageUrl': product.get('imageUrl', '')
-            })
-        
-        return recommendations[:num_recommendations]
+        for idx in ranked_rows():
+            if len(recommendations) >= num_recommendations:
+                break
+            record = self.top_selling_records.get(idx)
+            if record is None:
+                record = self.product_record(idx, 0.5)
+                if idx in self.top_selling.members:
+                    self.top_selling_records[idx] = record
+            record = record.copy()
+            if record['barcode'] not in excluded:
+                recommendations.append(record)
+        
+        return recommendations
     
     # Compute similarity with improved algorithm
     def get_similar_products(self, cart_barcodes, num_recommendations=12, 
-                             max_per_category=3, similarity_threshold=0.1):
+                             max_per_category=3, similarity_threshold=0.1, similarity_mode=None):
         # If cart is empty, return top selling products
         if not cart_barcodes:
             return self.get_top_selling_products(num_recommendations)
     
-        cart_indices = [self.product_idx_map[barcode] for barcode in cart_barcodes if barcode in self.product_idx_map]
+        cart_indices = self.cart_indices(cart_barcodes)
         
         # If no valid cart items were found, return top selling products
         if not cart_indices:
             return self.get_top_selling_products(num_recommendations)
     
-        # Compute weighted cosine similarity for cart items
-        cart_vectors = self.tfidf_matrix[cart_indices]
-        cosine_sim = cosine_similarity(cart_vectors, self.tfidf_matrix)
+        similarity_mode = similarity_mode or self.similarity_mode
+        if similarity_mode == 'exact' and self.shards is not None:
+            # The shards score and boost their own rows and send back only those that can
+            # make the ranking; the diversity pass runs here on the merged candidates
+            with RECOMMEND_STAGE_SECONDS.time('similarity'):
+                sharded = self.shards.score(cart_indices, num_recommendations, max_per_category)
+            if sharded is not None:
+                candidates, scores = sharded
+                return self.select_recommendations(
+                    cart_barcodes, candidates, scores, num_recommendations, max_per_category
+                )
         
-        # Apply recency bias - more recent cart items have higher weight
-        weights = np.linspace(0.8, 1.0, len(cart_indices))
-        weighted_cosine_sim = np.average(cosine_sim, axis=0, weights=weights)
-    
-        recommended_products = []
-        for i, score in enumerate(weighted_cosine_sim):
-            barcode = self.product_keys[i]
-            if barcode not in cart_barcodes:
-                recommended_products.append({
-                    'barcode': barcode,
-                    'similarity': score,
-                    'category': self.product_data[barcode]['category'],
-                    'sub_category': self.product_data[barcode]['sub_category'],
-                    'price': self.product_data[barcode]['price'],
-                    'units_sold': self.product_data[barcode]['units_sold'],
-                    'name': self.product_data[barcode]['name'],
-                    'imageUrl': self.product_data[barcode].get('imageUrl', '')
-                })
-    
-        # Improved boosting algorithm
-        for rec in recommended_products:
-            # Category match boost
-            if self.product_data[rec['barcode']]['category'] in [self.product_data[b]['category'] for b in cart_barcodes]:
-                rec['similarity'] *= 1.3
-            
-            # Sub-category match boost
-            if self.product_data[rec['barcode']]['sub_category'] in [self.product_data[b].get('sub_category', '') for b in cart_barcodes]:
-                rec['similarity'] *= 1.2
-            
-            # Popularity boost with diminishing returns
-            popularity_boost = min(1 + (rec['units_sold'] / 1000), 1.5)
-            rec['similarity'] *= popularity_boost
-            
-            # Price range similarity boost
-            cart_prices = [self.product_data[b]['price'] for b in cart_barcodes]
-            avg_cart_price = sum(cart_prices) / len(cart_prices)
-            price_ratio = min(rec['price'], avg_cart_price) / max(rec['price'], avg_cart_price)
-            rec['similarity'] *= (0.7 + 0.3 * price_ratio)  # Price similarity accounts for up to 30% boost
-    
-        # Sigmoid normalization function to preserve meaningful score distribution
-        def sigmoid_normalize(scores):
-            return 1 / (1 + np.exp(-5 * (scores - 0.5)))
-        
-        if recommended_products:
-            similarities = np.array([rec['similarity'] for rec in recommended_products])
-            normalized = sigmoid_normalize(similarities / max(similarities))
-            for i, rec in enumerate(recommended_products):
-                rec['similarity'] = normalized[i]
-    
-        recommended_products.sort(key=lambda x: x['similarity'], reverse=True)
-    
-        # Ensure category diversity with improved algorithm
-        category_counts = defaultdict(int)
-        final_recommendations = []
-        
-        # First pass: select top items from different categories
-        for rec in recommended_products:
-            category = rec['category']
-            if category_counts[category] < max_per_category:
-                final_recommendations.append(rec)
-                category_counts[category] += 1
-    
-            if len(final_recommendations) == num_recommendations:
-                break
+        with RECOMMEND_STAGE_SECONDS.time('similarity'):
+            if similarity_mode == 'neighbors':
+                candidates, similarity = self.neighbor_similarity(cart_indices)
+            else:
+                candidates, similarity = self.exact_similarity(cart_indices)
+        
+        return self.rank_candidates(
+            cart_barcodes, cart_indices, candidates, similarity, num_recommendations, max_per_category
+        )
     
-        # If we don't have enough recommendations yet, add more from the sorted list
-        if len(final_recommendations) < num_recommendations:
-            remaining_options = [rec for rec in recommended_products if rec not in final_recommendations]
-            
-            # Sort by similarity score
-            remaining_options.sort(key=lambda x: x['similarity'], reverse=True)
-            
-            # Add remaining recommendations until we reach the desired number
-            additional_needed = num_recommendations - len(final_recommendations)
-            final_recommendations.extend(remaining_options[:additional_needed])
+    # Matrix rows of the cart items that exist in the catalog, in cart order
+    def cart_indices(self, cart_barcodes):
+        return self.catalog.rows(cart_barcodes)
+    
+    # Boost, diversify and normalize candidate scores into the final recommendations
+    def rank_candidates(self, cart_barcodes, cart_indices, candidates, similarity,
+                        num_recommendations, max_per_category=3):
+        with RECOMMEND_STAGE_SECONDS.time('boosting'):
+            scores = self.boost_scores(similarity, candidates, cart_indices)
+        return self.select_recommendations(cart_barcodes, candidates, scores, num_recommendations, max_per_category)
+    
+    # Final recommendations from the boosted scores of the candidates
+    def select_recommendations(self, cart_barcodes, candidates, scores, num_recommendations, max_per_category=3):
+        start = time.perf_counter()
+        
+        # Ensure category diversity on the top of the ranking only. The normalization is
+        # monotonic, so the boosted scores rank the same and only the selected products
+        # need it.
+        selected = self.select_diverse(
+            scores, self.catalog.category_codes[candidates], num_recommendations, max_per_category
+        )
+        diversified = time.perf_counter()
+        
+        selected_scores = sigmoid_normalize(scores[selected] / scores.max()) if len(selected) else scores[selected]
+        RECOMMEND_STAGE_SECONDS.observe(diversified - start, 'diversity')
+        RECOMMEND_STAGE_SECONDS.observe(time.perf_counter() - diversified, 'normalization')
+        
+        final_recommendations = [
+            self.product_record(candidates[pos], float(score)) for pos, score in zip(selected, selected_scores)
+        ]
         
         # If we still don't have enough recommendations, add top selling products
         if len(final_recommendations) < num_recommendations:
             top_selling = self.get_top_selling_products(
                 num_recommendations - len(final_recommendations),
-                exclude_barcodes=cart_barcodes + [rec['barcode'] for rec in final_recommendations]
+                exclude_barcodes=list(cart_barcodes) + [rec['barcode'] for rec in final_recommendations]
             )
             final_recommendations.extend(top_selling)
     
         # Ensure we return exactly the requested number of recommendations
         return final_recommendations[:num_recommendations]
     
-    # Get recommendations for cart barcodes
-    def recommend(self, cart_barcodes, num_recommendations=12):
-        if not self.product_data or self.tfidf_matrix is None:
+    # Weighted cosine similarity of every catalog product that is not in the cart
+    def exact_similarity(self, cart_indices):
+        # The weighted average of the cosines is the cosine with the weighted sum of the cart rows
+        weights = recency_weights(len(cart_indices))
+        weighted_cosine_sim = self.similarity(cart_indices, weights[None, :])[0]
+    
+        # Every catalog product that is not already in the cart is a candidate
+        return self.exclude_cart(weighted_cosine_sim, cart_indices)
+    
+    # Cosine similarity of every catalog product with weighted sums of the given rows, or
+    # with each row when there are no weights; one sparse product against the dense sums
+    def similarity(self, rows, weights=None):
+        vectors = self.tfidf_matrix[rows].T
+        vectors = vectors.toarray() if weights is None else vectors @ weights.T
+        return np.ascontiguousarray((self.tfidf_matrix @ vectors).T)
+    
+    # Candidate rows and their similarity for a cart, given its weighted similarity row
+    def exclude_cart(self, weighted_similarity, cart_indices):
+        candidate_mask = np.ones(len(self.catalog), dtype=bool)
+        candidate_mask[cart_indices] = False
+        candidates = np.flatnonzero(candidate_mask)
+        return candidates, weighted_similarity[candidates]
+    
+    # Weighted similarity merged from the cart items' neighbor lists only
+    def neighbor_similarity(self, cart_indices):
+        weights = np.linspace(0.8, 1.0, len(cart_indices))
+        neighbor_rows = self.neighbor_indices[cart_indices].ravel()
+        neighbor_weights = (self.neighbor_scores[cart_indices] * weights[:, None]).ravel()
+        
+        # Sum the weighted scores of products shared by several neighbor lists
+        candidates, inverse = np.unique(neighbor_rows, return_inverse=True)
+        similarity = np.bincount(inverse, weights=neighbor_weights, minlength=len(candidates)) / weights.sum()
+        
+        not_in_cart = ~np.isin(candidates, cart_indices)
+        return candidates[not_in_cart], similarity[not_in_cart]
+    
+    # Pick the best positions by score, allowing at most max_per_category per category
+    def select_diverse(self, scores, categories, num_recommendations, max_per_category):
+        total = len(scores)
+        if num_recommendations <= 0 or total == 0:
+            return np.empty(0, dtype=np.intp)
+        
+        # Over-fetch a bounded window and widen it only when the diversity cap
+        # leaves it short; equal scores keep catalog order like a stable sort
+        window = min(total, OVERFETCH_FACTOR * num_recommendations)
+        while True:
+            ranked = top_k_positions(scores, window)
+            keep = rank_within_groups(categories[ranked]) < max_per_category
+            selected = ranked[keep][:num_recommendations]
+            if len(selected) == num_recommendations or window == total:
+                break
+            window = min(total, window * OVERFETCH_FACTOR)
+        
+        # If we don't have enough recommendations yet, add more from the sorted list
+        if len(selected) < num_recommendations:
+            remaining = ranked[~keep][:num_recommendations - len(selected)]
+            selected = np.concatenate([selected, remaining])
+        
+        return selected
+    
+    # Apply category, sub-category, popularity and price boosts to candidate scores
+    def boost_scores(self, scores, candidates, cart_indices):
+        catalog = self.catalog
+        cart_categories = np.unique(catalog.category_codes[cart_indices])
+        cart_sub_categories = np.unique(catalog.sub_category_codes[cart_indices])
+        cart_prices = catalog.prices[cart_indices].tolist()
+        avg_cart_price = sum(cart_prices) / len(cart_prices)
+        
+        # Category match boost
+        category_match = np.isin(catalog.category_codes[candidates], cart_categories)
+        scores = scores * np.where(category_match, 1.3, 1.0)
+        
+        # Sub-category match boost
+        sub_category_match = np.isin(catalog.sub_category_codes[candidates], cart_sub_categories)
+        scores = scores * np.where(sub_category_match, 1.2, 1.0)
+        
+        # Popularity boost with diminishing returns
+        scores = scores * np.minimum(1 + (catalog.units_sold[candidates] / 1000), 1.5)
+        
+        # Price range similarity boost
+        prices = catalog.prices[candidates]
+        price_ratio = np.minimum(prices, avg_cart_price) / np.maximum(prices, avg_cart_price)
+        scores = scores * (0.7 + 0.3 * price_ratio)  # Price similarity accounts for up to 30% boost
+        
+        return scores
+    
+    # Get recommendations for cart barcodes, optionally reusing a cart session's scores
+    def recommend(self, cart_barcodes, num_recommendations=12, session_id=None):
+        if not self.catalog or self.tfidf_matrix is None:
             return []
         
-        recommendations = self.get_similar_products(cart_barcodes, num_recommendations=num_recommendations)
+        # Cached results are shared between requests and must not be modified
+        cache_key = self.cache_key(cart_barcodes, num_recommendations)
+        recommendations = self.cache.get(cache_key)
+        if recommendations is None:
+            # Sessions keep full similarity rows in this process, which sharding avoids
+            if session_id is not None and self.similarity_mode == 'exact' and self.shards is None:
+                recommendations = self.get_session_recommendations(session_id, cart_barcodes, num_recommendations)
+            else:
+                recommendations = self.get_similar_products(cart_barcodes, num_recommendations=num_recommendations)
+            self.cache.put(cache_key, recommendations)
         return recommendations
     
-    # Load model from pickle file
+    # Score a cart by updating its session with only the added or removed items
+    def get_session_recommendations(self, session_id, cart_barcodes, num_recommendations=12):
+        cart_indices = self.cart_indices(cart_barcodes)
+        session = self.sessions.get(session_id, len(self.catalog))
+        with session.lock:
+            if not cart_indices:
+                session.update([], self.row_similarity)
+                return self.get_top_selling_products(num_recommendations)
+            with RECOMMEND_STAGE_SECONDS.time('similarity'):
+                weighted_similarity = session.update(cart_indices, self.row_similarity)
+        
+        candidates, similarity = self.exclude_cart(weighted_similarity, cart_indices)
+        return self.rank_candidates(cart_barcodes, cart_indices, candidates, similarity, num_recommendations)
+    
+    # Cosine similarity rows of the given products against the whole catalog
+    def row_similarity(self, indices):
+        return list(self.similarity(indices))
+    
+    # Cache key for a cart; order matters because of the recency weights, and
+    # barcodes missing from the catalog do not change the result
+    def cache_key(self, cart_barcodes, num_recommendations):
+        known = tuple(self.catalog.barcode(idx) for idx in self.catalog.rows(cart_barcodes))
+        return known, num_recommendations
+    
+    # Get recommendations for many carts, scoring their rows together
+    def recommend_batch(self, carts, num_recommendations=12):
+        if isinstance(num_recommendations, int):
+            num_recommendations = [num_recommendations] * len(carts)
+        if not self.catalog or self.tfidf_matrix is None:
+            return [[] for _ in carts]
+        
+        # Serve what we can from the cache first
+        cache_keys = [self.cache_key(cart, num) for cart, num in zip(carts, num_recommendations)]
+        results = [self.cache.get(key) for key in cache_keys]
+        cart_indices = [self.cart_indices(cart) for cart in carts]
+        
+        # Carts scored against the full catalog share one matrix product per chunk;
+        # sharded models score each cart across the shards instead
+        scored = []
+        if self.similarity_mode == 'exact' and self.shards is None:
+            scored = [i for i, indices in enumerate(cart_indices) if indices and results[i] is None]
+        
+        max_carts = max(1, DENSE_BLOCK_SIZE // max(len(self.catalog), self.tfidf_matrix.shape[1], 1))
+        chunk = []
+        for position, i in enumerate(scored):
+            chunk.append(i)
+            if len(chunk) >= max_carts or position == len(scored) - 1:
+                # One observation per chunk of carts scored together
+                with RECOMMEND_STAGE_SECONDS.time('batch_similarity'):
+                    chunk_similarity = self.batch_similarity([cart_indices[j] for j in chunk])
+                for j, similarity in zip(chunk, chunk_similarity):
+                    candidates, candidate_similarity = self.exclude_cart(similarity, cart_indices[j])
+                    results[j] = self.rank_candidates(
+                        carts[j], cart_indices[j], candidates, candidate_similarity, num_recommendations[j]
+                    )
+                    self.cache.put(cache_keys[j], results[j])
+                chunk = []
+        
+        # Empty carts, unknown items, the neighbor mode and sharded scoring go through the single-cart path
+        for i, cart in enumerate(carts):
+            if results[i] is None:
+                results[i] = self.get_similar_products(cart, num_recommendations=num_recommendations[i])
+                self.cache.put(cache_keys[i], results[i])
+        return results
+    
+    # Weighted cosine similarity rows for several carts from one stacked product
+    def batch_similarity(self, carts_indices):
+        stacked = [idx for indices in carts_indices for idx in indices]
+        
+        # Each cart's row of weights covers only its own items, with its own recency weights
+        weights = np.zeros((len(carts_indices), len(stacked)), dtype=np.float32)
+        start = 0
+        for cart, indices in enumerate(carts_indices):
+            stop = start + len(indices)
+            weights[cart, start:stop] = recency_weights(len(indices))
+            start = stop
+        return list(self.similarity(stacked, weights))
+    
+    # Load model from an artifact directory, or from a legacy pickle file when ALLOW_PICKLE_MODEL is set
     @classmethod
-    def load_model(cls, filename="recommender_model.pkl"):
+    def load_model(cls, filename="recommender_model", similarity_mode=SIMILARITY_MODE,
+                   num_neighbors=NUM_NEIGHBORS, scoring_shards=SCORING_SHARDS):
         try:
-            with open(filename, 'rb') as f:
-                model_data = pickle.load(f)
+            if similarity_mode not in ('exact', 'neighbors'):
+                raise ValueError(f"Unknown similarity mode: {similarity_mode}")
+            
+            start_time = time.perf_counter()
+            # Taken first, so a model published while this one loads is still noticed
+            signature = model_signature(filename)
+            if os.path.isdir(filename):
+                # Memory-mapped arrays, shared between workers through the page cache
+                model_data = load_model_artifact(filename)
+                manifest = model_data['manifest']
+                model_version = manifest['model_version']
+                # Artifacts written before the export time was recorded were built right after it
+                sales_through = manifest.get('sales_through')
+                if sales_through is None:
+                    sales_through = time.mktime(time.strptime(manifest['created_at'], '%Y-%m-%dT%H:%M:%S'))
+            else:
+                if not ALLOW_PICKLE_MODEL:
+                    raise ValueError(f"{filename} is not a model artifact directory; convert a pickled model with "
+                                     f"'python model_store.py {filename} <artifact_dir>' or set ALLOW_PICKLE_MODEL=1")
+                print(f"WARNING: Loading pickled model {filename}; unpickling runs any code the file contains")
+                with open(filename, 'rb') as f:
+                    model_data = pickle.load(f)
+                sales_through = os.path.getmtime(filename)
+                model_version = time.strftime('%Y%m%d%H%M%S', time.localtime(sales_through))
+                model_data['catalog'] = ProductCatalog.from_records(
+                    [model_data['product_data'][barcode] for barcode in model_data['product_keys']]
+                )
             
             recommender = cls()
-            recommender.product_data = model_data['product_data']
+            recommender.model_path = filename
+            recommender.model_version = model_version
+            recommender.sales_through = sales_through
+            recommender.catalog = model_data['catalog']
             recommender.vectorizer = model_data['vectorizer']
-            recommender.tfidf_matrix = model_data['tfidf_matrix']
-            recommender.product_keys = model_data['product_keys']
-            recommender.product_idx_map = model_data['product_idx_map']
+            recommender.tfidf_matrix = normalized_matrix(model_data['tfidf_matrix'])
+            recommender.build_product_arrays()
+            
+            if similarity_mode == 'neighbors':
+                # Reuse the neighbor index stored with the artifact when it is large enough
+                stored = model_data.get('neighbor_indices')
+                if stored is not None and stored.shape[1] >= num_neighbors:
+                    recommender.neighbor_indices = stored[:, :num_neighbors]
+                    recommender.neighbor_scores = model_data['neighbor_scores'][:, :num_neighbors]
+                else:
+                    recommender.build_neighbor_index(num_neighbors)
+                recommender.similarity_mode = 'neighbors'
+                
+                # Check the neighbor index against the exact path on sample carts
+                recall = recommender.neighbor_recall()
+                print(f"Neighbor index built with {num_neighbors} neighbors, recall@12: {recall:.3f}")
+            elif scoring_shards > 1:
+                # Shard workers map the artifact files themselves; a pickle has none to share
+                if os.path.isdir(filename):
+                    recommender.shards = ShardPool(
+                        filename, model_version, len(recommender.catalog), scoring_shards
+                    )
+                else:
+                    print(f"WARNING: Sharded scoring needs a model artifact directory, scoring {filename} in-process")
             
-            print(f"Model loaded successfully from {filename}")
+            recommender.signature = signature
+            recommender.loaded_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+            recommender.load_duration = time.perf_counter() - start_time
+            print(f"Model loaded successfully from {filename} (version {model_version})")
             return recommender
         except Exception as e:
             print(f"Error loading model: {e}")
             return None
 
-# Global variable to store the recommender model
+# Global variable to store the recommender model. Requests read it once and
+# keep their reference, so a reload only swaps it for new requests.
 recommender = None
 
-def load_recommender_model(model_path="recommender_model.pkl"):
+# Serializes background reloads
+reload_lock = threading.Lock()
+
+# Id of the last reload request this process has acted on. Workers forked from a
+# preloaded master inherit the one that was current when the master loaded its model.
+applied_reload = None
+
+def apply_sales(units):
+    """Add changed sales counts to the active model"""
+    model = recommender
+    if model is not None:
+        model.apply_sales(units)
+
+# Live units sold per product from completed orders not yet in the model's export,
+# added to the model's own counts
+sales_counters = SalesCounters(apply=apply_sales)
+
+# Background invoice pipeline used by /generate-invoice; SMS go through a durable outbox
+invoice_outbox = NotificationOutbox()
+invoice_jobs = InvoiceJobQueue(outbox=invoice_outbox)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    # Label by the route pattern, not the path, so job ids don't each become a series
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, route, str(response.status_code))
+    return response
+
+def model_metrics(model):
+    """Prometheus lines for the active model and its recommendation cache"""
+    if model is None:
+        return metrics.render_samples('recommender_model_loaded', 'Whether a model is loaded.', [({}, 0)])
+    
+    cache = model.cache.stats()
+    return (
+        metrics.render_samples('recommender_model_loaded', 'Whether a model is loaded.', [({}, 1)])
+        + metrics.render_samples('recommender_model_info', 'Version of the loaded model.',
+                               [({'version': model.model_version}, 1)])
+        + metrics.render_samples('recommender_model_load_duration_seconds', 'Time taken to load the active model.',
+                               [({}, model.load_duration)])
+        + metrics.render_samples('recommender_model_products', 'Products in the loaded catalog.',
+                               [({}, len(model.catalog))])
+        + metrics.render_samples('recommendation_cache_hits_total', 'Recommendation cache hits since the model loaded.',
+                               [({}, cache['hits'])], 'counter')
+        + metrics.render_samples('recommendation_cache_misses_total',
+                               'Recommendation cache misses since the model loaded.', [({}, cache['misses'])], 'counter')
+        + metrics.render_samples('recommendation_cache_entries', 'Entries in the recommendation cache.',
+                               [({}, cache['size'])])
+    )
+
+def record_order_sales(data):
+    """Queue the items of an invoiced order for the sales counts; never fails the invoice"""
+    try:
+        sales_counters.record(data.get('razorpay_order_id'), data.get('order_items'))
+    except queue.Full:
+        print(f"WARNING: Sales queue is full, order {data.get('razorpay_order_id')} is not counted")
+
+def admin_error(token):
+    """Error payload and status for an admin request carrying the given token, or None if it is allowed"""
+    # Fail closed: no configured token means nobody may call the admin endpoints
+    if not ADMIN_TOKEN:
+        return {'error': 'Admin endpoints are disabled; set ADMIN_TOKEN to enable them'}, 503
+    if not hmac.compare_digest((token or '').encode(), ADMIN_TOKEN.encode()):
+        return {'error': 'Unauthorized'}, 403
+    return None
+
+def json_response(payload):
+    """Same response as jsonify, with product records written from their cached JSON"""
+    return Response(serializer.encode(payload), mimetype='application/json')
+
+def load_recommender_model(model_path=MODEL_PATH):
     """Load the recommender model at application startup"""
-    global recommender
-    recommender = ProductRecommender.load_model(model_path)
+    global recommender, applied_reload
+    # Requests made before this load are covered by it
+    reload_request = read_reload_request()
+    applied_reload = reload_request['id'] if reload_request else None
+    candidate = ProductRecommender.load_model(model_path)
+    # Counts can't change between applying them and the swap
+    with sales_counters.apply_lock:
+        if candidate is not None:
+            candidate.apply_sales(sales_counters.since(candidate.sales_through))
+        recommender = candidate
     return recommender is not None
 
+def get_recommender():
+    """Return the active recommender, loading it on first use"""
+    if recommender is None:
+        load_recommender_model()
+    return recommender
+
+def check_recommender(candidate):
+    """Sanity-check a freshly loaded model before it serves traffic"""
+    if candidate is None or not candidate.catalog:
+        return False
+    
+    # Both the empty-cart and the similarity paths must return results
+    if not candidate.recommend([]):
+        return False
+    return bool(candidate.recommend([candidate.catalog.barcode(0)]))
+
+def reload_recommender_model(model_path=None):
+    """Build a new recommender and swap it in once it passes the checks"""
+    global recommender
+    with reload_lock:
+        model_path = model_path or (recommender.model_path if recommender else MODEL_PATH)
+        candidate = ProductRecommender.load_model(model_path)
+        if not check_recommender(candidate):
+            print(f"WARNING: Model from {model_path} failed validation, keeping the current model")
+            return False
+        
+        with sales_counters.apply_lock:
+            # Sales the new export already includes are no longer added; results cached
+            # by the checks predate the live counts
+            candidate.apply_sales(sales_counters.since(candidate.sales_through))
+            candidate.cache.clear()
+            previous = recommender
+            recommender = candidate
+        # Requests still holding the old model fall back to in-process scoring
+        if previous is not None and previous.shards is not None:
+            previous.shards.close()
+        print(f"Recommender model swapped to version {candidate.model_version}")
+        return True
+
+def model_signature(model_path):
+    """Modification time of the file that changes when a model is published"""
+    manifest_path = os.path.join(model_path, 'manifest.json')
+    try:
+        return os.path.getmtime(manifest_path if os.path.isdir(model_path) else model_path)
+    except OSError:
+        return None
+
+def read_reload_request():
+    """The latest /admin/reload-model request, or None if there has been none"""
+    try:
+        with open(MODEL_RELOAD_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_reload_request(model_path):
+    """Record a reload request for every worker's watcher and return its id"""
+    request_id = uuid.uuid4().hex
+    # Written aside and renamed, so a watcher never reads half a request
+    temporary_path = f'{MODEL_RELOAD_PATH}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump({'id': request_id, 'model_path': model_path, 'requested_at': time.time()}, f)
+    os.replace(temporary_path, MODEL_RELOAD_PATH)
+    return request_id
+
+def watched_signature(model_path):
+    """Signature the watcher compares against: that of the active model when it came from model_path"""
+    # A worker forked after the model was published starts with the master's older
+    # model and so catches up on its first poll
+    model = recommender
+    if model is not None and model.model_path == model_path and model.signature is not None:
+        return model.signature
+    return model_signature(model_path)
+
+def poll_model_updates(model_path, last_signature):
+    """Reload for a reload request this process hasn't acted on, or a model published
+    at model_path since last_signature; returns the signature to compare against next"""
+    global applied_reload
+    reload_request = read_reload_request()
+    if reload_request is not None and reload_request['id'] != applied_reload:
+        applied_reload = reload_request['id']
+        reload_recommender_model(reload_request.get('model_path'))
+    
+    signature = model_signature(model_path)
+    if signature is not None and signature != last_signature:
+        reload_recommender_model(model_path)
+        return signature
+    return last_signature
+
+def start_model_watcher(model_path=MODEL_PATH, interval=MODEL_WATCH_INTERVAL):
+    """Poll the model path and the reload requests, and reload in the background when either changes"""
+    if interval <= 0:
+        return None
+    
+    def watch():
+        last_signature = watched_signature(model_path)
+        while True:
+            last_signature = poll_model_updates(model_path, last_signature)
+            time.sleep(interval)
+    
+    watcher = threading.Thread(target=watch, name='model-watcher', daemon=True)
+    watcher.start()
+    return watcher
+
+# --------------- REQUEST HANDLING ---------------
+# Validation and response bodies shared by the routes below and the ASGI handlers in
+# asgi.py; each front end only decodes the request and runs the scoring its own way.
+
+class RequestError(Exception):
+    """A request that can't be served, answered with its message and status"""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def require_recommender():
+    """The active recommender; callers keep this reference even if a reload swaps it"""
+    model = get_recommender()
+    if model is None:
+        raise RequestError('Recommender model not available', 500)
+    return model
+
+def parse_recommend_request(data):
+    """(cart_barcodes, num_recommendations, session_id) of a /recommend body"""
+    if not data or 'cart_barcodes' not in data:
+        raise RequestError('Invalid request. Missing cart_barcodes field.')
+
+    cart_barcodes = data['cart_barcodes']
+    if not isinstance(cart_barcodes, list):
+        raise RequestError('cart_barcodes must be a list of strings')
+
+    num_recommendations = int(data.get('num_recommendations', 12))
+
+    # Cart session id (optional parameter); scans in one session reuse earlier scores
+    session_id = data.get('session_id')
+    if session_id is not None and not isinstance(session_id, str):
+        raise RequestError('session_id must be a string')
+    return cart_barcodes, num_recommendations, session_id
+
+def recommend_payload(cart_barcodes, recommendations):
+    return {
+        'success': True,
+        'cart_barcodes': cart_barcodes,
+        'num_recommendations': len(recommendations),
+        'recommendations': recommendations
+    }
+
+def parse_batch_request(data):
+    """(ids, carts, nums) of a /recommend/batch body, one entry per cart"""
+    if not data or not isinstance(data.get('requests'), list):
+        raise RequestError('Invalid request. Missing requests list.')
+
+    cart_requests = data['requests']
+    if len(cart_requests) > MAX_BATCH_SIZE:
+        raise RequestError(f'A batch can contain at most {MAX_BATCH_SIZE} carts')
+
+    default_num = int(data.get('num_recommendations', 12))
+    ids, carts, nums = [], [], []
+    for cart_request in cart_requests:
+        if not isinstance(cart_request, dict) or 'id' not in cart_request:
+            raise RequestError('Each request needs an id and a cart_barcodes list')
+        if not isinstance(cart_request.get('cart_barcodes'), list):
+            raise RequestError(f'cart_barcodes must be a list of strings (request {cart_request["id"]})')
+        ids.append(str(cart_request['id']))
+        carts.append(cart_request['cart_barcodes'])
+        nums.append(int(cart_request.get('num_recommendations', default_num)))
+
+    if len(set(ids)) != len(ids):
+        raise RequestError('Request ids must be unique')
+    return ids, carts, nums
+
+def batch_payload(ids, carts, batch_results):
+    """Recommendations keyed by request id"""
+    return {
+        'success': True,
+        'num_requests': len(ids),
+        'results': {
+            request_id: {
+                'cart_barcodes': cart,
+                'num_recommendations': len(recommendations),
+                'recommendations': recommendations
+            }
+            for request_id, cart, recommendations in zip(ids, carts, batch_results)
+        }
+    }
+
+def top_products_payload(top_products):
+    return {
+        'success': True,
+        'num_products': len(top_products),
+        'products': top_products
+    }
+
+def health_payload():
+    """Model, cache, outbox and sales state; reads the outbox from SQLite"""
+    model = recommender
+    return {
+        'status': 'healthy',
+        'model_loaded': model is not None,
+        'model_version': model.model_version if model else None,
+        'model_loaded_at': model.loaded_at if model else None,
+        'model_load_seconds': round(model.load_duration, 3) if model else None,
+        'cache': model.cache.stats() if model else None,
+        'invoice_outbox': invoice_outbox.stats(),
+        'sales': sales_counters.stats()
+    }
+
+def start_model_reload(token, data):
+    """(payload, status) of /admin/reload-model: starts loading a new model in the background"""
+    global applied_reload
+    error = admin_error(token)
+    if error:
+        return error
+
+    if reload_lock.locked():
+        return {'error': 'A model reload is already in progress'}, 409
+
+    # Only artifact directories can be loaded on request, never pickle files
+    model_path = (data or {}).get('model_path')
+    if model_path is not None and not os.path.isdir(model_path):
+        return {'error': 'model_path must be a model artifact directory'}, 400
+
+    # The other workers' watchers pick the request up; this one acts on it at once
+    applied_reload = write_reload_request(model_path)
+    threading.Thread(target=reload_recommender_model, args=(model_path,), daemon=True).start()
+
+    return {
+        'success': True,
+        'message': 'Model reload started',
+        'current_version': recommender.model_version if recommender else None
+    }, 202
+
+def ingest_sales_order(token, data):
+    """(payload, status) of /sales: queues a completed order's items for counting"""
+    error = admin_error(token)
+    if error:
+        return error
+
+    if not isinstance(data, dict) or not isinstance(data.get('order_items'), list):
+        return {'error': 'Invalid request. Missing order_items list.'}, 400
+    order_id = data.get('order_id')
+    if order_id is not None and not isinstance(order_id, str):
+        return {'error': 'order_id must be a string'}, 400
+
+    # Counted on the background flush; a repeated order id is counted once
+    try:
+        if not sales_counters.record(order_id, data['order_items']):
+            return {'error': 'order_items has no item with a product_barcode and a positive quantity'}, 400
+    except queue.Full:
+        return {'error': 'Sales queue is full, please retry shortly'}, 503
+
+    return {'success': True, 'message': 'Order queued for counting'}, 202
+
+def check_invoice_request(data):
+    if not data:
+        raise RequestError('Invalid request. Missing data.')
+
+    # Validate required fields
+    required_fields = ['userName', 'phone_number']
+    missing_fields = [field for field in required_fields if field not in data]
+    if missing_fields:
+        raise RequestError(f'Missing required fields: {", ".join(missing_fields)}')
+
+def invoice_queued_payload(job_id):
+    """Job id the caller polls for the download link"""
+    return {
+        'success': True,
+        'message': 'Invoice queued for generation',
+        'job_id': job_id,
+        'status_url': f'/invoice-jobs/{job_id}'
+    }
+
+def invoice_job_status(jobs, job_id):
+    """(payload, status) of /invoice-jobs/<job_id>; reads the job store and the outbox from SQLite"""
+    job = jobs.get(job_id)
+    if job is None:
+        return {'error': 'Invoice job not found'}, 404
+
+    # Delivery state of the SMS, which the outbox sends after the job is done
+    if job['sms_queued'] and job['order_id']:
+        job['sms'] = invoice_outbox.status(job['order_id'])
+        job['sms_sent'] = bool(job['sms']) and job['sms']['status'] == 'sent'
+
+    return {'success': True, **job}, 200
+
 @app.route('/recommend', methods=['POST'])
 def recommend_products():
     """API endpoint to get product recommendations based on cart items"""
     try:
-        # Get JSON data from request
-        data = request.get_json()
-        
-        # Validate input
-        if not data or 'cart_barcodes' not in data:
-            return jsonify({'error': 'Invalid request. Missing cart_barcodes field.'}), 400
-        
-        cart_barcodes = data['cart_barcodes']
-        
-        # Validate cart_barcodes is a list
-        if not isinstance(cart_barcodes, list):
-            return jsonify({'error': 'cart_barcodes must be a list of strings'}), 400
-        
-        # Get number of recommendations (optional parameter)
-        num_recommendations = int(data.get('num_recommendations', 12))
-        
-        # Check if model is loaded
-        global recommender
-        if recommender is None:
-            # Try to load the model
-            if not load_recommender_model():
-                return jsonify({'error': 'Recommender model not available'}), 500
-        
-        # Get recommendations
-        recommendations = recommender.recommend(cart_barcodes, num_recommendations)
-        
-        # Return recommendations as JSON
-        return jsonify({
-            'success': True,
-            'cart_barcodes': cart_barcodes,
-            'num_recommendations': len(recommendations),
-            'recommendations': recommendations
-        })
-        
+        cart_barcodes, num_recommendations, session_id = parse_recommend_request(request.get_json())
+        model = require_recommender()
+        recommendations = model.recommend(cart_barcodes, num_recommendations, session_id=session_id)
+        return json_response(recommend_payload(cart_barcodes, recommendations))
+
+    except RequestError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/recommend/batch', methods=['POST'])
+def recommend_products_batch():
+    """API endpoint to get recommendations for many carts in one call"""
+    try:
+        ids, carts, nums = parse_batch_request(request.get_json())
+        model = require_recommender()
+        batch_results = model.recommend_batch(carts, nums)
+        return json_response(batch_payload(ids, carts, batch_results))
+
+    except RequestError as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -231,95 +1146,84 @@ def recommend_products():
 def get_top_products():
     """API endpoint to get top selling products"""
     try:
-        # Get number of products (optional parameter)
         num_products = request.args.get('num', default=12, type=int)
-        
-        # Check if model is loaded
-        global recommender
-        if recommender is None:
-            # Try to load the model
-            if not load_recommender_model():
-                return jsonify({'error': 'Recommender model not available'}), 500
-        
-        # Get top selling products
-        top_products = recommender.get_top_selling_products(num_products)
-        
-        # Return top products as JSON
-        return jsonify({
-            'success': True,
-            'num_products': len(top_products),
-            'products': top_products
-        })
-        
+        model = require_recommender()
+        return json_response(top_products_payload(model.get_top_selling_products(num_products)))
+
+    except RequestError as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    global recommender
-    return jsonify({
-        'status': 'healthy',
-        'model_loaded': recommender is not None
-    })
+    return jsonify(health_payload())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Request, scoring and invoice timings plus model and cache state, in the Prometheus text format"""
+    return Response(metrics.render(model_metrics(recommender)), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/admin/reload-model', methods=['POST'])
+def reload_model():
+    """API endpoint to load a new model in the background and swap it in"""
+    payload, status = start_model_reload(request.headers.get('X-Admin-Token'), request.get_json(silent=True))
+    return jsonify(payload), status
+
+@app.route('/sales', methods=['POST'])
+def ingest_sales():
+    """API endpoint to count a completed order's items towards the top-selling ranking"""
+    payload, status = ingest_sales_order(request.headers.get('X-Admin-Token'), request.get_json(silent=True))
+    return jsonify(payload), status
 
 @app.route('/generate-invoice', methods=['POST'])
 def generate_invoice():
-    """API endpoint to generate and send invoice PDF"""
+    """API endpoint to queue invoice PDF generation and delivery"""
     try:
-        # Get JSON data from request
         data = request.get_json()
-        if not data:
-            return jsonify({'error': 'Invalid request. Missing data.'}), 400
-
-        # Validate required fields
-        required_fields = ['userName', 'phone_number']
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            return jsonify({'error': f'Missing required fields: {", ".join(missing_fields)}'}), 400
+        check_invoice_request(data)
 
-        # Generate the invoice PDF
+        # Rendering, upload and SMS run on the invoice workers
         try:
-            pdf_path = generate_invoice_pdf(data)
-        except Exception as e:
-            return jsonify({'error': f'Failed to generate PDF: {str(e)}'}), 500
+            job_id = invoice_jobs.submit(data)
+        except queue.Full:
+            return jsonify({'error': 'Invoice queue is full, please retry shortly'}), 503
 
-        # Upload the PDF to Dropbox
-        try:
-            dropbox_link = upload_to_dropbox(pdf_path)
-            if not dropbox_link:
-                return jsonify({'error': 'Failed to generate Dropbox link'}), 500
-        except Exception as e:
-            return jsonify({'error': f'Failed to upload to Dropbox: {str(e)}'}), 500
+        # The paid order's items count towards the top-selling ranking
+        record_order_sales(data)
 
-        # Send the invoice via Twilio
-        try:
-            if data.get('phone_number') and dropbox_link:
-                send_invoice_via_twilio(data['phone_number'], dropbox_link)
-        except Exception as e:
-            # Don't fail the whole request if SMS fails, just log the error
-            print(f"Warning: Failed to send SMS: {str(e)}")
-
-        # Return the file in the response
-        return jsonify({
-            'success': True,
-            'message': 'Invoice generated and sent successfully',
-            'download_link': dropbox_link
-        })
-        
+        return jsonify(invoice_queued_payload(job_id)), 202
+
+    except RequestError as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/invoice-jobs/<job_id>', methods=['GET'])
+def get_invoice_job(job_id):
+    """API endpoint to get the progress of a queued invoice"""
+    payload, status = invoice_job_status(invoice_jobs, job_id)
+    return jsonify(payload), status
+
 if __name__ == '__main__':
     # Load the model before starting the server
-    model_path = os.environ.get('MODEL_PATH', 'recommender_model.pkl')
-    
-    print(f"Loading recommender model from {model_path}...")
-    if load_recommender_model(model_path):
+    print(f"Loading recommender model from {MODEL_PATH}...")
+    if load_recommender_model(MODEL_PATH):
         print("Model loaded successfully!")
     else:
         print("WARNING: Failed to load model. API will attempt to load it on first request.")
     
+    # Reload automatically when a new model is published
+    start_model_watcher(MODEL_PATH, MODEL_WATCH_INTERVAL)
+    
+    # Resume invoices and send any SMS left behind by a previous run
+    invoice_jobs.start()
+    invoice_outbox.start()
+    
+    # Pick up the live sales counts and keep them flowing into the model
+    sales_counters.start()
+    
     # Get port from environment variable or use default
     port = int(os.environ.get('PORT', 5000))
     
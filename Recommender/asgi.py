@@ -0,0 +1,270 @@
+import asyncio
+import json
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs
+import app
+import metrics
+import serializer
+from invoice_jobs import AsyncInvoiceJobQueue, INVOICE_WORKERS
+from metrics import REQUEST_SECONDS
+
+# Async variant of the API in app.py for I/O-bound traffic, served by any ASGI server:
+#   uvicorn asgi:application --host 0.0.0.0 --port 5000
+# Scoring runs on a bounded thread pool; invoice delivery runs on the event loop, so
+# pending uploads and SMS wait on sockets rather than on a thread each.
+
+# --------------- CONFIGURATION ---------------
+# Threads that run recommendation scoring, and the requests allowed to wait or run
+# on them before new ones are turned away with a 503
+SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS', os.cpu_count() or 1))
+SCORING_QUEUE_LIMIT = int(os.environ.get('SCORING_QUEUE_LIMIT', 64))
+
+# Same CORS policy as flask-cors' defaults in app.py
+CORS_METHODS = 'DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT'
+
+scoring_executor = ThreadPoolExecutor(SCORING_WORKERS, thread_name_prefix='scoring')
+scoring_pending = 0
+
+# Invoices render on their own threads so they never hold up scoring; SMS go through the shared outbox
+render_executor = ThreadPoolExecutor(INVOICE_WORKERS, thread_name_prefix='invoice-render')
+invoice_jobs = AsyncInvoiceJobQueue(outbox=app.invoice_outbox, executor=render_executor)
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers read"""
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = parse_qs(scope['query_string'].decode('latin-1'))
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        self.body = body
+
+    def get_json(self):
+        """Decoded JSON body, or None if it is missing or malformed"""
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+async def run_scoring(func, *args, **kwargs):
+    """Run CPU-bound scoring off the event loop; raises queue.Full when the backlog is at its limit"""
+    global scoring_pending
+    if scoring_pending >= SCORING_QUEUE_LIMIT:
+        raise queue.Full
+    scoring_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(scoring_executor, partial(func, *args, **kwargs))
+    finally:
+        scoring_pending -= 1
+
+async def run_blocking(func, *args):
+    """Run a blocking call, such as a SQLite read, on the loop's default executor"""
+    return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args))
+
+async def recommend_products(request):
+    """API endpoint to get product recommendations based on cart items"""
+    try:
+        cart_barcodes, num_recommendations, session_id = app.parse_recommend_request(request.get_json())
+        model = app.require_recommender()
+        recommendations = await run_scoring(model.recommend, cart_barcodes, num_recommendations,
+                                            session_id=session_id)
+        return app.recommend_payload(cart_barcodes, recommendations), 200
+
+    except app.RequestError as e:
+        return {'error': str(e)}, e.status
+    except queue.Full:
+        return {'error': 'Recommender is busy, please retry shortly'}, 503
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+async def recommend_products_batch(request):
+    """API endpoint to get recommendations for many carts in one call"""
+    try:
+        ids, carts, nums = app.parse_batch_request(request.get_json())
+        model = app.require_recommender()
+        batch_results = await run_scoring(model.recommend_batch, carts, nums)
+        return app.batch_payload(ids, carts, batch_results), 200
+
+    except app.RequestError as e:
+        return {'error': str(e)}, e.status
+    except queue.Full:
+        return {'error': 'Recommender is busy, please retry shortly'}, 503
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+async def get_top_products(request):
+    """API endpoint to get top selling products"""
+    try:
+        # Falls back to the default on a malformed value, like Flask's request.args.get(type=int)
+        try:
+            num_products = int(request.args.get('num', ['12'])[0])
+        except ValueError:
+            num_products = 12
+
+        model = app.require_recommender()
+        top_products = await run_scoring(model.get_top_selling_products, num_products)
+        return app.top_products_payload(top_products), 200
+
+    except app.RequestError as e:
+        return {'error': str(e)}, e.status
+    except queue.Full:
+        return {'error': 'Recommender is busy, please retry shortly'}, 503
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+async def health_check(request):
+    """Health check endpoint"""
+    return await run_blocking(app.health_payload), 200
+
+async def reload_model(request):
+    """API endpoint to load a new model in the background and swap it in"""
+    return app.start_model_reload(request.headers.get('x-admin-token'), request.get_json())
+
+async def ingest_sales(request):
+    """API endpoint to count a completed order's items towards the top-selling ranking"""
+    return app.ingest_sales_order(request.headers.get('x-admin-token'), request.get_json())
+
+async def generate_invoice(request):
+    """API endpoint to queue invoice PDF generation and delivery"""
+    try:
+        data = request.get_json()
+        app.check_invoice_request(data)
+
+        # Rendering, upload and SMS run as a task on this event loop
+        try:
+            job_id = await invoice_jobs.submit(data)
+        except queue.Full:
+            return {'error': 'Invoice queue is full, please retry shortly'}, 503
+
+        # The paid order's items count towards the top-selling ranking
+        app.record_order_sales(data)
+
+        return app.invoice_queued_payload(job_id), 202
+
+    except app.RequestError as e:
+        return {'error': str(e)}, e.status
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+async def get_invoice_job(request, job_id):
+    """API endpoint to get the progress of a queued invoice"""
+    return await run_blocking(app.invoice_job_status, invoice_jobs, job_id)
+
+async def get_metrics(request):
+    """Request, scoring and invoice timings plus model and cache state, in the Prometheus text format"""
+    return metrics.render(app.model_metrics(app.recommender)), 200
+
+ROUTES = {
+    '/recommend': ('POST', recommend_products),
+    '/recommend/batch': ('POST', recommend_products_batch),
+    '/top-products': ('GET', get_top_products),
+    '/health': ('GET', health_check),
+    '/metrics': ('GET', get_metrics),
+    '/admin/reload-model': ('POST', reload_model),
+    '/sales': ('POST', ingest_sales),
+    '/generate-invoice': ('POST', generate_invoice)
+}
+
+def find_route(path):
+    """Return (route pattern, method, handler, path parameters) for the path, or None"""
+    prefix = '/invoice-jobs/'
+    if path.startswith(prefix) and '/' not in path[len(prefix):] and len(path) > len(prefix):
+        return '/invoice-jobs/<job_id>', 'GET', get_invoice_job, {'job_id': path[len(prefix):]}
+    if path in ROUTES:
+        return (path,) + ROUTES[path] + ({},)
+    return None
+
+async def send_response(send, status, payload=None, headers=(), include_body=True):
+    """Send a JSON response serialized the way Flask's jsonify does, or a text one for a str payload"""
+    body = b''
+    response_headers = [(b'access-control-allow-origin', b'*')]
+    if isinstance(payload, str):
+        body = payload.encode()
+        response_headers.append((b'content-type', metrics.CONTENT_TYPE.encode()))
+    elif payload is not None:
+        body = serializer.encode(payload)
+        response_headers.append((b'content-type', b'application/json'))
+    response_headers.append((b'content-length', str(len(body)).encode()))
+    response_headers.extend(headers)
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body if include_body else b''})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Load the model before the server accepts requests
+            print(f"Loading recommender model from {app.MODEL_PATH}...")
+            if app.load_recommender_model(app.MODEL_PATH):
+                print("Model loaded successfully!")
+            else:
+                print("WARNING: Failed to load model. API will attempt to load it on first request.")
+
+            # Reload automatically when a new model is published, resume invoices and send
+            # any SMS left behind by a previous run, and keep the live sales counts flowing
+            # into the model
+            app.start_model_watcher(app.MODEL_PATH, app.MODEL_WATCH_INTERVAL)
+            invoice_jobs.start()
+            app.invoice_outbox.start()
+            app.sales_counters.start()
+            metrics.STORE.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Let in-flight invoices finish their upload and SMS before the process exits
+            await invoice_jobs.close()
+            await run_blocking(app.invoice_outbox.stop)
+            scoring_executor.shutdown(wait=False)
+            render_executor.shutdown(wait=False)
+            if app.recommender is not None and app.recommender.shards is not None:
+                app.recommender.shards.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    # Read the whole request body
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    request = Request(scope, b''.join(chunks))
+
+    # Label by the route pattern, not the path, so job ids don't each become a series
+    start = time.perf_counter()
+    route = find_route(request.path)
+    status = await handle(request, route, send)
+    REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, route[0] if route else 'unmatched', str(status))
+
+async def handle(request, route, send):
+    """Dispatch the request to its handler and return the response status"""
+    if route is None:
+        await send_response(send, 404, {'error': 'Not found'})
+        return 404
+    _, method, handler, params = route
+
+    # CORS preflight
+    if request.method == 'OPTIONS':
+        headers = [(b'access-control-allow-methods', CORS_METHODS.encode())]
+        if 'access-control-request-headers' in request.headers:
+            headers.append((b'access-control-allow-headers',
+                            request.headers['access-control-request-headers'].encode('latin-1')))
+        await send_response(send, 200, headers=headers)
+        return 200
+
+    if request.method != method and not (request.method == 'HEAD' and method == 'GET'):
+        await send_response(send, 405, {'error': 'Method not allowed'}, [(b'allow', method.encode())])
+        return 405
+
+    payload, status = await handler(request, **params)
+    await send_response(send, status, payload, include_body=request.method != 'HEAD')
+    return status
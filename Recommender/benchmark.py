@@ -0,0 +1,290 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import scipy
+import sklearn
+import send_invoice
+from app import NUM_NEIGHBORS, ProductRecommender
+from benchmark_invoice import sample_order
+from build_model import build_full
+from model_store import save_model_artifact
+
+# --------------- CONFIGURATION ---------------
+# Synthetic catalogs are written here once per size and seed, then reused
+BENCHMARK_DATA_DIR = os.getenv('BENCHMARK_DATA_DIR', 'benchmark_data')
+
+# Results format; bump when the meaning of a field changes so old baselines aren't compared
+RESULTS_VERSION = 1
+
+# Shape of the synthetic catalog: categories, their sub-categories and word pools
+NUM_CATEGORIES = 24
+SUB_CATEGORIES_PER_CATEGORY = 5
+CATEGORY_WORDS = 400
+SHARED_WORDS = 3000
+NUM_BRANDS = 2000
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ne', 'su', 'to', 'vi', 'pa', 'de', 'fo', 'gu', 'hi', 'ja', 'be', 'zo',
+             'ti', 'mu', 'sa', 're', 'no', 'la', 'ku', 'po']
+
+def make_words(rng, count, prefix=''):
+    """Distinct pseudo-words of two to four syllables"""
+    words = set()
+    while len(words) < count:
+        words.add(prefix + ''.join(rng.choice(SYLLABLES, rng.integers(2, 5))))
+    return sorted(words)
+
+def synthetic_catalog(num_products, seed=0):
+    """Returns (product_data, product_keys) for a reproducible catalog of the given size"""
+    rng = np.random.default_rng(seed)
+    shared_words = make_words(rng, SHARED_WORDS)
+    brands = [word.capitalize() for word in make_words(rng, NUM_BRANDS, 'x')]
+    categories = []
+    for c in range(NUM_CATEGORIES):
+        words = make_words(rng, CATEGORY_WORDS, f'c{c}')
+        sub_categories = [f'Sub Category {c}-{s}' for s in range(SUB_CATEGORIES_PER_CATEGORY)]
+        categories.append((f'category {c}', sub_categories, words))
+
+    # Popular categories and words come up more often, as in a real catalog
+    category_choice = rng.zipf(1.3, num_products) % NUM_CATEGORIES
+    sub_category_choice = rng.integers(0, SUB_CATEGORIES_PER_CATEGORY, num_products)
+    brand_choice = rng.integers(0, NUM_BRANDS, num_products)
+    name_lengths = rng.integers(3, 9, num_products)
+    description_lengths = rng.integers(4, 16, num_products)
+    units_sold = (rng.pareto(1.2, num_products) * 50).astype(np.int64)
+    prices = np.round(rng.lognormal(5.5, 1.0, num_products))
+
+    product_data = {}
+    product_keys = []
+    for i in range(num_products):
+        category, sub_categories, words = categories[category_choice[i]]
+        category_words = rng.choice(words, name_lengths[i])
+        extra_words = rng.choice(shared_words, description_lengths[i])
+        name = ' '.join([brands[brand_choice[i]], *category_words])
+        barcode = f'{900000000000 + i}'
+        product_keys.append(barcode)
+        product_data[barcode] = {
+            'name': name,
+            'price': int(prices[i]),
+            'description': f"{name} {' '.join(extra_words)}",
+            'category': category,
+            'sub_category': sub_categories[sub_category_choice[i]],
+            'units_sold': int(units_sold[i]),
+            'imageUrl': f'https://example.com/images/{barcode}.jpg',
+            'barcode': barcode,
+            'stock_quantity': 100
+        }
+    return product_data, product_keys
+
+def catalog_artifact(num_products, seed=0, data_dir=BENCHMARK_DATA_DIR):
+    """Path of the model artifact for a synthetic catalog, building it on first use"""
+    path = os.path.join(data_dir, f'catalog_{num_products}_{seed}')
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+        return path
+
+    print(f"Building synthetic catalog of {num_products} products in {path}...")
+    start = time.perf_counter()
+    product_data, product_keys = synthetic_catalog(num_products, seed)
+    product_data, product_keys, vectorizer, tfidf_matrix = build_full(
+        [[product_data[barcode] for barcode in product_keys]]
+    )
+    os.makedirs(data_dir, exist_ok=True)
+    save_model_artifact(path, product_data, product_keys, vectorizer, tfidf_matrix,
+                        model_version=f'synthetic-{num_products}-{seed}')
+    print(f"Built in {time.perf_counter() - start:.1f} s ({tfidf_matrix.shape[1]} terms)")
+    return path
+
+def sample_carts(recommender, cart_size, count, seed=0):
+    """Random carts of catalog barcodes, the same for every run with the same seed"""
+    rng = np.random.default_rng(seed + cart_size)
+    keys = recommender.catalog.barcodes.tolist()
+    return [[keys[i] for i in rng.choice(len(keys), cart_size, replace=False)] for _ in range(count)]
+
+def measure(name, params, func, inputs, iterations, max_seconds, rounds):
+    """Time func over the inputs (cycling) and return a result record with latency, throughput and memory"""
+    # Warm up caches, lazy imports and the page cache of memory-mapped arrays
+    for value in inputs[:3]:
+        func(value)
+
+    # The calls are split into rounds; the best round median is the figure least
+    # disturbed by other load on the machine, and the one compared between runs
+    latencies = []
+    round_medians = []
+    elapsed = 0
+    for _ in range(rounds):
+        round_latencies = []
+        start = time.perf_counter()
+        while len(round_latencies) < iterations // rounds and time.perf_counter() - start < max_seconds / rounds:
+            value = inputs[len(round_latencies) % len(inputs)]
+            call_start = time.perf_counter()
+            func(value)
+            round_latencies.append(time.perf_counter() - call_start)
+        elapsed += time.perf_counter() - start
+        round_medians.append(np.median(round_latencies))
+        latencies.extend(round_latencies)
+
+    # Peak memory in a separate pass; tracing slows every allocation down
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for value in inputs[:3]:
+        func(value)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    result = {
+        'name': name,
+        'params': params,
+        'iterations': len(latencies),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 6),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 6),
+        'mean_ms': round(float(latencies.mean()) * 1000, 6),
+        'best_round_p50_ms': round(float(min(round_medians)) * 1000, 6),
+        'ops_per_sec': round(len(latencies) / elapsed, 2),
+        'peak_memory_kib': round(peak / 1024, 1)
+    }
+    print(f"{result_key(result):<48} p50 {result['p50_ms']:>9.3f} ms   p99 {result['p99_ms']:>9.3f} ms   "
+          f"{result['ops_per_sec']:>9.1f}/s   peak {result['peak_memory_kib']:>10.1f} KiB")
+    return result
+
+def result_key(result):
+    """Identifies a measurement across runs, e.g. recommend[products=10000,cart_size=3]"""
+    params = ','.join(f'{key}={value}' for key, value in sorted(result['params'].items()))
+    return f"{result['name']}[{params}]"
+
+def environment():
+    """Where the results came from, so runs on different machines aren't mistaken for regressions"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'scikit_learn': sklearn.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count()
+    }
+
+def run_benchmarks(args):
+    results = []
+    for num_products in args.sizes:
+        path = catalog_artifact(num_products, args.seed, args.data_dir)
+
+        load_inputs = [path] * args.load_iterations
+        results.append(measure('load_model', {'products': num_products}, ProductRecommender.load_model,
+                               load_inputs, args.load_iterations, args.max_seconds, 1))
+
+        # Scoring is measured uncached; every call runs the full pipeline
+        recommender = ProductRecommender.load_model(path)
+        recommender.cache.max_entries = 0
+        for cart_size in args.cart_sizes:
+            carts = sample_carts(recommender, cart_size, args.carts, args.seed)
+            results.append(measure('recommend', {'products': num_products, 'cart_size': cart_size},
+                                   recommender.recommend, carts, args.iterations, args.max_seconds, args.rounds))
+
+        # Neighbor-index mode, measured with the recall@12 it keeps against the exact path on the same carts
+        if args.num_neighbors > 0:
+            neighbors = ProductRecommender.load_model(path, similarity_mode='neighbors',
+                                                      num_neighbors=args.num_neighbors)
+            neighbors.cache.max_entries = 0
+            for cart_size in args.cart_sizes:
+                carts = sample_carts(neighbors, cart_size, args.carts, args.seed)
+                result = measure('recommend_neighbors', {'products': num_products, 'cart_size': cart_size,
+                                                         'neighbors': args.num_neighbors},
+                                 neighbors.recommend, carts, args.iterations, args.max_seconds, args.rounds)
+                result['neighbor_recall'] = round(neighbors.neighbor_recall(carts), 4)
+                print(f"{'':<48} recall@12 {result['neighbor_recall']:.4f}")
+                results.append(result)
+
+        results.append(measure('get_top_selling_products', {'products': num_products},
+                               recommender.get_top_selling_products, [12], args.iterations, args.max_seconds,
+                               args.rounds))
+
+    for lines in args.invoice_lines:
+        results.append(measure('generate_invoice_pdf', {'lines': lines}, send_invoice.generate_invoice_pdf,
+                               [sample_order(lines)], args.iterations, args.max_seconds, args.rounds))
+    return results
+
+def compare(results, baseline, threshold, p99_threshold, recall_threshold):
+    """Print the change against a baseline run and return the keys that regressed"""
+    previous = {result_key(result): result for result in baseline['results']}
+    regressions = []
+    # Runs outside a git checkout have no commit to name
+    commit = baseline['environment'].get('commit') or 'an unknown commit'
+    created_at = baseline['environment'].get('created_at') or 'an unknown date'
+    print(f"\nCompared with {commit} from {created_at}:")
+    for result in results:
+        key = result_key(result)
+        old = previous.get(key)
+        if old is None:
+            print(f"{key:<48} (new)")
+            continue
+        change = result['best_round_p50_ms'] / old['best_round_p50_ms'] - 1
+        p99_change = result['p99_ms'] / old['p99_ms'] - 1
+        regressed = change > threshold or p99_change > p99_threshold
+        # A faster neighbor index that finds fewer of the exact recommendations is a regression too
+        recall = ''
+        if 'neighbor_recall' in old:
+            recall_change = result['neighbor_recall'] - old['neighbor_recall']
+            regressed = regressed or -recall_change > recall_threshold
+            recall = f"   recall {old['neighbor_recall']:.4f} -> {result['neighbor_recall']:.4f}"
+        if regressed:
+            regressions.append(key)
+        print(f"{key:<48} p50 {old['best_round_p50_ms']:>9.3f} -> {result['best_round_p50_ms']:>9.3f} ms "
+              f"({change:+7.1%})   p99 {p99_change:+7.1%}{recall}{'   REGRESSION' if regressed else ''}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the recommender and invoice hot paths in-process')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Synthetic catalog sizes (products); 1000000 works but takes a while to build')
+    parser.add_argument('--cart-sizes', type=int, nargs='+', default=[1, 3, 10, 30], help='Items per cart')
+    parser.add_argument('--num-neighbors', type=int, default=NUM_NEIGHBORS,
+                        help='Neighbors per product in the neighbor-index measurements (0 skips them)')
+    parser.add_argument('--invoice-lines', type=int, nargs='+', default=[5, 50, 500], help='Order lines per invoice')
+    parser.add_argument('--carts', type=int, default=100, help='Distinct carts per cart size')
+    parser.add_argument('--iterations', type=int, default=300, help='Calls per measurement')
+    parser.add_argument('--rounds', type=int, default=5, help='Rounds the calls of a measurement are split into')
+    parser.add_argument('--load-iterations', type=int, default=5, help='Model loads per catalog size')
+    parser.add_argument('--max-seconds', type=float, default=10.0, help='Time limit per measurement')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic catalogs and carts')
+    parser.add_argument('--data-dir', default=BENCHMARK_DATA_DIR, help='Where synthetic catalogs are kept')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Baseline results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Relative slowdown of the best round p50 reported as a regression (exit status 1)')
+    parser.add_argument('--p99-threshold', type=float, default=0.5,
+                        help='Relative slowdown of the p99 reported as a regression; it is noisier than the p50, '
+                             'so the default is looser')
+    parser.add_argument('--recall-threshold', type=float, default=0.01,
+                        help='Drop of the neighbor index recall@12 (absolute) reported as a regression')
+    args = parser.parse_args()
+
+    # The measured functions print a line per call; keep the report readable
+    import app
+    import model_store
+    app.print = model_store.print = send_invoice.print = lambda *args, **kwargs: None
+
+    results = run_benchmarks(args)
+    report = {'version': RESULTS_VERSION, 'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != RESULTS_VERSION:
+            raise SystemExit(f"Baseline uses results format {baseline.get('version')}, expected {RESULTS_VERSION}")
+        if compare(results, baseline, args.threshold, args.p99_threshold, args.recall_threshold):
+            raise SystemExit(1)
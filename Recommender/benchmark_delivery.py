@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import dropbox
+import dropbox.dropbox_client
+import requests
+import twilio.http.http_client
+from twilio.rest import Client
+import send_invoice
+from benchmark_invoice import sample_order
+from invoice_jobs import InvoiceJobQueue, AsyncInvoiceJobQueue
+
+# Stand-in metadata returned by the fake Dropbox endpoints
+FILE_METADATA = {
+    'name': 'invoice.pdf',
+    'id': 'id:benchmark',
+    'client_modified': '2026-01-01T00:00:00Z',
+    'server_modified': '2026-01-01T00:00:00Z',
+    'rev': '0123456789abcdef',
+    'size': 1,
+    'path_lower': '/invoice.pdf',
+    'path_display': '/invoice.pdf'
+}
+SHARED_LINK = dict(FILE_METADATA, **{
+    '.tag': 'file',
+    'url': 'https://www.dropbox.com/s/benchmark/invoice.pdf?dl=0',
+    'link_permissions': {
+        'can_revoke': True, 'visibility_policies': [], 'can_set_expiry': False, 'can_remove_expiry': False,
+        'allow_download': True, 'can_allow_download': True, 'can_disallow_download': False,
+        'allow_comments': False, 'team_restricts_comments': False
+    }
+})
+FAKE_RESPONSES = {
+    '/2/files/upload': (200, FILE_METADATA),
+    '/2/sharing/create_shared_link_with_settings': (200, SHARED_LINK),
+    '/2/sharing/list_shared_links': (200, {'links': [], 'has_more': False}),
+    'Messages.json': (201, {'sid': 'SMbenchmark', 'status': 'queued'}),
+    '/': (404, {})
+}
+
+class FakeServer(ThreadingHTTPServer):
+    """Local HTTP server that adds a handshake delay per connection and a delay per request"""
+    daemon_threads = True
+    # Room for the bursts of connections the async pipeline opens
+    request_queue_size = 256
+
+    def __init__(self, connect_delay, request_delay):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.connect_delay = connect_delay
+        self.request_delay = request_delay
+        self.connections = 0
+        self.requests = 0
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Stands in for the TCP and TLS handshakes of a new connection
+        self.server.connections += 1
+        time.sleep(self.server.connect_delay)
+
+    def respond(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests += 1
+        time.sleep(self.server.request_delay)
+        path = urlsplit(self.path).path
+        key = next((key for key in FAKE_RESPONSES if path.endswith(key)), '/')
+        status, body = FAKE_RESPONSES[key]
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    do_POST = do_GET = do_HEAD = respond
+
+    def log_message(self, *args):
+        pass
+
+class LocalAdapter(requests.adapters.HTTPAdapter):
+    """Sends requests for the real API hosts to the matching fake server"""
+    def __init__(self, servers, **kwargs):
+        super().__init__(**kwargs)
+        self.servers = servers
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        server = self.servers[url.hostname]
+        request.url = url._replace(scheme='http', netloc=f'127.0.0.1:{server.server_port}').geturl()
+        return super().send(request, **kwargs)
+
+def route_sessions_to(servers):
+    """Makes every session the Dropbox and Twilio SDKs create talk to the fake servers"""
+    def create_session(max_connections=8, proxies=None, ca_certs=None):
+        session = requests.Session()
+        session.mount('https://', LocalAdapter(servers, pool_maxsize=max_connections))
+        return session
+
+    def create_twilio_adapter(**kwargs):
+        return LocalAdapter(servers, **kwargs)
+
+    dropbox.create_session = dropbox.dropbox_client.create_session = create_session
+    twilio.http.http_client.HTTPAdapter = create_twilio_adapter
+
+def previous_upload_to_dropbox(pdf_bytes, file_name):
+    """Upload as done before pooling: a new client per call and a link lookup before creating one"""
+    dbx = dropbox.Dropbox(send_invoice.DROPBOX_ACCESS_TOKEN)
+    dropbox_path = f"/{file_name}"
+    dbx.files_upload(pdf_bytes, dropbox_path, mode=dropbox.files.WriteMode("overwrite"))
+    shared_links = dbx.sharing_list_shared_links(path=dropbox_path).links
+    if shared_links:
+        shared_link = shared_links[0].url
+    else:
+        shared_link = dbx.sharing_create_shared_link_with_settings(dropbox_path).url
+    return shared_link.replace("?dl=0", "?dl=1")
+
+def previous_send_invoice_via_twilio(phone_number, dropbox_link):
+    """SMS as sent before pooling: a new client per call"""
+    client = Client(send_invoice.account_sid, send_invoice.auth_token)
+    client.messages.create(messaging_service_sid=send_invoice.messaging_service_sid,
+                           body=f'Your invoice can be downloaded at: {dropbox_link}', to=f'+91{phone_number}')
+    return True
+
+def deliver(data, upload, notify, warm_up=None):
+    """Renders and delivers one invoice, returning the wall-clock time in seconds"""
+    start = time.perf_counter()
+    if warm_up:
+        threading.Thread(target=warm_up, daemon=True).start()
+    pdf_name, pdf_bytes = send_invoice.generate_invoice_pdf(data)
+    link = upload(pdf_bytes, pdf_name)
+    notify(data['phone_number'], link)
+    return time.perf_counter() - start
+
+def run(name, invoices, data, upload, notify, warm_up=None, servers=()):
+    connections = sum(server.connections for server in servers)
+    requests_sent = sum(server.requests for server in servers)
+    times = [deliver(data, upload, notify, warm_up) for _ in range(invoices)]
+    steady = sorted(times[1:]) or times
+    print(f"{name:<24} first {times[0] * 1000:7.1f} ms   steady p50 {steady[len(steady) // 2] * 1000:7.1f} ms   "
+          f"connections {sum(s.connections for s in servers) - connections:3d}   "
+          f"requests {sum(s.requests for s in servers) - requests_sent:3d}")
+
+def run_burst(name, invoices, deliver_all, servers=()):
+    """Delivers a burst of invoices submitted at once and reports how long the last one took"""
+    connections = sum(server.connections for server in servers)
+    start = time.perf_counter()
+    stats = deliver_all()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {invoices} invoices in {elapsed:6.2f} s ({invoices / elapsed:6.1f}/s)   "
+          f"completed {stats['completed']:4d}   failed {stats['failed']:3d}   "
+          f"connections {sum(s.connections for s in servers) - connections:3d}")
+
+def threaded_burst(invoices, data, workers):
+    """Delivers the burst on the thread pool pipeline used by app.py"""
+    # An in-memory job store, so jobs of earlier runs don't show up in the stats
+    jobs = InvoiceJobQueue(workers=workers, queue_size=invoices, warm_up=None, path=':memory:')
+    for _ in range(invoices):
+        jobs.submit(data)
+    jobs.pending.join()
+    return jobs.stats()
+
+def async_burst(invoices, data, workers):
+    """Delivers the burst on the event loop pipeline used by asgi.py"""
+    async def deliver_all():
+        jobs = AsyncInvoiceJobQueue(executor=ThreadPoolExecutor(workers), limit=invoices, path=':memory:')
+        for _ in range(invoices):
+            await jobs.submit(data)
+        await jobs.close(timeout=None)
+        return jobs.stats()
+    return asyncio.run(deliver_all())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure invoice delivery against local fake Dropbox and Twilio servers')
+    parser.add_argument('--invoices', type=int, default=20, help='Invoices delivered per variant')
+    parser.add_argument('--lines', type=int, default=5, help='Order lines per invoice')
+    parser.add_argument('--connect-delay', type=float, default=0.05, help='Seconds added to every new connection')
+    parser.add_argument('--request-delay', type=float, default=0.02, help='Seconds added to every request')
+    parser.add_argument('--burst', type=int, default=0,
+                        help='Also deliver this many invoices at once on the threaded and async pipelines')
+    parser.add_argument('--workers', type=int, default=4, help='Invoice worker (or render) threads in the burst')
+    args = parser.parse_args()
+
+    hosts = ['content.dropboxapi.com', 'api.dropboxapi.com', 'api.twilio.com']
+    servers = {host: FakeServer(args.connect_delay, args.request_delay) for host in hosts}
+    for server in servers.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    route_sessions_to(servers)
+
+    send_invoice.DROPBOX_ACCESS_TOKEN = 'benchmark-token'
+    send_invoice.account_sid = 'ACbenchmark'
+    send_invoice.auth_token = 'benchmark-token'
+    send_invoice.messaging_service_sid = 'MGbenchmark'
+
+    # The invoice functions print a line per call; keep the report readable
+    send_invoice.print = lambda *args, **kwargs: None
+
+    data = sample_order(args.lines)
+    run('new client per invoice', args.invoices, data, previous_upload_to_dropbox,
+        previous_send_invoice_via_twilio, servers=servers.values())
+    run('pooled clients', args.invoices, data, send_invoice.upload_to_dropbox,
+        send_invoice.send_invoice_via_twilio, servers=servers.values())
+    send_invoice.reset_clients()
+    run('pooled + warm-up', args.invoices, data, send_invoice.upload_to_dropbox,
+        send_invoice.send_invoice_via_twilio, send_invoice.warm_up_connections, servers=servers.values())
+
+    if args.burst:
+        # The async pipeline talks to the hosts directly rather than through the SDK sessions
+        for host, server in servers.items():
+            url = f'http://127.0.0.1:{server.server_port}/'
+            if host == 'content.dropboxapi.com':
+                send_invoice.DROPBOX_CONTENT_URL = url
+            elif host == 'api.dropboxapi.com':
+                send_invoice.DROPBOX_API_URL = url
+            else:
+                send_invoice.TWILIO_API_URL = url
+        run_burst(f'threaded ({args.workers} workers)', args.burst,
+                  lambda: threaded_burst(args.burst, data, args.workers), servers.values())
+        run_burst('async', args.burst, lambda: async_burst(args.burst, data, args.workers), servers.values())
@@ -0,0 +1,42 @@
+import argparse
+import time
+from send_invoice import render_invoice
+
+def sample_order(num_items):
+    """Returns invoice data with the given number of order lines"""
+    items = [
+        {"product_name": f"Sample Product {i}", "quantity": i % 5 + 1, "price": 20 + (i * 37) % 480}
+        for i in range(num_items)
+    ]
+    return {
+        "userName": "Benchmark User",
+        "phone_number": "9999999999",
+        "razorpay_order_id": "order_benchmark",
+        "razorpay_payment_id": "pay_benchmark",
+        "payment_status": "completed",
+        "amount": sum(item["price"] * item["quantity"] for item in items),
+        "order_items": items
+    }
+
+def invoices_per_second(data, use_template, seconds):
+    """Renders the invoice repeatedly for about the given time and returns the rate"""
+    render_invoice(data, use_template)  # warm up (and fill the template cache)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        render_invoice(data, use_template)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare invoice rendering with and without the cached template')
+    parser.add_argument('--lines', type=int, nargs='+', default=[5, 50, 500], help='Order sizes to render')
+    parser.add_argument('--seconds', type=float, default=3.0, help='Time spent on each measurement')
+    args = parser.parse_args()
+
+    print(f"{'lines':>6} {'direct/s':>10} {'template/s':>11} {'speedup':>8}")
+    for num_items in args.lines:
+        data = sample_order(num_items)
+        direct = invoices_per_second(data, False, args.seconds)
+        template = invoices_per_second(data, True, args.seconds)
+        print(f"{num_items:>6} {direct:>10.1f} {template:>11.1f} {template / direct:>7.2f}x")
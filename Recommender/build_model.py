@@ -0,0 +1,350 @@
+import argparse
+import csv
+import json
+import os
+import time
+from collections import Counter
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfTransformer, TfidfVectorizer
+from model_store import MANIFEST_FILE, load_model_artifact, save_model_artifact
+
+# Builds the recommender model artifact from a product catalog export (CSV or
+# JSONL with the fields of the BACKEND product model). A running service picks
+# the new artifact up through its model watcher or /admin/reload-model.
+
+# --------------- CONFIGURATION ---------------
+# Export rows read and vectorized at a time
+BUILD_CHUNK_SIZE = int(os.getenv('BUILD_CHUNK_SIZE', 10000))
+
+# Vectorizer settings of the production model
+VECTORIZER_PARAMS = {
+    'stop_words': 'english', 'ngram_range': (1, 3), 'min_df': 2, 'max_df': 0.9, 'sublinear_tf': True
+}
+
+# An incremental update keeps the vocabulary and idf weights of the last full build.
+# It falls back to a full rebuild when the share of vocabulary terms a refit would add
+# or drop, or the mean relative change of the idf weights, exceeds these limits...
+MAX_VOCABULARY_DRIFT = float(os.getenv('MAX_VOCABULARY_DRIFT', 0.01))
+MAX_IDF_DRIFT = float(os.getenv('MAX_IDF_DRIFT', 0.02))
+# ...or once this share of the catalog has been added, removed or re-vectorized since then
+MAX_CHANGED_FRACTION = float(os.getenv('MAX_CHANGED_FRACTION', 0.2))
+
+# Product fields the text is made of; a change to any of them re-vectorizes the row
+TEXT_FIELDS = ['name', 'description', 'category', 'sub_category']
+
+def product_text(product):
+    """Text a product is vectorized from; the name and category are repeated to weigh more"""
+    return (f"{product['name']} {product['description']} {product['category']} {product['category']} "
+            f"{product['sub_category']} {product['name']}")
+
+def plain_value(value):
+    """Unwrap MongoDB extended JSON such as {"$numberInt": "3"}"""
+    if isinstance(value, dict) and len(value) == 1:
+        key = next(iter(value))
+        if key.startswith('$'):
+            return value[key]
+    return value
+
+def parse_number(value, default=0):
+    value = plain_value(value)
+    if value is None or value == '':
+        return default
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+def is_active(row):
+    value = plain_value(row.get('is_active'))
+    if isinstance(value, str):
+        return value.strip().lower() not in ('false', '0', 'no')
+    return value is None or bool(value)
+
+def product_record(row):
+    """Normalize one exported product row into the record the recommender serves"""
+    barcode = str(plain_value(row['barcode'])).strip()
+    if not barcode:
+        raise ValueError('empty barcode')
+    return {
+        'name': str(row['name']),
+        'price': parse_number(row['price']),
+        'description': str(row.get('description') or ''),
+        'category': str(row['category']),
+        'sub_category': str(row.get('sub_category') or ''),
+        'units_sold': int(parse_number(row.get('units_sold'))),
+        'imageUrl': str(row.get('imageUrl') or ''),
+        'barcode': barcode,
+        'stock_quantity': int(parse_number(row.get('stock_quantity')))
+    }
+
+def read_rows(path, file_format=None):
+    """Yield the export's rows as dicts, one at a time"""
+    file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def read_products(path, file_format=None, chunk_size=BUILD_CHUNK_SIZE):
+    """Yield lists of active products, chunk_size export rows at a time"""
+    chunk = []
+    for line_number, row in enumerate(read_rows(path, file_format), start=1):
+        if not is_active(row):
+            continue
+        try:
+            chunk.append(product_record(row))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"WARNING: Skipping export row {line_number}: {e!r}")
+            continue
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def count_terms(texts, analyzer, vocabulary, unknown=None):
+    """Term counts of the texts as a CSR matrix without a fixed width; terms missing from the
+    vocabulary are added to it, or only tallied per document in unknown when that is given"""
+    indptr = [0]
+    indices = []
+    counts = []
+    for text in texts:
+        row = {}
+        unseen = set()
+        for term in analyzer(text):
+            column = vocabulary.get(term)
+            if column is None:
+                if unknown is not None:
+                    unseen.add(term)
+                    continue
+                column = vocabulary[term] = len(vocabulary)
+            row[column] = row.get(column, 0) + 1
+        indices.extend(row)
+        counts.extend(row.values())
+        indptr.append(len(indices))
+        if unseen:
+            unknown.update(unseen)
+    return np.array(counts, dtype=np.float64), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)
+
+def stack_counts(blocks, width):
+    """One CSR matrix from the count blocks of consecutive chunks"""
+    matrices = [
+        sparse.csr_matrix((counts, indices, indptr), shape=(len(indptr) - 1, width))
+        for counts, indices, indptr in blocks
+    ]
+    return sparse.vstack(matrices, format='csr') if matrices else sparse.csr_matrix((0, width))
+
+def document_frequency_limits(vectorizer, num_documents):
+    """min_df and max_df as document counts, the way scikit-learn applies them"""
+    min_df, max_df = vectorizer.min_df, vectorizer.max_df
+    low = min_df if isinstance(min_df, int) else min_df * num_documents
+    high = max_df if isinstance(max_df, int) else max_df * num_documents
+    return low, high
+
+def compute_idf(vectorizer, document_frequency, num_documents):
+    smooth = int(vectorizer.smooth_idf)
+    return np.log((num_documents + smooth) / (document_frequency + smooth)) + 1
+
+def tfidf_transformer(vectorizer):
+    """Transformer that turns term counts into the vectorizer's TF-IDF rows"""
+    transformer = TfidfTransformer(norm=vectorizer.norm, use_idf=vectorizer.use_idf,
+                                   smooth_idf=vectorizer.smooth_idf, sublinear_tf=vectorizer.sublinear_tf)
+    transformer.idf_ = vectorizer.idf_
+    return transformer
+
+def build_full(chunks, params=VECTORIZER_PARAMS):
+    """Fit the vectorizer on every product; the same result as TfidfVectorizer.fit_transform,
+    with the export read and counted one chunk at a time"""
+    vectorizer = TfidfVectorizer(**params)
+    analyzer = vectorizer.build_analyzer()
+    terms = {}
+    product_data = {}
+    product_keys = []
+    blocks = []
+    for chunk in chunks:
+        fresh = []
+        for product in chunk:
+            # Barcodes are unique in the catalog; the first row of a duplicate wins
+            if product['barcode'] in product_data:
+                print(f"WARNING: Duplicate barcode {product['barcode']}, keeping the first row")
+                continue
+            product_data[product['barcode']] = product
+            product_keys.append(product['barcode'])
+            fresh.append(product)
+        blocks.append(count_terms([product_text(product) for product in fresh], analyzer, terms))
+    counts = stack_counts(blocks, len(terms))
+
+    # Keep the terms within the document frequency limits, in sorted order
+    document_frequency = np.bincount(counts.indices, minlength=len(terms))
+    low, high = document_frequency_limits(vectorizer, len(product_keys))
+    kept = sorted(term for term, column in terms.items() if low <= document_frequency[column] <= high)
+    if not kept:
+        raise ValueError('After pruning, no terms remain. Try a lower min_df or a higher max_df.')
+    columns = np.array([terms[term] for term in kept])
+    counts = counts[:, columns]
+
+    vectorizer.vocabulary_ = {term: i for i, term in enumerate(kept)}
+    vectorizer.idf_ = compute_idf(vectorizer, document_frequency[columns], len(product_keys))
+    tfidf_matrix = tfidf_transformer(vectorizer).transform(counts)
+    return product_data, product_keys, vectorizer, tfidf_matrix
+
+def update_model(model_data, products):
+    """Re-vectorize only the added and changed products against the existing vocabulary.
+
+    Returns (product_data, product_keys, tfidf_matrix, build info), or a string saying why
+    a full rebuild is needed instead, or None if nothing changed."""
+    catalog = model_data['catalog']
+    old_keys = catalog.barcodes.tolist()
+    old_data = dict(zip(old_keys, catalog.records()))
+    row_of = {barcode: i for i, barcode in enumerate(old_keys)}
+    vectorizer = model_data['vectorizer']
+    matrix = model_data['tfidf_matrix']
+    previous_build = model_data['manifest'].get('build', {})
+
+    removed = [barcode for barcode in old_keys if barcode not in products]
+    added = [barcode for barcode in products if barcode not in old_data]
+    changed = [
+        barcode for barcode in old_keys
+        if barcode in products and any(products[barcode][f] != old_data[barcode][f] for f in TEXT_FIELDS)
+    ]
+    updated = [barcode for barcode in old_keys if barcode in products and products[barcode] != old_data[barcode]]
+    if not (removed or added or updated):
+        return None
+
+    rows_changed = len(removed) + len(added) + len(changed) + previous_build.get('rows_changed_since_full_build', 0)
+    if rows_changed > MAX_CHANGED_FRACTION * len(old_keys):
+        return f'{rows_changed} products changed since the last full build'
+
+    # Document frequencies after the update: drop the old rows, count the new ones
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    for barcode in removed + changed:
+        row = row_of[barcode]
+        document_frequency[matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]] -= 1
+    revectorized = changed + added
+    unknown = Counter()
+    counts = stack_counts(
+        [count_terms([product_text(products[b]) for b in revectorized], vectorizer.build_analyzer(),
+                     vectorizer.vocabulary_, unknown)],
+        matrix.shape[1]
+    )
+    document_frequency += np.bincount(counts.indices, minlength=matrix.shape[1])
+
+    # Terms a refit would drop, and new terms already frequent enough among the changed rows to be added.
+    # Terms pruned by the last full build are not stored, so one that a changed row lifts over min_df
+    # goes uncounted; MAX_CHANGED_FRACTION bounds how much of that can pile up.
+    low, high = document_frequency_limits(vectorizer, len(products))
+    leaving = int(np.count_nonzero((document_frequency < low) | (document_frequency > high)))
+    entering = sum(1 for frequency in unknown.values() if frequency >= low)
+    vocabulary_drift = (leaving + entering) / len(vectorizer.vocabulary_)
+
+    # Mean relative change of the idf weights, weighted by how many products use each term
+    present = document_frequency > 0
+    idf = compute_idf(vectorizer, document_frequency[present], len(products))
+    weights = document_frequency[present]
+    idf_drift = float(np.sum(weights * np.abs(idf / vectorizer.idf_[present] - 1)) / max(weights.sum(), 1))
+
+    if vocabulary_drift > MAX_VOCABULARY_DRIFT:
+        return f'vocabulary drift {vocabulary_drift:.4f} exceeds {MAX_VOCABULARY_DRIFT}'
+    if idf_drift > MAX_IDF_DRIFT:
+        return f'idf drift {idf_drift:.4f} exceeds {MAX_IDF_DRIFT}'
+
+    # Unchanged rows are copied; changed rows are replaced and new ones appended. When only
+    # prices, stock or units sold changed there is nothing to re-vectorize
+    if revectorized:
+        new_rows = tfidf_transformer(vectorizer).transform(counts)
+    else:
+        new_rows = sparse.csr_matrix((0, matrix.shape[1]), dtype=matrix.dtype)
+    product_keys = [barcode for barcode in old_keys if barcode in products] + added
+    position = {barcode: matrix.shape[0] + i for i, barcode in enumerate(revectorized)}
+    order = [position.get(barcode, row_of.get(barcode)) for barcode in product_keys]
+    tfidf_matrix = sparse.vstack([matrix, new_rows], format='csr')[order]
+
+    product_data = {barcode: products[barcode] for barcode in product_keys}
+    build = {
+        'mode': 'incremental',
+        'added': len(added),
+        'removed': len(removed),
+        're_vectorized': len(changed),
+        'updated': len(updated),
+        'rows_changed_since_full_build': rows_changed,
+        'vocabulary_drift': round(vocabulary_drift, 6),
+        'idf_drift': round(idf_drift, 6)
+    }
+    return product_data, product_keys, tfidf_matrix, build
+
+def neighbor_index(tfidf_matrix, num_neighbors):
+    """Top-N neighbor arrays for the matrix, as the 'neighbors' similarity mode uses them"""
+    from app import ProductRecommender, normalized_matrix
+    recommender = ProductRecommender()
+    recommender.tfidf_matrix = normalized_matrix(tfidf_matrix)
+    recommender.build_neighbor_index(num_neighbors)
+    return recommender.neighbor_indices, recommender.neighbor_scores
+
+def build_model(export_path, artifact_path, file_format=None, chunk_size=BUILD_CHUNK_SIZE,
+                incremental=False, num_neighbors=None, sales_through=None):
+    """Build or update the artifact from a catalog export; returns the manifest, or None if up to date"""
+    start = time.perf_counter()
+    # The export's units sold include every sale up to when it was taken, by default
+    # when the file was written
+    if sales_through is None:
+        sales_through = os.path.getmtime(export_path)
+    chunks = read_products(export_path, file_format, chunk_size)
+    result = None
+    if incremental and os.path.exists(os.path.join(artifact_path, MANIFEST_FILE)):
+        model_data = load_model_artifact(artifact_path)
+        if num_neighbors is None:
+            num_neighbors = model_data['manifest'].get('num_neighbors', 0)
+
+        products = {}
+        for chunk in chunks:
+            for product in chunk:
+                products.setdefault(product['barcode'], product)
+        result = update_model(model_data, products)
+        if result is None:
+            print(f"✅ Model at {artifact_path} is up to date with {export_path}")
+            return None
+        if isinstance(result, str):
+            print(f"Full rebuild: {result}")
+            chunks = [list(products.values())]
+            result = None
+        else:
+            product_data, product_keys, tfidf_matrix, build = result
+            vectorizer = model_data['vectorizer']
+
+    if result is None:
+        product_data, product_keys, vectorizer, tfidf_matrix = build_full(chunks)
+        build = {'mode': 'full', 'rows_changed_since_full_build': 0}
+
+    neighbor_indices = neighbor_scores = None
+    if num_neighbors:
+        neighbor_indices, neighbor_scores = neighbor_index(tfidf_matrix, num_neighbors)
+
+    build.update(source=os.path.basename(export_path), duration_seconds=round(time.perf_counter() - start, 3))
+    manifest = save_model_artifact(artifact_path, product_data, product_keys, vectorizer, tfidf_matrix,
+                                   neighbor_indices=neighbor_indices, neighbor_scores=neighbor_scores, build=build,
+                                   sales_through=sales_through)
+    print(f"✅ {build['mode'].capitalize()} build of {len(product_keys)} products took {build['duration_seconds']} s")
+    return manifest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the recommender model artifact from a product catalog export')
+    parser.add_argument('export_path', help='Catalog export, CSV or JSONL (one product per line)')
+    parser.add_argument('artifact_path', help='Model artifact directory to write')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='Export format (default: from the file extension)')
+    parser.add_argument('--chunk-size', type=int, default=BUILD_CHUNK_SIZE, help='Export rows processed at a time')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only re-vectorize changed products of the existing artifact, unless the vocabulary drifted')
+    parser.add_argument('--neighbors', type=int,
+                        help='Also store the top-N neighbor index (default: as in the existing artifact, else none)')
+    parser.add_argument('--sales-through',
+                        help='Local time the export was taken, as YYYY-MM-DDTHH:MM:SS; the service only adds the '
+                             'sales recorded after it (default: the export file\'s modification time)')
+    args = parser.parse_args()
+
+    sales_through = None
+    if args.sales_through:
+        sales_through = time.mktime(time.strptime(args.sales_through, '%Y-%m-%dT%H:%M:%S'))
+    build_model(args.export_path, args.artifact_path, args.format, args.chunk_size, args.incremental, args.neighbors,
+                sales_through)
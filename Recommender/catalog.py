@@ -0,0 +1,136 @@
+import numpy as np
+
+class StringColumn:
+    """Variable-length UTF-8 strings stored as one byte buffer plus offsets"""
+    def __init__(self, data, offsets):
+        # Plain ndarray views of memory-mapped arrays index faster than np.memmap
+        self.data = np.asarray(data)
+        self.offsets = np.asarray(offsets)
+
+    @classmethod
+    def from_strings(cls, values):
+        encoded = [value.encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def tolist(self):
+        buffer = self.data.tobytes()
+        bounds = self.offsets.tolist()
+        return [buffer[bounds[i]:bounds[i + 1]].decode('utf-8') for i in range(len(bounds) - 1)]
+
+def build_barcode_index(barcodes):
+    """Sorted fixed-width barcode bytes plus the matrix row of each entry"""
+    encoded = np.array([barcode.encode('utf-8') for barcode in barcodes.tolist()], dtype=np.bytes_)
+    if len(encoded) == 0:
+        encoded = np.empty(0, dtype='S1')
+    order = np.argsort(encoded, kind='stable')
+    return encoded[order], order.astype(np.int32)
+
+class ProductCatalog:
+    """Columnar product attributes, indexed by the row ids of the TF-IDF matrix"""
+    def __init__(self, barcodes, names, descriptions, image_urls, categories, category_codes,
+                 sub_categories, sub_category_codes, prices, units_sold, stock_quantity,
+                 barcode_index=None, barcode_rows=None):
+        self.barcodes = barcodes
+        self.names = names
+        self.descriptions = descriptions
+        self.image_urls = image_urls
+
+        # Each distinct category and sub-category string is kept once, rows hold its code
+        self.categories = categories
+        self.category_codes = np.asarray(category_codes)
+        self.sub_categories = sub_categories
+        self.sub_category_codes = np.asarray(sub_category_codes)
+
+        self.prices = np.asarray(prices)
+        self.units_sold = np.asarray(units_sold)
+        self.stock_quantity = np.asarray(stock_quantity)
+
+        # Barcode lookups binary-search a sorted bytes array instead of hashing into a dict
+        if barcode_index is None:
+            barcode_index, barcode_rows = build_barcode_index(barcodes)
+        self.barcode_index = np.asarray(barcode_index)
+        self.barcode_rows = np.asarray(barcode_rows)
+
+    @classmethod
+    def from_records(cls, products):
+        """Build a catalog from product dicts in matrix row order"""
+        categories = {}
+        sub_categories = {}
+        category_codes = np.array(
+            [categories.setdefault(p['category'], len(categories)) for p in products], dtype=np.int32
+        )
+        sub_category_codes = np.array(
+            [sub_categories.setdefault(p.get('sub_category', ''), len(sub_categories)) for p in products],
+            dtype=np.int32
+        )
+        return cls(
+            barcodes=StringColumn.from_strings([p['barcode'] for p in products]),
+            names=StringColumn.from_strings([p['name'] for p in products]),
+            descriptions=StringColumn.from_strings([p.get('description', '') for p in products]),
+            image_urls=StringColumn.from_strings([p.get('imageUrl', '') for p in products]),
+            categories=list(categories),
+            category_codes=category_codes,
+            sub_categories=list(sub_categories),
+            sub_category_codes=sub_category_codes,
+            prices=np.array([p['price'] for p in products], dtype=np.float64),
+            units_sold=np.array([p.get('units_sold', 0) for p in products], dtype=np.int64),
+            stock_quantity=np.array([p.get('stock_quantity', 0) for p in products], dtype=np.int64)
+        )
+
+    def __len__(self):
+        return len(self.barcodes)
+
+    def __contains__(self, barcode):
+        return bool(self.rows([barcode]))
+
+    def rows(self, barcodes):
+        """Rows of the barcodes found in the catalog, in the given order"""
+        if not barcodes or not len(self.barcode_index):
+            return []
+
+        # Only strings can be barcodes; longer keys cannot be in the index and must not be
+        # truncated to its width
+        width = self.barcode_index.dtype.itemsize
+        encoded = [barcode.encode('utf-8', 'surrogatepass') for barcode in barcodes if isinstance(barcode, str)]
+        keys = np.array([key for key in encoded if len(key) <= width], dtype=self.barcode_index.dtype)
+        positions = np.minimum(np.searchsorted(self.barcode_index, keys), len(self.barcode_index) - 1)
+        found = self.barcode_index[positions] == keys
+        return self.barcode_rows[positions[found]].tolist()
+
+    def row(self, barcode):
+        """Row of a barcode, or None if it is not in the catalog"""
+        rows = self.rows([barcode])
+        return rows[0] if rows else None
+
+    def barcode(self, idx):
+        return self.barcodes[idx]
+
+    def price(self, idx):
+        # Whole-number prices are served as ints, as they are in the product records
+        price = float(self.prices[idx])
+        return int(price) if price.is_integer() else price
+
+    def record(self, idx):
+        """Full product record for a row, with the fields of the BACKEND product model"""
+        return {
+            'name': self.names[idx],
+            'price': self.price(idx),
+            'description': self.descriptions[idx],
+            'category': self.categories[self.category_codes[idx]],
+            'sub_category': self.sub_categories[self.sub_category_codes[idx]],
+            'units_sold': int(self.units_sold[idx]),
+            'imageUrl': self.image_urls[idx],
+            'barcode': self.barcodes[idx],
+            'stock_quantity': int(self.stock_quantity[idx])
+        }
+
+    def records(self):
+        return [self.record(idx) for idx in range(len(self))]
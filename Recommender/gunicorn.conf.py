@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+
+# Scoring uses numpy/scipy; one BLAS thread per worker keeps workers from competing for cores.
+# Set before the app (and numpy) is imported by preload_app.
+for variable in ('OPENBLAS_NUM_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(variable, '1')
+
+# Each worker keeps its own request and invoice histograms; publishing them to a shared
+# file lets a scrape that lands on any worker report the whole server
+os.environ.setdefault('METRICS_PATH', 'metrics.db')
+
+# --------------- SERVER ---------------
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Load the model once in the master; workers share it copy-on-write
+preload_app = True
+
+# /recommend is CPU-bound and holds the GIL, so parallelism comes from one process per core.
+# A few threads per worker keep slow clients and the quick /generate-invoice hand-off
+# (rendering and delivery run on background threads) from blocking a whole worker.
+# Invoice job records are kept in a SQLite file (INVOICE_JOBS_PATH) shared by the
+# workers, so a status poll can land on any of them.
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Every worker starts its own SCORING_SHARDS shard processes, so cap the shards per worker
+# to keep the box at one scoring process per core; with fewer than two left, score in-process.
+# Set before the app is imported by preload_app.
+requested_shards = int(os.environ.get('SCORING_SHARDS', 0))
+if requested_shards > 1 and workers * requested_shards > multiprocessing.cpu_count():
+    shards_per_worker = multiprocessing.cpu_count() // workers
+    if shards_per_worker < 2:
+        shards_per_worker = 0
+    print(f"WARNING: SCORING_SHARDS={requested_shards} with {workers} workers would oversubscribe "
+          f"{multiprocessing.cpu_count()} CPUs; using {shards_per_worker} shards per worker")
+    os.environ['SCORING_SHARDS'] = str(shards_per_worker)
+
+# --------------- TIMEOUTS ---------------
+# Requests are short; a worker silent for this long is restarted
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# Time given to in-flight requests on shutdown or reload
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then so memory growth in a worker can't accumulate. Invoice
+# jobs survive it: worker_exit drains them and the other workers resume the rest.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+# Access logs cost a write per request; enable with GUNICORN_ACCESS_LOG=-
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+errorlog = '-'
+
+def on_starting(server):
+    """Start the metrics from zero, as a fresh process's would"""
+    import metrics
+    metrics.STORE.reset()
+
+def post_fork(server, worker):
+    """Start the per-process background threads and scoring shards; neither survives the fork"""
+    import app
+    app.start_model_watcher(app.MODEL_PATH, app.MODEL_WATCH_INTERVAL)
+    app.invoice_jobs.start()
+    app.invoice_outbox.start()
+    app.sales_counters.start()
+    app.metrics.STORE.start()
+    if app.recommender is not None and app.recommender.shards is not None:
+        app.recommender.shards.start()
+
+def worker_exit(server, worker):
+    """Let queued invoices finish, then hand what's left and the SMS outbox's dispatch lease
+    to the other workers instead of waiting for them to notice this one is gone"""
+    import app
+    app.invoice_jobs.stop()
+    app.invoice_outbox.stop()
+    app.metrics.STORE.publish()
+
+def child_exit(server, worker):
+    """Keep an exited worker's counts in the totals once its row is gone; runs in the master"""
+    import metrics
+    metrics.STORE.retire(worker.pid)
@@ -0,0 +1,465 @@
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from functools import partial
+from send_invoice import (generate_invoice_pdf, upload_to_dropbox, send_invoice_via_twilio, warm_up_connections,
+                          create_async_session, upload_to_dropbox_async, send_invoice_via_twilio_async)
+
+# --------------- CONFIGURATION ---------------
+# Worker threads and pending-job capacity of the invoice pipeline
+INVOICE_WORKERS = int(os.getenv('INVOICE_WORKERS', 4))
+INVOICE_QUEUE_SIZE = int(os.getenv('INVOICE_QUEUE_SIZE', 100))
+
+# Attempts per stage and the base delay (seconds) of the exponential backoff
+INVOICE_STAGE_ATTEMPTS = int(os.getenv('INVOICE_STAGE_ATTEMPTS', 3))
+INVOICE_RETRY_DELAY = float(os.getenv('INVOICE_RETRY_DELAY', 1.0))
+
+# SQLite file holding the job records, so any worker on a host can answer a status poll
+INVOICE_JOBS_PATH = os.getenv('INVOICE_JOBS_PATH', 'invoice_jobs.db')
+
+# Finished jobs kept around for status lookups
+INVOICE_JOBS_KEPT = int(os.getenv('INVOICE_JOBS_KEPT', 1000))
+
+# Each job row holds its request, so work a worker leaves unfinished (it was recycled,
+# restarted or killed) is picked up by another. Every INVOICE_SWEEP_INTERVAL seconds a
+# worker marks its own jobs as alive and takes over the jobs of workers silent for
+# INVOICE_JOB_STALE_AFTER seconds.
+INVOICE_SWEEP_INTERVAL = float(os.getenv('INVOICE_SWEEP_INTERVAL', 30))
+INVOICE_JOB_STALE_AFTER = float(os.getenv('INVOICE_JOB_STALE_AFTER', 120))
+
+# Time a stopping worker gives its queued invoices before handing the rest to the others
+INVOICE_DRAIN_TIMEOUT = float(os.getenv('INVOICE_DRAIN_TIMEOUT', 10))
+
+# Invoices in flight at once on the async pipeline; each waits on the network, not on a thread
+ASYNC_INVOICE_LIMIT = int(os.getenv('ASYNC_INVOICE_LIMIT', 5000))
+
+# Attempts per stage and the request payload are kept as JSON; the payload is dropped
+# once the job is finished. owner is the process running the job, NULL when released.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoice_jobs (
+    job_id TEXT PRIMARY KEY,
+    order_id TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    attempts TEXT NOT NULL DEFAULT '{}',
+    download_link TEXT,
+    sms_sent INTEGER NOT NULL DEFAULT 0,
+    sms_queued INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    payload TEXT,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS invoice_jobs_status ON invoice_jobs (status, created_at);
+"""
+
+JOB_COLUMNS = ['job_id', 'order_id', 'status', 'stage', 'attempts', 'download_link', 'sms_sent', 'sms_queued',
+               'error', 'created_at', 'updated_at']
+
+class InvoiceJobQueue:
+    """Background worker pool that renders, uploads and sends invoices"""
+    def __init__(self, render=generate_invoice_pdf, upload=upload_to_dropbox, notify=send_invoice_via_twilio,
+                 warm_up=warm_up_connections, outbox=None, workers=INVOICE_WORKERS, queue_size=INVOICE_QUEUE_SIZE,
+                 attempts=INVOICE_STAGE_ATTEMPTS, retry_delay=INVOICE_RETRY_DELAY, jobs_kept=INVOICE_JOBS_KEPT,
+                 path=INVOICE_JOBS_PATH, sweep_interval=INVOICE_SWEEP_INTERVAL, stale_after=INVOICE_JOB_STALE_AFTER):
+        # Stage functions can be swapped for local stand-ins in tests
+        self.render = render
+        self.upload = upload
+        self.notify = notify
+        self.warm_up = warm_up
+        # When set, SMS notifications are recorded in this durable outbox and sent by its dispatcher
+        self.outbox = outbox
+
+        self.workers = workers
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.jobs_kept = jobs_kept
+        self.sweep_interval = sweep_interval
+        self.stale_after = stale_after
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.threads = []
+        self.sweeper = None
+        self.pid = None
+        # Set while the worker shuts down; no new jobs are taken then
+        self.stopping = threading.Event()
+
+        # Job records live in SQLite rather than in this process: a status poll may
+        # reach any worker, not just the one running the job
+        self.path = path
+        self.store_lock = threading.Lock()
+        self.connection = None
+        self.connection_pid = None
+        # Identifies this process as the owner of its jobs; set when the connection opens
+        self.owner = None
+
+    def connect(self):
+        """Return this process's SQLite connection, opening it on first use"""
+        # A connection must not cross a fork, so each worker process opens its own
+        if self.connection is None or self.connection_pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Progress updates needn't survive a power loss, so commits skip the fsync
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self.connection = connection
+            self.connection_pid = os.getpid()
+            self.owner = uuid.uuid4().hex
+        return self.connection
+
+    def start(self):
+        """Start the worker threads; called lazily so it also works after a fork"""
+        with self.lock:
+            # Threads don't survive a fork: a forked child starts its own, on a fresh
+            # queue, since the inherited one still has the parent's threads waiting on it
+            if self.pid != os.getpid():
+                self.pending = queue.Queue(maxsize=self.pending.maxsize)
+                self.threads = []
+                self.sweeper = None
+                self.pid = os.getpid()
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            for i in range(len(self.threads), self.workers):
+                thread = threading.Thread(target=self.work, name=f'invoice-worker-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            if self.sweeper is None or not self.sweeper.is_alive():
+                self.sweeper = threading.Thread(target=self.run_sweeper, name='invoice-sweeper', daemon=True)
+                self.sweeper.start()
+
+    def submit(self, data):
+        """Queue an invoice and return its job id; raises queue.Full when saturated or stopping"""
+        if self.stopping.is_set():
+            raise queue.Full
+        self.start()
+        job_id = self.create_job(data)
+        try:
+            self.pending.put_nowait((job_id, data))
+        except queue.Full:
+            with self.store_lock:
+                self.connect().execute('DELETE FROM invoice_jobs WHERE job_id = ?', (job_id,))
+            raise
+        return job_id
+
+    def create_job(self, data):
+        """Record a new queued job and return its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.store_lock:
+            connection = self.connect()
+            connection.execute(
+                "INSERT INTO invoice_jobs (job_id, order_id, status, payload, owner, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, data.get('razorpay_order_id'), json.dumps(data), self.owner, now, now)
+            )
+        return job_id
+
+    def get(self, job_id):
+        """Return a snapshot of the job, or None if it is unknown"""
+        with self.store_lock:
+            row = self.connect().execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM invoice_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        job.update(attempts=json.loads(job['attempts']), sms_sent=bool(job['sms_sent']),
+                   sms_queued=bool(job['sms_queued']))
+        return job
+
+    def update(self, job_id, **changes):
+        changes['updated_at'] = time.time()
+        with self.store_lock:
+            self.connect().execute(
+                f"UPDATE invoice_jobs SET {', '.join(f'{column} = ?' for column in changes)} WHERE job_id = ?",
+                list(changes.values()) + [job_id]
+            )
+
+    def work(self):
+        while True:
+            job_id, data = self.pending.get()
+            try:
+                self.run_job(job_id, data)
+            except Exception as e:
+                self.update(job_id, status='failed', error=str(e), payload=None)
+                print(f"❌ Invoice job {job_id} failed: {e}")
+            finally:
+                self.pending.task_done()
+                self.prune()
+
+    def run_sweeper(self):
+        while True:
+            try:
+                if not self.stopping.is_set():
+                    for job in self.sweep(self.pending.maxsize - self.pending.qsize()):
+                        try:
+                            self.pending.put_nowait(job)
+                        except queue.Full:
+                            self.update(job[0], owner=None)
+            except Exception as e:
+                print(f"❌ Invoice job sweep failed: {e}")
+            time.sleep(self.sweep_interval)
+
+    def sweep(self, capacity):
+        """Mark this process's unfinished jobs as alive and take over up to capacity jobs that were
+        released or whose owner has gone silent; returns them as (job_id, data)"""
+        now = time.time()
+        with self.store_lock:
+            connection = self.connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    "UPDATE invoice_jobs SET updated_at = ? WHERE owner = ? AND status NOT IN ('completed', 'failed')",
+                    (now, self.owner)
+                )
+                rows = connection.execute(
+                    "SELECT job_id, payload FROM invoice_jobs WHERE status NOT IN ('completed', 'failed') "
+                    "AND payload IS NOT NULL AND (owner IS NULL OR updated_at < ?) ORDER BY created_at LIMIT ?",
+                    (now - self.stale_after, max(capacity, 0))
+                ).fetchall()
+                # Taken-over jobs start again from rendering; the outbox keeps the SMS to one per order
+                connection.executemany(
+                    "UPDATE invoice_jobs SET owner = ?, status = 'queued', stage = NULL, updated_at = ? WHERE job_id = ?",
+                    [(self.owner, now, job_id) for job_id, _ in rows]
+                )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        if rows:
+            print(f"Resuming {len(rows)} invoice job(s) left unfinished by another worker")
+        return [(job_id, json.loads(payload)) for job_id, payload in rows]
+
+    def release(self):
+        """Hand this process's unfinished jobs to the other workers' sweeps"""
+        with self.store_lock:
+            self.connect().execute(
+                "UPDATE invoice_jobs SET owner = NULL WHERE owner = ? AND status NOT IN ('completed', 'failed')",
+                (self.owner,)
+            )
+
+    def stop(self, timeout=INVOICE_DRAIN_TIMEOUT):
+        """Stop taking jobs, give the queued ones time to finish, then release the rest"""
+        self.stopping.set()
+        deadline = time.monotonic() + timeout
+        while self.pending.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.release()
+
+    def run_job(self, job_id, data):
+        # Connect to Dropbox and Twilio while the PDF renders; the upload doesn't
+        # wait for it and opens its own connection if the pool is still empty
+        if self.warm_up:
+            threading.Thread(target=self.run_warm_up, name=f'invoice-warm-up-{job_id}', daemon=True).start()
+        
+        # The PDF stays in memory from rendering to upload
+        pdf_name, pdf_bytes = self.run_stage(job_id, 'rendering', self.render, data)
+
+        # A missing link is a failed upload, so it is retried like an error
+        def upload(pdf_bytes, file_name):
+            link = self.upload(pdf_bytes, file_name)
+            if not link:
+                raise RuntimeError('Failed to generate Dropbox link')
+            return link
+
+        download_link = self.run_stage(job_id, 'uploading', upload, pdf_bytes, pdf_name)
+        self.update(job_id, download_link=download_link)
+
+        # Don't fail the whole job if SMS fails, just record the error
+        try:
+            if data.get('phone_number') and self.outbox:
+                # One notification per order, however often the invoice is requested
+                self.run_stage(job_id, 'notifying', self.outbox.enqueue,
+                               data.get('razorpay_order_id'), data['phone_number'], download_link)
+                self.update(job_id, sms_queued=True)
+            elif data.get('phone_number'):
+                self.run_stage(job_id, 'notifying', self.notify, data['phone_number'], download_link)
+                self.update(job_id, sms_sent=True)
+        except Exception as e:
+            self.update(job_id, error=f'Failed to send SMS: {e}')
+            print(f"Warning: Failed to send SMS: {str(e)}")
+
+        self.update(job_id, status='completed', stage=None, payload=None)
+
+    def run_warm_up(self):
+        # Only an optimization; the stages open their own connections if this fails
+        try:
+            self.warm_up()
+        except Exception as e:
+            print(f"Warning: connection warm-up failed: {e}")
+
+    def run_stage(self, job_id, stage, func, *args):
+        """Run one stage with exponential backoff between attempts"""
+        for attempt in range(1, self.attempts + 1):
+            self.start_attempt(job_id, stage, attempt)
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt == self.attempts:
+                    raise RuntimeError(f'{stage} failed after {attempt} attempts: {e}') from e
+                print(f"Warning: {stage} attempt {attempt} failed for job {job_id}: {e}")
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def start_attempt(self, job_id, stage, attempt):
+        with self.store_lock:
+            self.connect().execute(
+                'UPDATE invoice_jobs SET attempts = json_set(attempts, ?, ?), status = ?, stage = ?, updated_at = ? '
+                'WHERE job_id = ?',
+                (f'$.{stage}', attempt, stage, stage, time.time(), job_id)
+            )
+
+    def prune(self):
+        """Forget the oldest finished jobs beyond the retention limit"""
+        with self.store_lock:
+            self.connect().execute(
+                "DELETE FROM invoice_jobs WHERE job_id IN (SELECT job_id FROM invoice_jobs "
+                "WHERE status IN ('completed', 'failed') ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.jobs_kept,)
+            )
+
+    def statuses(self):
+        """Jobs per status, across every worker sharing the store"""
+        with self.store_lock:
+            return dict(self.connect().execute('SELECT status, COUNT(*) FROM invoice_jobs GROUP BY status').fetchall())
+
+    def stats(self):
+        statuses = self.statuses()
+        return {
+            'queued': self.pending.qsize(),
+            'capacity': self.pending.maxsize,
+            'in_progress': sum(count for status, count in statuses.items() if status not in ('queued', 'completed', 'failed')),
+            'completed': statuses.get('completed', 0),
+            'failed': statuses.get('failed', 0)
+        }
+
+class AsyncInvoiceJobQueue(InvoiceJobQueue):
+    """Invoice pipeline on an asyncio event loop: rendering runs in an executor, delivery over async HTTP"""
+    def __init__(self, render=generate_invoice_pdf, upload=upload_to_dropbox_async, notify=send_invoice_via_twilio_async,
+                 outbox=None, executor=None, limit=ASYNC_INVOICE_LIMIT, attempts=INVOICE_STAGE_ATTEMPTS,
+                 retry_delay=INVOICE_RETRY_DELAY, jobs_kept=INVOICE_JOBS_KEPT, path=INVOICE_JOBS_PATH,
+                 sweep_interval=INVOICE_SWEEP_INTERVAL, stale_after=INVOICE_JOB_STALE_AFTER):
+        # upload and notify are coroutines taking the aiohttp session first; render and the
+        # outbox run on the executor (the loop's default one when None)
+        super().__init__(render, upload, notify, warm_up=None, outbox=outbox, workers=0, queue_size=limit,
+                         attempts=attempts, retry_delay=retry_delay, jobs_kept=jobs_kept, path=path,
+                         sweep_interval=sweep_interval, stale_after=stale_after)
+        self.executor = executor
+        self.limit = limit
+        self.tasks = set()
+        self.session = None
+
+    async def store(self, func, *args, **kwargs):
+        """Run a job store call on the loop's default executor; SQLite would block the loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def submit(self, data):
+        """Start an invoice on the running event loop and return its job id; raises queue.Full when saturated"""
+        if len(self.tasks) >= self.limit:
+            raise queue.Full
+        if self.session is None:
+            self.session = create_async_session()
+        self.start()
+        job_id = await self.store(self.create_job, data)
+        self.start_task(job_id, data)
+        return job_id
+
+    def start_task(self, job_id, data):
+        task = asyncio.get_running_loop().create_task(self.work(job_id, data))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def start(self):
+        """Start the sweep on the running event loop; the jobs themselves are tasks started by submit"""
+        if self.sweeper is None or self.sweeper.done():
+            self.sweeper = asyncio.get_running_loop().create_task(self.run_sweeper())
+
+    async def run_sweeper(self):
+        while True:
+            try:
+                if self.session is None:
+                    self.session = create_async_session()
+                for job_id, data in await self.store(self.sweep, self.limit - len(self.tasks)):
+                    self.start_task(job_id, data)
+            except Exception as e:
+                print(f"❌ Invoice job sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    async def work(self, job_id, data):
+        try:
+            await self.run_job(job_id, data)
+        except Exception as e:
+            await self.store(self.update, job_id, status='failed', error=str(e), payload=None)
+            print(f"❌ Invoice job {job_id} failed: {e}")
+        finally:
+            await self.store(self.prune)
+
+    async def run_job(self, job_id, data):
+        loop = asyncio.get_running_loop()
+        
+        # Rendering is CPU work, so it runs off the loop
+        pdf_name, pdf_bytes = await self.run_stage(job_id, 'rendering', loop.run_in_executor,
+                                                   self.executor, self.render, data)
+
+        # A missing link is a failed upload, so it is retried like an error
+        async def upload(pdf_bytes, file_name):
+            link = await self.upload(self.session, pdf_bytes, file_name)
+            if not link:
+                raise RuntimeError('Failed to generate Dropbox link')
+            return link
+
+        download_link = await self.run_stage(job_id, 'uploading', upload, pdf_bytes, pdf_name)
+        await self.store(self.update, job_id, download_link=download_link)
+
+        # Don't fail the whole job if SMS fails, just record the error
+        try:
+            if data.get('phone_number') and self.outbox:
+                # One notification per order, however often the invoice is requested
+                await self.run_stage(job_id, 'notifying', loop.run_in_executor, self.executor, self.outbox.enqueue,
+                                     data.get('razorpay_order_id'), data['phone_number'], download_link)
+                await self.store(self.update, job_id, sms_queued=True)
+            elif data.get('phone_number'):
+                await self.run_stage(job_id, 'notifying', self.notify, self.session, data['phone_number'], download_link)
+                await self.store(self.update, job_id, sms_sent=True)
+        except Exception as e:
+            await self.store(self.update, job_id, error=f'Failed to send SMS: {e}')
+            print(f"Warning: Failed to send SMS: {str(e)}")
+
+        await self.store(self.update, job_id, status='completed', stage=None, payload=None)
+
+    async def run_stage(self, job_id, stage, func, *args):
+        """Run one stage with exponential backoff between attempts"""
+        for attempt in range(1, self.attempts + 1):
+            await self.store(self.start_attempt, job_id, stage, attempt)
+            try:
+                return await func(*args)
+            except Exception as e:
+                if attempt == self.attempts:
+                    raise RuntimeError(f'{stage} failed after {attempt} attempts: {e}') from e
+                print(f"Warning: {stage} attempt {attempt} failed for job {job_id}: {e}")
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    async def close(self, timeout=30):
+        """Give in-flight invoices time to finish, release the rest to other workers, then close the HTTP session"""
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+        if self.tasks:
+            await asyncio.wait(set(self.tasks), timeout=timeout)
+        await self.store(self.release)
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def stats(self):
+        statuses = self.statuses()
+        return {
+            'queued': statuses.get('queued', 0),
+            'capacity': self.limit,
+            'in_progress': sum(count for status, count in statuses.items() if status not in ('queued', 'completed', 'failed')),
+            'completed': statuses.get('completed', 0),
+            'failed': statuses.get('failed', 0)
+        }
@@ -0,0 +1,251 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from send_invoice import send_invoice_via_twilio
+
+# --------------- CONFIGURATION ---------------
+# SQLite file holding invoice SMS notifications until they are delivered
+OUTBOX_PATH = os.getenv('OUTBOX_PATH', 'invoice_outbox.db')
+
+# Messages claimed per batch and the most messages sent per second
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 20))
+OUTBOX_RATE_LIMIT = float(os.getenv('OUTBOX_RATE_LIMIT', 10))
+
+# Attempts per message and the exponential backoff between them (seconds)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_RETRY_DELAY = float(os.getenv('OUTBOX_RETRY_DELAY', 5))
+OUTBOX_MAX_RETRY_DELAY = float(os.getenv('OUTBOX_MAX_RETRY_DELAY', 600))
+
+# Seconds between checks when nothing is due, and how long a claimed batch is
+# reserved before another dispatcher may pick it up again
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 1))
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv('OUTBOX_CLAIM_TIMEOUT', 120))
+
+# Every worker process runs a dispatcher, but only the holder of the dispatch lease
+# sends, so OUTBOX_RATE_LIMIT applies to the whole host. A lease not renewed for this
+# many seconds (its worker exited) is taken over by another dispatcher.
+OUTBOX_LEASE_TIMEOUT = float(os.getenv('OUTBOX_LEASE_TIMEOUT', 15))
+
+# Finished notifications are kept this long (seconds), which is also how long
+# a repeated order id is recognized as a duplicate
+OUTBOX_RETENTION = float(os.getenv('OUTBOX_RETENTION', 7 * 24 * 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    order_id TEXT PRIMARY KEY,
+    phone_number TEXT NOT NULL,
+    download_link TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS notifications_due ON notifications (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS dispatch_lease (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+class NotificationOutbox:
+    """Durable outbox of invoice SMS notifications, drained by a rate-limited dispatcher"""
+    def __init__(self, path=OUTBOX_PATH, send=send_invoice_via_twilio, batch_size=OUTBOX_BATCH_SIZE,
+                 rate_limit=OUTBOX_RATE_LIMIT, max_attempts=OUTBOX_MAX_ATTEMPTS, retry_delay=OUTBOX_RETRY_DELAY,
+                 max_retry_delay=OUTBOX_MAX_RETRY_DELAY, poll_interval=OUTBOX_POLL_INTERVAL,
+                 claim_timeout=OUTBOX_CLAIM_TIMEOUT, retention=OUTBOX_RETENTION, lease_timeout=OUTBOX_LEASE_TIMEOUT):
+        # The send function can be swapped for a local stand-in in tests
+        self.path = path
+        self.send = send
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self.retention = retention
+        self.lease_timeout = lease_timeout
+        self.purged_at = 0
+        self.next_send = 0
+        # Identifies this process's dispatcher in the lease; set when the connection opens
+        self.owner = None
+        self.lease_renewed_at = 0
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.connection = None
+        self.pid = None
+
+    def connect(self):
+        """Return this process's SQLite connection, opening it on first use"""
+        # A connection must not cross a fork, so each worker process opens its own
+        if self.connection is None or self.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self.connection = connection
+            self.pid = os.getpid()
+            self.owner = uuid.uuid4().hex
+        return self.connection
+
+    def start(self):
+        """Start the dispatcher thread; called lazily so it also works after a fork"""
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.connect()
+            self.thread = threading.Thread(target=self.dispatch, name='invoice-outbox', daemon=True)
+            self.thread.start()
+
+    def enqueue(self, order_id, phone_number, download_link):
+        """Record a notification; returns False if one already exists for the order"""
+        self.start()
+        now = time.time()
+        with self.lock:
+            cursor = self.connect().execute(
+                'INSERT OR IGNORE INTO notifications '
+                '(order_id, phone_number, download_link, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)',
+                (order_id or f'unknown-{uuid.uuid4().hex}', phone_number, download_link, now, now)
+            )
+        self.wakeup.set()
+        return cursor.rowcount == 1
+
+    def status(self, order_id):
+        """Return the delivery state of an order's notification, or None if there is none"""
+        with self.lock:
+            row = self.connect().execute(
+                'SELECT status, attempts, last_error, sent_at FROM notifications WHERE order_id = ?', (order_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'status': row[0], 'attempts': row[1], 'error': row[2], 'sent_at': row[3]}
+
+    def acquire_lease(self):
+        """Take or renew the dispatch lease; returns False while another dispatcher holds it"""
+        now = time.time()
+        with self.lock:
+            connection = self.connect()
+            cursor = connection.execute(
+                'INSERT INTO dispatch_lease (id, owner, expires_at) VALUES (1, ?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+                'WHERE dispatch_lease.owner = excluded.owner OR dispatch_lease.expires_at <= ?',
+                (self.owner, now + self.lease_timeout, now)
+            )
+        if cursor.rowcount == 1:
+            self.lease_renewed_at = time.monotonic()
+            return True
+        return False
+
+    def stop(self, timeout=5):
+        """Stop the dispatcher and hand the lease to another worker's at once"""
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        with self.lock:
+            self.connect().execute('DELETE FROM dispatch_lease WHERE owner = ?', (self.owner,))
+
+    def claim_batch(self):
+        """Reserve the next due notifications so no other dispatcher sends them meanwhile"""
+        # A dispatcher that dies mid-batch leaves its claim to expire, so delivery is at-least-once
+        now = time.time()
+        with self.lock:
+            connection = self.connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = connection.execute(
+                    "SELECT order_id, phone_number, download_link, attempts FROM notifications "
+                    "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                    (now, self.batch_size)
+                ).fetchall()
+                connection.executemany(
+                    'UPDATE notifications SET next_attempt_at = ? WHERE order_id = ?',
+                    [(now + self.claim_timeout, row[0]) for row in rows]
+                )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        return rows
+
+    def send_batch(self, rows):
+        """Send a claimed batch at the configured rate and record the outcomes in one transaction"""
+        interval = 1.0 / self.rate_limit if self.rate_limit > 0 else 0
+        sent, failed = [], []
+        for position, (order_id, phone_number, download_link, attempts) in enumerate(rows):
+            # A slow batch renews the lease as it goes; if another dispatcher took it over,
+            # or this one is stopping, the rest of the batch is handed back unsent
+            lease_due = time.monotonic() - self.lease_renewed_at > self.lease_timeout / 3
+            if self.stopped.is_set() or (lease_due and not self.acquire_lease()):
+                failed.extend(('pending', row[3], time.time(), None, row[0]) for row in rows[position:])
+                break
+            delay = self.next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_send = max(self.next_send, time.monotonic()) + interval
+            try:
+                self.send(phone_number, download_link)
+                sent.append((time.time(), order_id))
+            except Exception as e:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    print(f"❌ Giving up on invoice SMS for order {order_id} after {attempts} attempts: {e}")
+                    failed.append(('failed', attempts, time.time(), str(e), order_id))
+                else:
+                    backoff = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+                    failed.append(('pending', attempts, time.time() + backoff, str(e), order_id))
+
+        with self.lock:
+            connection = self.connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany(
+                    "UPDATE notifications SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL "
+                    "WHERE order_id = ?", sent
+                )
+                connection.executemany(
+                    'UPDATE notifications SET status = ?, attempts = ?, next_attempt_at = ?, '
+                    'last_error = COALESCE(?, last_error) WHERE order_id = ?', failed
+                )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+    def purge(self):
+        """Delete notifications that finished longer ago than the retention period"""
+        cutoff = time.time() - self.retention
+        with self.lock:
+            self.connect().execute(
+                "DELETE FROM notifications WHERE status != 'pending' AND COALESCE(sent_at, next_attempt_at) < ?",
+                (cutoff,)
+            )
+        self.purged_at = time.time()
+
+    def dispatch(self):
+        while not self.stopped.is_set():
+            self.wakeup.clear()
+            try:
+                if self.acquire_lease():
+                    rows = self.claim_batch()
+                    if rows:
+                        self.send_batch(rows)
+                        continue
+                    if time.time() - self.purged_at > 3600:
+                        self.purge()
+            except Exception as e:
+                print(f"❌ Invoice outbox dispatch failed: {e}")
+            self.wakeup.wait(self.poll_interval)
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.connect().execute(
+                'SELECT status, COUNT(*) FROM notifications GROUP BY status'
+            ).fetchall())
+        return {status: counts.get(status, 0) for status in ('pending', 'sent', 'failed')}
@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import random
+import time
+import aiohttp
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+async def fetch_products(session, url, count):
+    """Use the service's own top sellers as the pool carts are drawn from"""
+    async with session.get(f'{url}/top-products', params={'num': count}) as response:
+        data = await response.json()
+    return data['products']
+
+def build_request(endpoint, products, rng):
+    """Return the path and JSON body of one request"""
+    cart = rng.sample(products, rng.randint(1, 8))
+    if endpoint == 'recommend':
+        return '/recommend', {'cart_barcodes': [product['barcode'] for product in cart], 'num_recommendations': 12}
+    # Order items as the checkout page sends them
+    order_items = [{
+        'cart_number': 1,
+        'product_barcode': product['barcode'],
+        'product_name': product['name'],
+        'quantity': rng.randint(1, 3),
+        'price': product['price']
+    } for product in cart]
+    return '/generate-invoice', {
+        'userName': 'Load Test',
+        'phone_number': '9999999999',
+        'razorpay_order_id': f'order_loadtest_{rng.getrandbits(64):x}',
+        'razorpay_payment_id': 'pay_loadtest',
+        'payment_status': 'completed',
+        'amount': sum(item['price'] * item['quantity'] for item in order_items),
+        'order_items': order_items
+    }
+
+async def client(session, url, endpoints, products, deadline, latencies, errors, seed):
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        path, body = build_request(rng.choice(endpoints), products, rng)
+        start = time.perf_counter()
+        try:
+            async with session.post(f'{url}{path}', json=body) as response:
+                await response.read()
+                if response.status >= 400:
+                    errors[response.status] = errors.get(response.status, 0) + 1
+                    continue
+        except aiohttp.ClientError as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            continue
+        latencies.append(time.perf_counter() - start)
+
+async def main(args):
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        products = await fetch_products(session, args.url, args.pool)
+        latencies, errors = [], {}
+        endpoints = ['recommend'] * args.recommend_weight + ['invoice'] * args.invoice_weight
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            client(session, args.url, endpoints, products, deadline, latencies, errors, seed)
+            for seed in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    print(f"URL:         {args.url}")
+    print(f"Requests:    {len(latencies)} ok, {sum(errors.values())} failed {errors or ''}")
+    print(f"Throughput:  {len(latencies) / elapsed:.1f} req/s")
+    print(f"Latency:     p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load test the recommender service, e.g. "python app.py" against '
+                    '"gunicorn -c gunicorn.conf.py wsgi:application"'
+    )
+    parser.add_argument('--url', default='http://localhost:5000', help='Base URL of the service')
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds to run')
+    parser.add_argument('--pool', type=int, default=200, help='Top products carts are drawn from')
+    parser.add_argument('--recommend-weight', type=int, default=9, help='Share of /recommend requests')
+    parser.add_argument('--invoice-weight', type=int, default=0, help='Share of /generate-invoice requests (these start real deliveries)')
+    asyncio.run(main(parser.parse_args()))
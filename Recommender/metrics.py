@@ -0,0 +1,284 @@
+import asyncio
+import bisect
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# --------------- CONFIGURATION ---------------
+# SQLite file every worker on a host publishes its histograms to, so a scrape answered
+# by any worker covers the whole server. Empty keeps each process's metrics to itself.
+METRICS_PATH = os.getenv('METRICS_PATH', '')
+
+# Seconds between publishes, which is also how late a scrape may see the requests
+# other workers handled
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+# Request latency buckets (seconds), Prometheus' defaults
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Finer buckets for the stages inside one recommendation
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+# Coarser buckets for invoice rendering and the network calls
+INVOICE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# One row per live process holding its histograms as JSON, plus the 'exited' row that
+# the histograms of workers that have gone are folded into, so counts never go back
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_snapshots (
+    owner TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    series TEXT NOT NULL
+);
+"""
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+class Histogram:
+    """Prometheus histogram with one series per combination of label values"""
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per series: the count of each bucket (non-cumulative, plus +Inf), and the sum
+        self.series = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labelvalues):
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labelvalues)
+            if series is None:
+                series = self.series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    def time(self, *labelvalues):
+        """Context manager that observes the duration of its block"""
+        return Timer(self, labelvalues)
+
+    def timed(self, *labelvalues):
+        """Decorator that observes each call's duration, with its outcome as the last label"""
+        # A call that raises or returns a falsy result (like a missing upload link) is an error
+        def decorate(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    outcome = 'error'
+                    try:
+                        result = await func(*args, **kwargs)
+                        outcome = 'success' if result else 'error'
+                        return result
+                    finally:
+                        self.observe(time.perf_counter() - start, *labelvalues, outcome)
+            else:
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    outcome = 'error'
+                    try:
+                        result = func(*args, **kwargs)
+                        outcome = 'success' if result else 'error'
+                        return result
+                    finally:
+                        self.observe(time.perf_counter() - start, *labelvalues, outcome)
+            return wrapper
+        return decorate
+
+    def snapshot(self):
+        """(label values, bucket counts, sum) of every series"""
+        with self.lock:
+            return [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self.series.items()]
+
+    def reset(self):
+        with self.lock:
+            self.series = {}
+
+    def render(self, series=None):
+        """Exposition lines for this process's series, or for the given snapshot"""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        if series is None:
+            series = self.snapshot()
+        for labelvalues, counts, total in sorted(series):
+            names = self.labelnames + ('le',)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(names, labelvalues + (bound,))} {cumulative}')
+            labels = format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+class Timer:
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+
+def render_samples(name, documentation, samples, metric_type='gauge'):
+    """Exposition lines for a value read at scrape time; samples are (labels dict, value) pairs"""
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {metric_type}']
+    for labels, value in samples:
+        lines.append(f'{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}')
+    return lines
+
+def merge_snapshots(snapshots):
+    """Sum (label values, bucket counts, sum) series by name and label values"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, series in snapshot.items():
+            by_labels = merged.setdefault(name, {})
+            for labelvalues, counts, total in series:
+                labelvalues = tuple(labelvalues)
+                current = by_labels.get(labelvalues)
+                if current is None:
+                    by_labels[labelvalues] = [list(counts), total]
+                elif len(current[0]) == len(counts):
+                    current[0] = [a + b for a, b in zip(current[0], counts)]
+                    current[1] += total
+    return {name: [(labelvalues, counts, total) for labelvalues, (counts, total) in by_labels.items()]
+            for name, by_labels in merged.items()}
+
+class MetricsStore:
+    """Histograms of every worker on a host, each publishing its own to a shared SQLite
+    file in the background and reading back everyone's when it answers a scrape"""
+    def __init__(self, path=METRICS_PATH, flush_interval=METRICS_FLUSH_INTERVAL, registry=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.registry = REGISTRY if registry is None else registry
+        # The process the histograms were created in; a forked worker starts from zero
+        self.origin_pid = os.getpid()
+
+        self.lock = threading.Lock()
+        self.thread = None
+        self.connection = None
+        self.pid = None
+        self.owner = None
+
+    def connect(self):
+        """Return this process's SQLite connection, opening it on first use"""
+        # A connection must not cross a fork, so each worker process opens its own
+        if self.connection is None or self.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self.connection = connection
+            self.pid = os.getpid()
+            self.owner = uuid.uuid4().hex
+        return self.connection
+
+    def start(self):
+        """Start publishing this process's histograms; called in each worker after the fork"""
+        if not self.path:
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            # Whatever the master observed before forking would otherwise be counted once per worker
+            if os.getpid() != self.origin_pid:
+                for histogram in self.registry:
+                    histogram.reset()
+                self.origin_pid = os.getpid()
+            self.connect()
+            self.thread = threading.Thread(target=self.run, name='metrics-publisher', daemon=True)
+            self.thread.start()
+
+    def publish(self):
+        """Replace this process's row with its current histograms"""
+        # Taken under the lock so a slower publish can't overwrite a newer snapshot
+        with self.lock:
+            series = {histogram.name: histogram.snapshot() for histogram in self.registry}
+            self.connect().execute(
+                'INSERT OR REPLACE INTO metric_snapshots (owner, pid, series) VALUES (?, ?, ?)',
+                (self.owner, os.getpid(), json.dumps(series))
+            )
+
+    def collect(self):
+        """Every worker's histograms summed, with this process's as of now"""
+        self.publish()
+        with self.lock:
+            rows = self.connect().execute('SELECT series FROM metric_snapshots').fetchall()
+        return merge_snapshots(json.loads(series) for series, in rows)
+
+    def retire(self, pid):
+        """Fold the histograms of a worker that has exited into the 'exited' row; called by the master"""
+        with self.lock:
+            connection = self.connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = connection.execute(
+                    "SELECT series FROM metric_snapshots WHERE pid = ? OR owner = 'exited'", (pid,)
+                ).fetchall()
+                if rows:
+                    merged = merge_snapshots(json.loads(series) for series, in rows)
+                    connection.execute("DELETE FROM metric_snapshots WHERE pid = ? AND owner != 'exited'", (pid,))
+                    connection.execute(
+                        "INSERT OR REPLACE INTO metric_snapshots (owner, pid, series) VALUES ('exited', 0, ?)",
+                        (json.dumps(merged),)
+                    )
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def reset(self):
+        """Forget every worker's histograms, as a restarted server's counters start from zero"""
+        with self.lock:
+            self.connect().execute('DELETE FROM metric_snapshots')
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"❌ Publishing metrics failed: {e}")
+
+def render(extra_lines=()):
+    """All registered histograms plus the given lines, in the Prometheus text format. With
+    METRICS_PATH set the histograms cover every worker; the extra lines are this process's."""
+    series = STORE.collect() if STORE.path else {}
+    lines = []
+    for histogram in REGISTRY:
+        lines.extend(histogram.render(series.get(histogram.name, []) if STORE.path else None))
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+# Every histogram in the process
+REGISTRY = []
+
+# Where this process publishes its histograms and reads the other workers'
+STORE = MetricsStore()
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.', ('method', 'route', 'status')
+)
+RECOMMEND_STAGE_SECONDS = Histogram(
+    'recommend_stage_duration_seconds', 'Time spent in each stage of scoring a cart.', ('stage',), STAGE_BUCKETS
+)
+INVOICE_STAGE_SECONDS = Histogram(
+    'invoice_stage_duration_seconds', 'Time spent rendering, uploading and sending invoices.',
+    ('stage', 'outcome'), INVOICE_BUCKETS
+)
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import pickle
+import shutil
+import time
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from catalog import ProductCatalog, StringColumn
+
+# --------------- ARTIFACT FORMAT ---------------
+# A model artifact is a directory holding a manifest.json and one raw .npy file
+# per array. Nothing in it is pickled, and every array can be memory-mapped so
+# that all workers on a host share the same pages through the OS page cache.
+FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+# Product attributes stored as variable-length UTF-8 string columns
+STRING_COLUMNS = ['barcode', 'name', 'description', 'imageUrl']
+
+# Vectorizer parameters that can be stored as plain JSON
+VECTORIZER_PARAMS = [
+    'analyzer', 'binary', 'decode_error', 'encoding', 'input', 'lowercase', 'max_df',
+    'max_features', 'min_df', 'ngram_range', 'norm', 'smooth_idf', 'stop_words',
+    'strip_accents', 'sublinear_tf', 'token_pattern', 'use_idf'
+]
+
+def catalog_string_columns(catalog):
+    """The catalog's string columns by their STRING_COLUMNS file name"""
+    return dict(zip(STRING_COLUMNS, [catalog.barcodes, catalog.names, catalog.descriptions, catalog.image_urls]))
+
+def save_string_column(path, name, column):
+    """Write a StringColumn as its UTF-8 byte buffer plus an offsets array"""
+    np.save(os.path.join(path, f'{name}_data.npy'), column.data)
+    np.save(os.path.join(path, f'{name}_offsets.npy'), column.offsets)
+
+def load_string_column(path, name, mmap_mode='r'):
+    """Read a string column written by save_string_column"""
+    data = np.load(os.path.join(path, f'{name}_data.npy'), mmap_mode=mmap_mode)
+    offsets = np.load(os.path.join(path, f'{name}_offsets.npy'), mmap_mode=mmap_mode)
+    return StringColumn(data, offsets)
+
+def save_model_artifact(path, product_data, product_keys, vectorizer, tfidf_matrix,
+                        neighbor_indices=None, neighbor_scores=None, model_version=None, build=None,
+                        sales_through=None):
+    """Write the model to a versioned artifact directory, replacing any existing one"""
+    tmp_path = f"{path.rstrip(os.sep)}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    # TF-IDF matrix as raw CSR arrays
+    tfidf_matrix = sparse.csr_matrix(tfidf_matrix)
+    tfidf_matrix.sort_indices()
+    np.save(os.path.join(tmp_path, 'tfidf_data.npy'), tfidf_matrix.data)
+    np.save(os.path.join(tmp_path, 'tfidf_indices.npy'), tfidf_matrix.indices)
+    np.save(os.path.join(tmp_path, 'tfidf_indptr.npy'), tfidf_matrix.indptr)
+
+    # Product attribute columns, in matrix row order
+    catalog = ProductCatalog.from_records([product_data[barcode] for barcode in product_keys])
+    for name, column in catalog_string_columns(catalog).items():
+        save_string_column(tmp_path, name, column)
+    np.save(os.path.join(tmp_path, 'category_codes.npy'), catalog.category_codes)
+    np.save(os.path.join(tmp_path, 'sub_category_codes.npy'), catalog.sub_category_codes)
+    np.save(os.path.join(tmp_path, 'price.npy'), catalog.prices)
+    np.save(os.path.join(tmp_path, 'units_sold.npy'), catalog.units_sold)
+    np.save(os.path.join(tmp_path, 'stock_quantity.npy'), catalog.stock_quantity)
+    np.save(os.path.join(tmp_path, 'barcode_index.npy'), catalog.barcode_index)
+    np.save(os.path.join(tmp_path, 'barcode_rows.npy'), catalog.barcode_rows)
+
+    # Fitted vectorizer: vocabulary in column order plus the idf weights
+    params = vectorizer.get_params()
+    unsupported = [key for key in params if key not in VECTORIZER_PARAMS + ['dtype', 'vocabulary'] and params[key] is not None]
+    if unsupported:
+        raise ValueError(f"Vectorizer parameters cannot be stored: {', '.join(unsupported)}")
+    terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+    save_string_column(tmp_path, 'vocabulary', StringColumn.from_strings(terms))
+    np.save(os.path.join(tmp_path, 'idf.npy'), vectorizer.idf_)
+
+    # Optional precomputed neighbor index
+    if neighbor_indices is not None:
+        np.save(os.path.join(tmp_path, 'neighbor_indices.npy'), neighbor_indices)
+        np.save(os.path.join(tmp_path, 'neighbor_scores.npy'), neighbor_scores)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'model_version': model_version or time.strftime('%Y%m%d%H%M%S'),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'num_products': len(product_keys),
+        'tfidf_shape': list(tfidf_matrix.shape),
+        'categories': catalog.categories,
+        'sub_categories': catalog.sub_categories,
+        'vectorizer': {
+            'params': {key: params[key] for key in VECTORIZER_PARAMS},
+            'dtype': np.dtype(params['dtype']).name
+        },
+        'num_neighbors': int(neighbor_indices.shape[1]) if neighbor_indices is not None else 0
+    }
+    # How build_model.py produced the artifact, so incremental updates know when to rebuild fully
+    if build:
+        manifest['build'] = build
+    # When the export was taken (seconds since the epoch); the service adds only the sales recorded since
+    if sales_through is not None:
+        manifest['sales_through'] = sales_through
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap the finished directory into place; readers holding the old files keep them
+    old_path = None
+    if os.path.exists(path):
+        old_path = f"{path.rstrip(os.sep)}.old-{os.getpid()}"
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    if old_path:
+        shutil.rmtree(old_path)
+
+    print(f"✅ Model artifact written to {path} (version {manifest['model_version']})")
+    return manifest
+
+def load_manifest(path):
+    """Read and validate the manifest of an artifact directory"""
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported model format version: {manifest.get('format_version')}")
+    return manifest
+
+def load_array(path, name, mmap_mode='r'):
+    return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+def load_tfidf_matrix(path, manifest, mmap_mode='r'):
+    """The stored TF-IDF matrix; scipy keeps memory-mapped arrays without copying"""
+    return sparse.csr_matrix(
+        (load_array(path, 'tfidf_data', mmap_mode), load_array(path, 'tfidf_indices', mmap_mode),
+         load_array(path, 'tfidf_indptr', mmap_mode)),
+        shape=tuple(manifest['tfidf_shape'])
+    )
+
+def load_catalog(path, manifest, mmap_mode='r'):
+    """Columnar product catalog in matrix row order"""
+    # Artifacts written before the barcode index existed get it built at load time
+    columns = {name: load_string_column(path, name, mmap_mode) for name in STRING_COLUMNS}
+    has_index = os.path.exists(os.path.join(path, 'barcode_index.npy'))
+    return ProductCatalog(
+        barcodes=columns['barcode'],
+        names=columns['name'],
+        descriptions=columns['description'],
+        image_urls=columns['imageUrl'],
+        categories=manifest['categories'],
+        category_codes=load_array(path, 'category_codes', mmap_mode),
+        sub_categories=manifest['sub_categories'],
+        sub_category_codes=load_array(path, 'sub_category_codes', mmap_mode),
+        prices=load_array(path, 'price', mmap_mode),
+        units_sold=load_array(path, 'units_sold', mmap_mode),
+        stock_quantity=load_array(path, 'stock_quantity', mmap_mode),
+        barcode_index=load_array(path, 'barcode_index', mmap_mode) if has_index else None,
+        barcode_rows=load_array(path, 'barcode_rows', mmap_mode) if has_index else None
+    )
+
+def load_model_artifact(path, mmap_mode='r'):
+    """Load an artifact directory: its manifest, product catalog, vectorizer and matrices"""
+    manifest = load_manifest(path)
+
+    # Rebuild the fitted vectorizer without unpickling it
+    vectorizer_config = manifest['vectorizer']
+    params = dict(vectorizer_config['params'])
+    params['ngram_range'] = tuple(params['ngram_range'])
+    vectorizer = TfidfVectorizer(dtype=np.dtype(vectorizer_config['dtype']).type, **params)
+    vocabulary = load_string_column(path, 'vocabulary', mmap_mode).tolist()
+    vectorizer.vocabulary_ = {term: i for i, term in enumerate(vocabulary)}
+    vectorizer.fixed_vocabulary_ = False
+    vectorizer.idf_ = np.array(load_array(path, 'idf', mmap_mode))
+
+    model_data = {
+        'manifest': manifest,
+        'catalog': load_catalog(path, manifest, mmap_mode),
+        'vectorizer': vectorizer,
+        'tfidf_matrix': load_tfidf_matrix(path, manifest, mmap_mode)
+    }
+    if manifest.get('num_neighbors'):
+        model_data['neighbor_indices'] = load_array(path, 'neighbor_indices', mmap_mode)
+        model_data['neighbor_scores'] = load_array(path, 'neighbor_scores', mmap_mode)
+    return model_data
+
+def convert_pickle(pickle_path, artifact_path, num_neighbors=0):
+    """Convert a legacy recommender_model.pkl into an artifact directory"""
+    # Only run this on trusted files: unpickling executes arbitrary code
+    with open(pickle_path, 'rb') as f:
+        model_data = pickle.load(f)
+
+    neighbor_indices = neighbor_scores = None
+    if num_neighbors:
+        from app import ProductRecommender, normalized_matrix
+        recommender = ProductRecommender()
+        recommender.tfidf_matrix = normalized_matrix(model_data['tfidf_matrix'])
+        recommender.build_neighbor_index(num_neighbors)
+        neighbor_indices = recommender.neighbor_indices
+        neighbor_scores = recommender.neighbor_scores
+
+    return save_model_artifact(
+        artifact_path,
+        model_data['product_data'],
+        model_data['product_keys'],
+        model_data['vectorizer'],
+        model_data['tfidf_matrix'],
+        neighbor_indices=neighbor_indices,
+        neighbor_scores=neighbor_scores
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a pickled recommender model into an artifact directory')
+    parser.add_argument('pickle_path', help='Path of the legacy recommender_model.pkl')
+    parser.add_argument('artifact_path', help='Directory to write the artifact to')
+    parser.add_argument('--neighbors', type=int, default=0, help='Also store the top-N neighbor index')
+    args = parser.parse_args()
+
+    convert_pickle(args.pickle_path, args.artifact_path, args.neighbors)
@@ -0,0 +1,256 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, insort
+import numpy as np
+
+# --------------- CONFIGURATION ---------------
+# SQLite file the live sales counts are flushed to; every worker on a host shares it
+SALES_DB_PATH = os.getenv('SALES_DB_PATH', 'sales_counters.db')
+
+# Seconds between flushes of the recorded orders, which is also how soon the
+# sales recorded by other workers show up in this one
+SALES_FLUSH_INTERVAL = float(os.getenv('SALES_FLUSH_INTERVAL', 5))
+
+# Orders waiting for the next flush before new ones are dropped
+SALES_QUEUE_SIZE = int(os.getenv('SALES_QUEUE_SIZE', 10000))
+
+# How long orders are remembered (seconds): a repeated order id within it is counted
+# once, and a model built from an export older than this misses the sales before it
+SALES_ORDER_RETENTION = float(os.getenv('SALES_ORDER_RETENTION', 7 * 24 * 3600))
+
+# Sales are kept per order line with the time the order was recorded, so a model
+# counts only the sales its export doesn't include yet. Line ids only grow, so a
+# worker reads back just the lines added since its last flush.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sales_orders (
+    order_id TEXT PRIMARY KEY,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sales_orders_recorded ON sales_orders (recorded_at);
+CREATE TABLE IF NOT EXISTS sales_lines (
+    line_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    barcode TEXT NOT NULL,
+    units INTEGER NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sales_lines_recorded ON sales_lines (recorded_at);
+"""
+
+def order_lines(order_items):
+    """Units per barcode of an order's items; items without a barcode or a positive quantity are skipped"""
+    units = {}
+    for item in order_items or []:
+        if not isinstance(item, dict):
+            continue
+        barcode = item.get('product_barcode')
+        quantity = item.get('quantity', 1)
+        if not isinstance(barcode, str) or not barcode:
+            continue
+        if isinstance(quantity, float) and quantity.is_integer():
+            quantity = int(quantity)
+        if isinstance(quantity, bool) or not isinstance(quantity, int):
+            continue
+        if quantity > 0:
+            units[barcode] = units.get(barcode, 0) + int(quantity)
+    return units
+
+class SalesCounters:
+    """Units sold per barcode since the active model's export, fed by completed orders
+    and flushed to a SQLite file in the background"""
+    def __init__(self, path=SALES_DB_PATH, flush_interval=SALES_FLUSH_INTERVAL, queue_size=SALES_QUEUE_SIZE,
+                 retention=SALES_ORDER_RETENTION, apply=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention = retention
+        # Called with {barcode: units} for the counts that changed, while apply_lock is held
+        self.apply = apply
+
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.unflushed = []
+        # Sales recorded from this time on are counted; since() moves it to a new model's export
+        self.cutoff = 0
+        self.counts = {}
+        self.last_line = 0
+        self.purged_at = 0
+
+        # The lock guards the connection; apply_lock is held while counts change and are
+        # applied, so a model swapped in under it can't miss an update
+        self.lock = threading.Lock()
+        self.apply_lock = threading.Lock()
+        self.thread = None
+        self.connection = None
+        self.pid = None
+
+    def connect(self):
+        """Return this process's SQLite connection, opening it on first use"""
+        # A connection must not cross a fork, so each worker process opens its own
+        if self.connection is None or self.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self.connection = connection
+            self.pid = os.getpid()
+        return self.connection
+
+    def start(self):
+        """Start the flush thread; called lazily so it also works after a fork"""
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.connect()
+            self.thread = threading.Thread(target=self.run, name='sales-counters', daemon=True)
+            self.thread.start()
+
+    def record(self, order_id, order_items):
+        """Queue a completed order for counting; returns False if it has nothing to count,
+        raises queue.Full when saturated. Never blocks."""
+        self.start()
+        units = order_lines(order_items)
+        if not units:
+            return False
+        self.pending.put_nowait((str(order_id) if order_id else None, units, time.time()))
+        return True
+
+    def since(self, cutoff):
+        """Count only the sales recorded from cutoff on, and return those counts. Called
+        with apply_lock held when a model built from an export taken at cutoff is swapped in."""
+        with self.lock:
+            connection = self.connect()
+            # One read transaction, so no line is both in the counts and read back by the next flush
+            connection.execute('BEGIN')
+            try:
+                last_line = connection.execute('SELECT COALESCE(MAX(line_id), 0) FROM sales_lines').fetchone()[0]
+                rows = connection.execute(
+                    'SELECT barcode, SUM(units) FROM sales_lines WHERE recorded_at >= ? AND line_id <= ? GROUP BY barcode',
+                    (cutoff, last_line)
+                ).fetchall()
+            finally:
+                connection.execute('COMMIT')
+        self.cutoff = cutoff
+        self.counts = dict(rows)
+        self.last_line = last_line
+        return dict(self.counts)
+
+    def flush(self):
+        """Write the queued orders in one transaction, then read back every line added since the last flush"""
+        # Orders of a flush that failed are tried again with the next one
+        orders = self.unflushed
+        self.unflushed = []
+        while True:
+            try:
+                orders.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+
+        if orders:
+            with self.lock:
+                connection = self.connect()
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    # Orders seen before, by this or another worker, are not counted again;
+                    # orders without an id can't be recognized and always count
+                    lines = []
+                    for order_id, units, recorded_at in orders:
+                        if order_id is not None:
+                            cursor = connection.execute(
+                                'INSERT OR IGNORE INTO sales_orders (order_id, recorded_at) VALUES (?, ?)',
+                                (order_id, recorded_at)
+                            )
+                            if cursor.rowcount == 0:
+                                continue
+                        lines.extend((barcode, quantity, recorded_at) for barcode, quantity in units.items())
+                    connection.executemany(
+                        'INSERT INTO sales_lines (barcode, units, recorded_at) VALUES (?, ?, ?)', lines
+                    )
+                    connection.execute('COMMIT')
+                except Exception:
+                    connection.execute('ROLLBACK')
+                    self.unflushed = orders
+                    raise
+
+        with self.apply_lock:
+            with self.lock:
+                added = self.connect().execute(
+                    'SELECT line_id, barcode, units, recorded_at FROM sales_lines WHERE line_id > ? ORDER BY line_id',
+                    (self.last_line,)
+                ).fetchall()
+            if not added:
+                return
+            # Lines recorded before the model's export are already in its units sold
+            updates = {}
+            for _, barcode, units, recorded_at in added:
+                if recorded_at >= self.cutoff:
+                    updates[barcode] = updates.get(barcode, self.counts.get(barcode, 0)) + units
+            self.counts.update(updates)
+            self.last_line = added[-1][0]
+            if updates and self.apply is not None:
+                self.apply(updates)
+
+    def purge(self):
+        """Forget orders recorded longer ago than the retention period"""
+        cutoff = time.time() - self.retention
+        with self.lock:
+            connection = self.connect()
+            connection.execute('DELETE FROM sales_orders WHERE recorded_at < ?', (cutoff,))
+            connection.execute('DELETE FROM sales_lines WHERE recorded_at < ?', (cutoff,))
+        self.purged_at = time.time()
+
+    def run(self):
+        while True:
+            try:
+                self.flush()
+                if time.time() - self.purged_at > 3600:
+                    self.purge()
+            except Exception as e:
+                print(f"❌ Sales counter flush failed: {e}")
+            time.sleep(self.flush_interval)
+
+    def stats(self):
+        with self.apply_lock:
+            return {
+                'products': len(self.counts),
+                'units': sum(self.counts.values()),
+                'counted_since': self.cutoff,
+                'pending_orders': self.pending.qsize() + len(self.unflushed)
+            }
+
+class TopSellingRanking:
+    """The rows that sold the most units, best first with ties in row order, kept
+    current as counts change without sorting the whole catalog again"""
+    def __init__(self, units_sold, size):
+        self.size = size
+        self.rebuild(units_sold)
+
+    def rebuild(self, units_sold):
+        order = np.argsort(-units_sold, kind='stable')[:self.size].tolist()
+        self.keys = [(-int(units_sold[idx]), idx) for idx in order]
+        self.members = dict((idx, key) for key, idx in zip(self.keys, order))
+        self.rows = order
+
+    def update(self, units_sold, rows):
+        """Re-rank after the counts of the given rows changed"""
+        # Readers keep iterating the lists they already have; changes go into copies
+        keys = list(self.keys)
+        members = dict(self.members)
+        for idx in rows:
+            key = (-int(units_sold[idx]), idx)
+            old = members.pop(idx, None)
+            if old is not None:
+                if key > old:
+                    # Fewer units than before: a row outside the ranking may now belong in it
+                    return self.rebuild(units_sold)
+                del keys[bisect_left(keys, old)]
+            elif len(keys) >= self.size and (not keys or key > keys[-1]):
+                continue
+
+            insort(keys, key)
+            members[idx] = key
+            if len(keys) > self.size:
+                del members[keys.pop()[1]]
+
+        self.keys = keys
+        self.members = members
+        self.rows = [idx for _, idx in keys]
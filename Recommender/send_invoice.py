@@ -1,10 +1,17 @@
+import aiohttp
 import dropbox
-from fpdf import FPDF
+from fpdf import FPDF, FPDF_VERSION
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 from datetime import datetime
+import json
 import os
+import threading
+import time
 import uuid
+import zlib
 from dotenv import load_dotenv
+from metrics import INVOICE_STAGE_SECONDS
 
 load_dotenv()
 
@@ -22,20 +29,161 @@ account_sid = os.getenv('TWILIO_ACCOUNT_SID')
 auth_token = os.getenv('TWILIO_AUTH_TOKEN')
 messaging_service_sid = os.getenv('TWILIO_MESSAGING_SERVICE_SID')
 
+# Pooled HTTP connections shared by every invoice in the process
+DROPBOX_MAX_CONNECTIONS = int(os.getenv('DROPBOX_MAX_CONNECTIONS', 8))
+# Seconds after which an unused pooled connection is assumed closed by the server
+CONNECTION_IDLE_TIMEOUT = float(os.getenv('CONNECTION_IDLE_TIMEOUT', 50))
+
+# Hosts used by the upload and SMS stages
+DROPBOX_CONTENT_URL = 'https://content.dropboxapi.com/'
+DROPBOX_API_URL = 'https://api.dropboxapi.com/'
+TWILIO_API_URL = 'https://api.twilio.com/'
+
+# Connections per host and per-request timeout (seconds) of the async delivery session
+ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', 100))
+ASYNC_REQUEST_TIMEOUT = float(os.getenv('ASYNC_REQUEST_TIMEOUT', 60))
+
+# Text of the invoice SMS
+SMS_BODY = 'Thank you for shopping with TheMart! Your invoice can be downloaded at: {link}'
+
 # Company branding colors
 PRIMARY_COLOR = (41, 128, 185)  # Blue
 SECONDARY_COLOR = (39, 174, 96)  # Green
 ACCENT_COLOR = (243, 156, 18)  # Orange
 TEXT_COLOR = (52, 73, 94)  # Dark blue-gray
 
+# Static invoice layout (bands, addresses, headings, terms), rendered once per
+# process and replayed into every invoice as ready-made PDF operators. Opt-in: the
+# replay writes raw operators and restores FPDF's internal drawing state, so it is
+# only used with the FPDF release it was written against.
+INVOICE_TEMPLATE = os.getenv('INVOICE_TEMPLATE', '0') == '1'
+TEMPLATE_FPDF_VERSION = '1.7.2'
+TEMPLATE_BLOCKS = {}
+TEMPLATE_LOCK = threading.Lock()
+if INVOICE_TEMPLATE and FPDF_VERSION != TEMPLATE_FPDF_VERSION:
+    print(f"WARNING: INVOICE_TEMPLATE needs FPDF {TEMPLATE_FPDF_VERSION}, found {FPDF_VERSION}; rendering invoices directly")
+
+# Drawing state a block depends on; a block is only replayed from the state it was recorded in
+TEMPLATE_STATE = ('font_family', 'font_style', 'font_size_pt', 'underline', 'text_color',
+                  'fill_color', 'draw_color', 'line_width', 'ws', 'x')
+
+# Order table layout
+ITEM_COLUMN_WIDTHS = [10, 80, 30, 30, 40]
+ITEM_ROW_HEIGHT = 7
+
+# Pages of a long invoice after this many are zlib-compressed as soon as they are finished
+UNCOMPRESSED_PAGES = 20
+
+# Item names shortened to fit the table, shared by all invoices in the process
+FITTED_TEXT = {}
+FITTED_TEXT_LIMIT = 50000
+
+class CompressedPages(dict):
+    """Finished FPDF pages, decompressed one at a time as the document is written out"""
+    def __init__(self, pages, alias, total_pages):
+        super().__init__(pages)
+        self.alias = alias
+        self.total_pages = total_pages
+        
+    def __getitem__(self, page):
+        content = super().__getitem__(page)
+        if isinstance(content, bytes):
+            content = zlib.decompress(content).decode('latin-1')
+        return content.replace(self.alias, self.total_pages) if self.alias else content
+
 class PremiumInvoicePDF(FPDF):
-    def __init__(self):
+    def __init__(self, use_template=INVOICE_TEMPLATE):
         super().__init__()
         self.WIDTH = 210
         self.HEIGHT = 297
         self.invoice_number = f"INV-{datetime.now().strftime('%Y%m')}-{str(uuid.uuid4())[:8].upper()}"
+        self.use_template = use_template
+        
+        # Register the fonts up front so their resource names are the same in every invoice
+        for style in ('B', 'I', ''):
+            self.set_font('Arial', style, 12)
+        self.font_family, self.font_style, self.font_size_pt = '', '', 12
+        
+    def _endpage(self):
+        # Only the first pages and the one being drawn are held uncompressed,
+        # so long invoices stay small in memory
+        super()._endpage()
+        if self.page > UNCOMPRESSED_PAGES:
+            self.pages[self.page] = zlib.compress(self.pages[self.page].encode('latin-1'), 1)
+        
+    def _putpages(self):
+        # The page count alias is filled in as each page is decompressed
+        alias = getattr(self, 'str_alias_nb_pages', None)
+        if alias:
+            del self.str_alias_nb_pages
+        self.pages = CompressedPages(self.pages, alias, str(self.page))
+        super()._putpages()
+        
+    def template_block(self, key, draw):
+        """Draws static content, replaying the operators recorded by the first invoice when possible"""
+        if not self.use_template or FPDF_VERSION != TEMPLATE_FPDF_VERSION:
+            return draw()
+        
+        state = tuple(getattr(self, name) for name in TEMPLATE_STATE)
+        with TEMPLATE_LOCK:
+            block = TEMPLATE_BLOCKS.get((key, state))
+        
+        # Record the block the first time it is drawn from this state
+        if block is None:
+            page, start, top = self.page, len(self.pages[self.page]), self.y
+            draw()
+            if self.page == page:
+                # Invoices rendered at the same time may both record it; either copy will do
+                with TEMPLATE_LOCK:
+                    TEMPLATE_BLOCKS.setdefault((key, state), {
+                        'ops': self.pages[page][start:],
+                        'top': top,
+                        'height': self.y - top,
+                        'end_state': {name: getattr(self, name) for name in TEMPLATE_STATE + ('lasth',)}
+                    })
+            return
+        
+        # Blocks that would cross a page break are drawn normally
+        if not self.in_footer and self.y + block['height'] > self.page_break_trigger:
+            return draw()
+        
+        end_state = block['end_state']
+        shift = (block['top'] - self.y) * self.k
+        if abs(shift) < 0.005:
+            self.pages[self.page] += block['ops']
+        else:
+            # Move the recorded block to the current position, then reapply the
+            # colors, line width and font it leaves behind, which Q would discard
+            self.pages[self.page] += f'q 1 0 0 1 0 {shift:.2f} cm\n' + block['ops'] + 'Q\n'
+            self._out(end_state['draw_color'])
+            self._out(end_state['fill_color'])
+            self._out(f"{end_state['line_width'] * self.k:.2f} w")
+            if end_state['ws']:
+                self._out(f"{end_state['ws'] * self.k:.3f} Tw")
+            if end_state['font_family']:
+                font = self.fonts[end_state['font_family'] + end_state['font_style']]
+                self._out(f"BT /F{font['i']} {end_state['font_size_pt']:.2f} Tf ET")
+        
+        # Leave the document in the state drawing the block would have
+        for name, value in end_state.items():
+            setattr(self, name, value)
+        if self.font_family:
+            self.current_font = self.fonts[self.font_family + self.font_style]
+            self.font_size = self.font_size_pt / self.k
+        self.color_flag = self.fill_color != self.text_color
+        self.y += block['height']
         
     def header(self):
+        self.template_block('header', self.add_header_band)
+        
+        # Invoice number and date
+        self.set_font('Arial', '', 10)
+        self.set_text_color(255, 255, 255)
+        self.cell(60, 8, f'No: {self.invoice_number}', 0, 1, 'R')
+        self.ln(10)
+        
+    def add_header_band(self):
+        """Static part of the page header"""
         # Add a colored header band
         self.set_fill_color(*PRIMARY_COLOR)
         self.rect(0, 0, 210, 35, 'F')
@@ -55,15 +203,17 @@ class PremiumInvoicePDF(FPDF):
         self.set_text_color(220, 220, 220)
         self.cell(130, 8, 'powered by HaborLane', 0, 0, 'L')
         
-        # Invoice number and date
-        self.set_font('Arial', '', 10)
-        self.set_text_color(255, 255, 255)
-        self.cell(60, 8, f'No: {self.invoice_number}', 0, 1, 'R')
-        self.ln(10)
-        
     def footer(self):
-        # Footer bar
         self.set_y(-40)
+        self.template_block('footer', self.add_footer_band)
+        
+        # Page number
+        self.set_font('Arial', 'I', 8)
+        self.cell(0, 5, f'Page {self.page_no()}/{self.alias_nb_pages()}', 0, 0, 'C')
+        
+    def add_footer_band(self):
+        """Static part of the page footer"""
+        # Footer bar
         self.set_fill_color(*PRIMARY_COLOR)
         self.rect(0, self.HEIGHT - 35, 210, 35, 'F')
         
@@ -78,57 +228,50 @@ class PremiumInvoicePDF(FPDF):
         self.set_text_color(220, 220, 220)
         self.cell(0, 5, 'For any questions, please contact: support@themartnadiad.com | 022-68502300', 0, 1, 'C')
         
-        # Page number
-        self.set_font('Arial', 'I', 8)
-        self.cell(0, 5, f'Page {self.page_no()}/{self.alias_nb_pages()}', 0, 0, 'C')
-        
     def add_colored_section_header(self, title):
         """Adds a colored section header with the given title"""
-        self.set_font('Arial', 'B', 12)
-        self.set_fill_color(*PRIMARY_COLOR)
-        self.set_text_color(255, 255, 255)
-        self.cell(0, 8, title, 0, 1, 'L', True)
-        self.ln(3)
+        def draw():
+            self.set_font('Arial', 'B', 12)
+            self.set_fill_color(*PRIMARY_COLOR)
+            self.set_text_color(255, 255, 255)
+            self.cell(0, 8, title, 0, 1, 'L', True)
+            self.ln(3)
+        self.template_block(('section', title), draw)
         
     def add_address_blocks(self, data):
         """Add from and to address blocks side by side"""
+        top = self.y
+        
         # From Address (Company)
-        self.set_font('Arial', 'B', 11)
-        self.set_text_color(*TEXT_COLOR)
-        self.cell(95, 7, 'FROM:', 0, 0, 'L')
+        self.template_block('company_address', self.add_company_address)
+        bottom = self.y
         
-        # To Address (Customer)
-        self.cell(95, 7, 'BILL TO:', 0, 1, 'L')
+        # To Address (Customer), next to the company column
+        self.set_xy(self.l_margin + 95, top)
+        self.set_font('Arial', 'B', 11)
+        self.cell(95, 7, 'BILL TO:', 0, 2, 'L')
         
-        # Company details
+        # Customer name and phone
         self.set_font('Arial', '', 9)
-        self.cell(95, 5, 'TheMart Supermarket', 0, 0, 'L')
-        
-        # Customer name
-        self.cell(95, 5, f"{data.get('userName', 'N/A')}", 0, 1, 'L')
+        self.cell(95, 5, f"{data.get('userName', 'N/A')}", 0, 2, 'L')
+        self.cell(95, 5, f"Phone: {data.get('phone_number', 'N/A')}", 0, 2, 'L')
         
-        # Company address line 1
-        self.cell(95, 5, '123 Business Street', 0, 0, 'L')
-        
-        # Customer phone
-        self.cell(95, 5, f"Phone: {data.get('phone_number', 'N/A')}", 0, 1, 'L')
-        
-        # Company address line 2
-        self.cell(95, 5, 'Nadiad, Gujarat, 387001', 0, 0, 'L')
-        
-        # Empty line for customer
-        self.cell(95, 5, '', 0, 1, 'L')
-        
-        # Company phone
-        self.cell(95, 5, 'Phone: 022-68502300', 0, 0, 'L')
-        
-        # Empty line for customer
-        self.cell(95, 5, '', 0, 1, 'L')
+        self.set_xy(self.l_margin, bottom)
+        self.ln(5)
         
-        # Company email
-        self.cell(95, 5, 'Email: info@themartnadiad.com', 0, 1, 'L')
+    def add_company_address(self):
+        """Company column of the address blocks"""
+        self.set_font('Arial', 'B', 11)
+        self.set_text_color(*TEXT_COLOR)
+        self.cell(95, 7, 'FROM:', 0, 2, 'L')
         
-        self.ln(5)
+        # Company details
+        self.set_font('Arial', '', 9)
+        self.cell(95, 5, 'TheMart Supermarket', 0, 2, 'L')
+        self.cell(95, 5, '123 Business Street', 0, 2, 'L')
+        self.cell(95, 5, 'Nadiad, Gujarat, 387001', 0, 2, 'L')
+        self.cell(95, 5, 'Phone: 022-68502300', 0, 2, 'L')
+        self.cell(95, 5, 'Email: info@themartnadiad.com', 0, 2, 'L')
         
     def add_invoice_details(self, data):
         """Add invoice information section"""
@@ -139,11 +282,13 @@ class PremiumInvoicePDF(FPDF):
         col_width = self.WIDTH / 3
         
         # Headers
-        self.set_font('Arial', 'B', 9)
-        self.set_text_color(*TEXT_COLOR)
-        self.cell(col_width, 7, 'DATE', 1, 0, 'C')
-        self.cell(col_width, 7, 'ORDER ID', 1, 0, 'C')
-        self.cell(col_width, 7, 'PAYMENT STATUS', 1, 1, 'C')
+        def draw_headers():
+            self.set_font('Arial', 'B', 9)
+            self.set_text_color(*TEXT_COLOR)
+            self.cell(col_width, 7, 'DATE', 1, 0, 'C')
+            self.cell(col_width, 7, 'ORDER ID', 1, 0, 'C')
+            self.cell(col_width, 7, 'PAYMENT STATUS', 1, 1, 'C')
+        self.template_block('invoice_details_header', draw_headers)
         
         # Values
         self.set_font('Arial', '', 9)
@@ -165,49 +310,104 @@ class PremiumInvoicePDF(FPDF):
         self.ln(5)
         
     def add_order_items(self, data):
-        """Add order items table"""
+        """Add order items table, paginating it by hand so any number of items can be streamed"""
         # Start order items section
         self.add_colored_section_header('ORDER DETAILS')
         
-        # Table header
-        self.set_font('Arial', 'B', 9)
-        self.set_fill_color(240, 240, 240)
-        self.set_text_color(*TEXT_COLOR)
-        
         # Column widths
-        col_widths = [10, 80, 30, 30, 40]
+        col_widths = ITEM_COLUMN_WIDTHS
+        
+        # Keep the header together with at least one row and a subtotal
+        if self.y + 8 + 2 * ITEM_ROW_HEIGHT > self.page_break_trigger:
+            self.add_page()
+        self.add_order_items_header()
+        
+        # Table content; order_items may be any iterable, rows are drawn as they arrive
+        count = 0
+        page_total = 0
+        pages = 1
+        for count, item in enumerate(data.get('order_items') or [], 1):
+            # Leave room for this row and the page subtotal, otherwise continue on a new page
+            if self.y + 2 * ITEM_ROW_HEIGHT > self.page_break_trigger:
+                self.add_page_subtotal(page_total)
+                self.add_page()
+                self.add_order_items_header()
+                page_total = 0
+                pages += 1
+            
+            item_name = item.get('product_name', 'Product')
+            quantity = item.get('quantity', 1)
+            price = item.get('price', 0)
+            amount = price * quantity
+            page_total += amount
+            
+            # Alternate row colors for better readability
+            fill = count % 2 == 0
+            fill_color = (245, 245, 245) if fill else (255, 255, 255)
+            self.set_fill_color(*fill_color)
+            
+            self.cell(col_widths[0], ITEM_ROW_HEIGHT, str(count), 1, 0, 'C', fill)
+            self.cell(col_widths[1], ITEM_ROW_HEIGHT, self.fit_text(item_name, col_widths[1]), 1, 0, 'L', fill)
+            self.cell(col_widths[2], ITEM_ROW_HEIGHT, str(quantity), 1, 0, 'C', fill)
+            self.cell(col_widths[3], ITEM_ROW_HEIGHT, f'Rs. {price:,.2f}', 1, 0, 'R', fill)
+            self.cell(col_widths[4], ITEM_ROW_HEIGHT, f'Rs. {amount:,.2f}', 1, 1, 'R', fill)
         
-        # Header row
-        self.cell(col_widths[0], 8, 'NO', 1, 0, 'C', True)
-        self.cell(col_widths[1], 8, 'ITEM DESCRIPTION', 1, 0, 'C', True)
-        self.cell(col_widths[2], 8, 'QTY', 1, 0, 'C', True)
-        self.cell(col_widths[3], 8, 'PRICE', 1, 0, 'C', True)
-        self.cell(col_widths[4], 8, 'AMOUNT', 1, 1, 'C', True)
+        if not count:
+            self.cell(sum(col_widths), ITEM_ROW_HEIGHT, 'No items found', 1, 1, 'C')
+        elif pages > 1:
+            self.add_page_subtotal(page_total)
         
-        # Table content
-        self.set_font('Arial', '', 9)
+        self.ln(5)
         
-        if 'order_items' in data and data['order_items']:
-            for i, item in enumerate(data['order_items'], 1):
-                item_name = item.get('product_name', 'Product')
-                quantity = item.get('quantity', 1)
-                price = item.get('price', 0)
-                amount = price * quantity
-                
-                # Alternate row colors for better readability
-                fill = i % 2 == 0
-                fill_color = (245, 245, 245) if fill else (255, 255, 255)
-                self.set_fill_color(*fill_color)
-                
-                self.cell(col_widths[0], 7, str(i), 1, 0, 'C', fill)
-                self.cell(col_widths[1], 7, item_name, 1, 0, 'L', fill)
-                self.cell(col_widths[2], 7, str(quantity), 1, 0, 'C', fill)
-                self.cell(col_widths[3], 7, f'Rs. {price:,.2f}', 1, 0, 'R', fill)
-                self.cell(col_widths[4], 7, f'Rs. {amount:,.2f}', 1, 1, 'R', fill)
-        else:
-            self.cell(sum(col_widths), 7, 'No items found', 1, 1, 'C')
+    def add_order_items_header(self):
+        """Header row of the order items table, repeated on every page it spans"""
+        col_widths = ITEM_COLUMN_WIDTHS
         
-        self.ln(5)
+        def draw_header_row():
+            self.set_font('Arial', 'B', 9)
+            self.set_fill_color(240, 240, 240)
+            self.set_text_color(*TEXT_COLOR)
+            self.cell(col_widths[0], 8, 'NO', 1, 0, 'C', True)
+            self.cell(col_widths[1], 8, 'ITEM DESCRIPTION', 1, 0, 'C', True)
+            self.cell(col_widths[2], 8, 'QTY', 1, 0, 'C', True)
+            self.cell(col_widths[3], 8, 'PRICE', 1, 0, 'C', True)
+            self.cell(col_widths[4], 8, 'AMOUNT', 1, 1, 'C', True)
+            self.set_font('Arial', '', 9)
+        self.template_block('order_items_header', draw_header_row)
+        
+    def add_page_subtotal(self, page_total):
+        """Subtotal row for the items on the current page"""
+        self.set_font('Arial', 'B', 9)
+        self.set_fill_color(240, 240, 240)
+        self.cell(sum(ITEM_COLUMN_WIDTHS[:4]), ITEM_ROW_HEIGHT, 'Page subtotal', 1, 0, 'R', True)
+        self.cell(ITEM_COLUMN_WIDTHS[4], ITEM_ROW_HEIGHT, f'Rs. {page_total:,.2f}', 1, 1, 'R', True)
+        self.set_font('Arial', '', 9)
+        
+    def fit_text(self, text, width):
+        """Shortens text with an ellipsis so it fits in a cell of the given width"""
+        key = (text, width, self.font_family, self.font_style, self.font_size_pt)
+        fitted = FITTED_TEXT.get(key)
+        if fitted is None:
+            fitted = self.shorten_text(text, width)
+            if len(FITTED_TEXT) < FITTED_TEXT_LIMIT:
+                FITTED_TEXT[key] = fitted
+        return fitted
+        
+    def shorten_text(self, text, width):
+        """Cuts text down to the width, measuring each character once"""
+        available = width - 2 * self.c_margin
+        if self.get_string_width(text) <= available:
+            return text
+        
+        char_widths = self.current_font['cw']
+        scale = self.font_size / 1000
+        available -= self.get_string_width('...')
+        used = 0
+        for end, char in enumerate(text):
+            used += char_widths.get(char, 0) * scale
+            if used > available:
+                return text[:end].rstrip() + '...'
+        return text
         
     def add_cart_totals(self, data):
         """Add individual cart totals"""
@@ -282,71 +482,155 @@ class PremiumInvoicePDF(FPDF):
         
     def add_terms_and_notes(self):
         """Add terms, notes and QR code"""
+        self.template_block('terms', self.draw_terms_and_notes)
+        
+    def draw_terms_and_notes(self):
+        """Static terms and notes section"""
         # Terms section
         self.ln(8)
         self.add_colored_section_header('TERMS & CONDITIONS')
         
-        self.set_font('Arial', '', 8)
-        self.multi_cell(0, 4, (
-            "1. All items must be returned within 7 days with original receipt for full refund.\n"
-            "2. Perishable items cannot be returned once purchased.\n"
-            "3. For electronics, original packaging and all accessories must be intact.\n"
-            "4. We reserve the right to verify payments and transactions.\n"
-            "5. For any questions or concerns, please contact customer service."
-        ), 0, 'L')
+        # Smaller blocks too, so they are still reused when the section spans a page break
+        def draw_terms():
+            self.set_font('Arial', '', 8)
+            self.multi_cell(0, 4, (
+                "1. All items must be returned within 7 days with original receipt for full refund.\n"
+                "2. Perishable items cannot be returned once purchased.\n"
+                "3. For electronics, original packaging and all accessories must be intact.\n"
+                "4. We reserve the right to verify payments and transactions.\n"
+                "5. For any questions or concerns, please contact customer service."
+            ), 0, 'L')
+        self.template_block('terms_text', draw_terms)
         
         # Notes section if needed
-        self.ln(5)
-        self.set_font('Arial', 'I', 8)
-        self.cell(0, 5, 'This is a computer-generated invoice and does not require a signature.', 0, 1, 'C')
+        def draw_notes():
+            self.ln(5)
+            self.set_font('Arial', 'I', 8)
+            self.cell(0, 5, 'This is a computer-generated invoice and does not require a signature.', 0, 1, 'C')
+        self.template_block('notes', draw_notes)
+
+def invoice_file_name():
+    """Returns a unique file name for a new invoice."""
+    return f"invoice_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex}.pdf"
+
+def render_invoice(data, use_template=INVOICE_TEMPLATE):
+    """Lays out the invoice and returns the PDF bytes."""
+    # Initialize PDF
+    pdf = PremiumInvoicePDF(use_template)
+    pdf.alias_nb_pages()
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=40)  # Set larger margin for footer
+    
+    # Add content sections
+    pdf.add_address_blocks(data)
+    pdf.add_invoice_details(data)
+    pdf.add_order_items(data)
+    pdf.add_cart_totals(data)
+    pdf.add_payment_summary(data)
+    pdf.add_terms_and_notes()
+    
+    # Render to bytes; FPDF builds the document as a latin-1 string
+    return pdf.output(dest='S').encode('latin-1')
 
+@INVOICE_STAGE_SECONDS.timed('render')
 def generate_invoice_pdf(data):
-    """Generates a professionally designed invoice PDF based on the provided data."""
+    """Renders a professionally designed invoice PDF in memory and returns (file_name, pdf_bytes)."""
     try:
-        # Initialize PDF
-        pdf = PremiumInvoicePDF()
-        pdf.alias_nb_pages()
-        pdf.add_page()
-        pdf.set_auto_page_break(auto=True, margin=40)  # Set larger margin for footer
-        
-        # Add content sections
-        pdf.add_address_blocks(data)
-        pdf.add_invoice_details(data)
-        pdf.add_order_items(data)
-        pdf.add_payment_summary(data)
-        pdf.add_terms_and_notes()
-        
-        # Save the PDF
-        pdf_filename = f"invoice_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-        pdf_path = os.path.join(os.getcwd(), pdf_filename)
-        pdf.output(pdf_path)
-        
-        print(f"✅ Premium PDF Created: {pdf_path}")
-        return pdf_path
+        pdf_bytes = render_invoice(data)
+        pdf_name = invoice_file_name()
+        
+        print(f"✅ Premium PDF Created: {pdf_name} ({len(pdf_bytes)} bytes)")
+        return pdf_name, pdf_bytes
         
     except Exception as e:
         print(f"❌ Error generating PDF: {e}")
         raise
 
-def upload_to_dropbox(local_file_path):
-    """Uploads the PDF to Dropbox and returns a direct download link."""
+# Process-wide Dropbox and Twilio clients, created on first use
+clients = {}
+clients_lock = threading.Lock()
+
+# Last time each host was used, to tell whether its pooled connection is still open
+last_used = {}
+
+def get_dropbox_client():
+    """Returns the shared Dropbox client and its pooled HTTP session."""
+    with clients_lock:
+        if 'dropbox' not in clients:
+            session = dropbox.create_session(max_connections=DROPBOX_MAX_CONNECTIONS)
+            clients['dropbox'] = (dropbox.Dropbox(DROPBOX_ACCESS_TOKEN, session=session), session)
+        return clients['dropbox']
+
+def get_twilio_client():
+    """Returns the shared Twilio client and its pooled HTTP session."""
+    with clients_lock:
+        if 'twilio' not in clients:
+            http_client = TwilioHttpClient(pool_connections=True)
+            clients['twilio'] = (Client(account_sid, auth_token, http_client=http_client), http_client.session)
+        return clients['twilio']
+
+def reset_clients():
+    """Forgets the shared clients, so a forked worker opens its own connections."""
+    global clients_lock
+    clients_lock = threading.Lock()
+    clients.clear()
+    last_used.clear()
+
+os.register_at_fork(after_in_child=reset_clients)
+
+def warm_up_connections():
+    """Opens pooled connections to the Dropbox and Twilio hosts that have gone idle, all at once."""
+    _, dropbox_session = get_dropbox_client()
+    _, twilio_session = get_twilio_client()
+    threads = []
+    for url, session in ((DROPBOX_CONTENT_URL, dropbox_session), (DROPBOX_API_URL, dropbox_session),
+                         (TWILIO_API_URL, twilio_session)):
+        if time.time() - last_used.get(url, 0) > CONNECTION_IDLE_TIMEOUT:
+            # Mark the host as used right away so concurrent invoices don't warm it twice
+            last_used[url] = time.time()
+            thread = threading.Thread(target=warm_up_connection, args=(session, url), daemon=True)
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+def warm_up_connection(session, url):
+    """Sends a HEAD request so the session's pool holds an open connection to the host."""
     try:
-        dbx = dropbox.Dropbox(DROPBOX_ACCESS_TOKEN)
-        dropbox_path = f"/{os.path.basename(local_file_path)}"
+        session.head(url, timeout=10)
+    except Exception as e:
+        last_used.pop(url, None)
+        print(f"Warning: could not connect to {url}: {e}")
+
+def create_shared_link(dbx, dropbox_path):
+    """Creates a shared link for the path, or returns the one it already has."""
+    try:
+        return dbx.sharing_create_shared_link_with_settings(dropbox_path).url
+    except dropbox.exceptions.ApiError as e:
+        if not (isinstance(e.error, dropbox.sharing.CreateSharedLinkWithSettingsError)
+                and e.error.is_shared_link_already_exists()):
+            raise
+        existing = e.error.get_shared_link_already_exists()
+        if existing is not None and existing.is_metadata():
+            return existing.get_metadata().url
+        return dbx.sharing_list_shared_links(path=dropbox_path, direct_only=True).links[0].url
+
+@INVOICE_STAGE_SECONDS.timed('upload')
+def upload_to_dropbox(pdf_bytes, file_name):
+    """Uploads the PDF bytes to Dropbox and returns a direct download link."""
+    try:
+        dbx, _ = get_dropbox_client()
+        dropbox_path = f"/{file_name}"
         
         # Upload the file (overwrite if it already exists)
-        with open(local_file_path, "rb") as file:
-            dbx.files_upload(file.read(), dropbox_path, mode=dropbox.files.WriteMode("overwrite"))
+        dbx.files_upload(pdf_bytes, dropbox_path, mode=dropbox.files.WriteMode("overwrite"))
+        last_used[DROPBOX_CONTENT_URL] = time.time()
         
-        # Check for existing shared link or create a new one
+        # Invoice file names are unique, so go straight to creating the link;
+        # only a retried upload finds one already there
         try:
-            shared_links = dbx.sharing_list_shared_links(path=dropbox_path).links
-            if shared_links:
-                shared_link = shared_links[0].url  # Use the existing link
-            else:
-                # Create a new link if not found
-                shared_link_metadata = dbx.sharing_create_shared_link_with_settings(dropbox_path)
-                shared_link = shared_link_metadata.url
+            shared_link = create_shared_link(dbx, dropbox_path)
+            last_used[DROPBOX_API_URL] = time.time()
         except Exception as e:
             print(f"❌ Error retrieving Dropbox link: {e}")
             return None
@@ -360,25 +644,27 @@ def upload_to_dropbox(local_file_path):
         print(f"❌ Error uploading to Dropbox: {e}")
         raise
 
+def format_phone_number(phone_number):
+    """Returns the number in E.164 form, adding the country code if not present."""
+    if not phone_number.startswith('+'):
+        # Assuming Indian numbers by default
+        return f'+91{phone_number}' if not phone_number.startswith('91') else f'+{phone_number}'
+    return phone_number
+
+@INVOICE_STAGE_SECONDS.timed('sms')
 def send_invoice_via_twilio(phone_number, dropbox_link):
     """Sends the invoice link via Twilio SMS."""
     try:
-        # Initialize Twilio client
-        client = Client(account_sid, auth_token)
-        
-        # Format phone number correctly - add country code if not present
-        if not phone_number.startswith('+'):
-            # Assuming Indian numbers by default
-            formatted_number = f'+91{phone_number}' if not phone_number.startswith('91') else f'+{phone_number}'
-        else:
-            formatted_number = phone_number
+        client, _ = get_twilio_client()
+        formatted_number = format_phone_number(phone_number)
         
         # Send SMS with invoice link
         message = client.messages.create(
             messaging_service_sid=messaging_service_sid,
-            body=f'Thank you for shopping with TheMart! Your invoice can be downloaded at: {dropbox_link}',
+            body=SMS_BODY.format(link=dropbox_link),
             to=formatted_number
         )
+        last_used[TWILIO_API_URL] = time.time()
         
         print(f"✅ SMS sent successfully to {formatted_number}. Message SID: {message.sid}")
         return True
@@ -387,6 +673,97 @@ def send_invoice_via_twilio(phone_number, dropbox_link):
         print(f"❌ Error sending SMS: {e}")
         raise
 
+def create_async_session():
+    """Returns an aiohttp session for the async delivery functions; create it inside the running event loop."""
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=ASYNC_MAX_CONNECTIONS,
+                                     keepalive_timeout=CONNECTION_IDLE_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=ASYNC_REQUEST_TIMEOUT))
+
+async def post_api(session, url, **kwargs):
+    """POSTs to a Dropbox or Twilio endpoint and returns the status and the decoded body."""
+    async with session.post(url, **kwargs) as response:
+        text = await response.text()
+        try:
+            return response.status, json.loads(text)
+        except ValueError:
+            return response.status, text
+
+async def create_shared_link_async(session, headers, dropbox_path):
+    """Creates a shared link for the path, or returns the one it already has."""
+    status, body = await post_api(session, f'{DROPBOX_API_URL}2/sharing/create_shared_link_with_settings',
+                                  json={'path': dropbox_path}, headers=headers)
+    if status == 200:
+        return body['url']
+    error = body.get('error', {}) if isinstance(body, dict) else {}
+    if status != 409 or error.get('.tag') != 'shared_link_already_exists':
+        raise RuntimeError(f'Dropbox API error {status}: {body}')
+    existing = error.get('shared_link_already_exists') or {}
+    if existing.get('.tag') == 'metadata':
+        return existing['metadata']['url']
+    status, body = await post_api(session, f'{DROPBOX_API_URL}2/sharing/list_shared_links',
+                                  json={'path': dropbox_path, 'direct_only': True}, headers=headers)
+    if status != 200 or not body['links']:
+        raise RuntimeError(f'Dropbox API error {status}: {body}')
+    return body['links'][0]['url']
+
+@INVOICE_STAGE_SECONDS.timed('upload')
+async def upload_to_dropbox_async(session, pdf_bytes, file_name):
+    """Uploads the PDF bytes to Dropbox without blocking the event loop and returns a direct download link."""
+    try:
+        dropbox_path = f"/{file_name}"
+        headers = {'Authorization': f'Bearer {DROPBOX_ACCESS_TOKEN}'}
+        
+        # Upload the file (overwrite if it already exists)
+        upload_headers = dict(headers, **{
+            'Content-Type': 'application/octet-stream',
+            'Dropbox-API-Arg': json.dumps({'path': dropbox_path, 'mode': 'overwrite'})
+        })
+        status, body = await post_api(session, f'{DROPBOX_CONTENT_URL}2/files/upload',
+                                      data=pdf_bytes, headers=upload_headers)
+        if status != 200:
+            raise RuntimeError(f'Dropbox API error {status}: {body}')
+        
+        try:
+            shared_link = await create_shared_link_async(session, headers, dropbox_path)
+        except Exception as e:
+            print(f"❌ Error retrieving Dropbox link: {e}")
+            return None
+        
+        # Convert to direct download link
+        direct_link = shared_link.replace("?dl=0", "?dl=1")
+        print(f"✅ File uploaded to Dropbox: {direct_link}")
+        return direct_link
+        
+    except Exception as e:
+        print(f"❌ Error uploading to Dropbox: {e}")
+        raise
+
+@INVOICE_STAGE_SECONDS.timed('sms')
+async def send_invoice_via_twilio_async(session, phone_number, dropbox_link):
+    """Sends the invoice link via Twilio SMS without blocking the event loop."""
+    try:
+        formatted_number = format_phone_number(phone_number)
+        
+        # Send SMS with invoice link
+        status, body = await post_api(
+            session, f'{TWILIO_API_URL}2010-04-01/Accounts/{account_sid}/Messages.json',
+            data={
+                'MessagingServiceSid': messaging_service_sid,
+                'Body': SMS_BODY.format(link=dropbox_link),
+                'To': formatted_number
+            },
+            auth=aiohttp.BasicAuth(account_sid, auth_token)
+        )
+        if status != 201:
+            raise RuntimeError(f'Twilio API error {status}: {body}')
+        
+        print(f"✅ SMS sent successfully to {formatted_number}. Message SID: {body['sid']}")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Error sending SMS: {e}")
+        raise
+
 # Test function for direct execution
 if __name__ == "__main__":
     # Test data with multiple carts
@@ -409,10 +786,10 @@ if __name__ == "__main__":
     
     try:
         # Generate PDF
-        pdf_path = generate_invoice_pdf(test_data)
+        pdf_name, pdf_bytes = generate_invoice_pdf(test_data)
         
         # Upload to Dropbox
-        dropbox_link = upload_to_dropbox(pdf_path)
+        dropbox_link = upload_to_dropbox(pdf_bytes, pdf_name)
         
         # Send SMS
         if dropbox_link:
@@ -0,0 +1,97 @@
+import json
+import math
+import numpy as np
+from json.encoder import encode_basestring_ascii
+
+# Responses are written the way Flask's jsonify writes them: sorted keys, compact
+# separators, ASCII escapes and a trailing newline. Product records carry their
+# static fields already serialized, so only the similarity score and the live units
+# sold are formatted per request; sort order puts 'similarity' between 'price' and
+# 'sub_category', and 'units_sold' last.
+
+# Encoder for everything else, set up once instead of on every json.dumps call
+ENCODER = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+class ProductRecord(dict):
+    """Response record of a product that knows where its pre-serialized JSON is"""
+    __slots__ = ('fragments', 'row')
+
+    def copy(self):
+        return self.fragments.record(self.row, self)
+
+class RecordFragments:
+    """Pre-serialized static JSON of every catalog product, built once per loaded model"""
+    def __init__(self, catalog):
+        categories = [encode_basestring_ascii(category) for category in catalog.categories]
+        sub_categories = [encode_basestring_ascii(sub_category) for sub_category in catalog.sub_categories]
+        barcodes = catalog.barcodes.tolist()
+        names = catalog.names.tolist()
+        image_urls = catalog.image_urls.tolist()
+        category_codes = catalog.category_codes.tolist()
+        sub_category_codes = catalog.sub_category_codes.tolist()
+
+        fragments = []
+        splits = []
+        for idx in range(len(catalog)):
+            prefix = (
+                f'{{"barcode":{encode_basestring_ascii(barcodes[idx])},"category":{categories[category_codes[idx]]},'
+                f'"imageUrl":{encode_basestring_ascii(image_urls[idx])},"name":{encode_basestring_ascii(names[idx])},'
+                f'"price":{ENCODER.encode(catalog.price(idx))},"similarity":'
+            )
+            suffix = f',"sub_category":{sub_categories[sub_category_codes[idx]]},"units_sold":'
+            fragments.append((prefix + suffix).encode('ascii'))
+            splits.append(len(prefix))
+
+        # One ASCII buffer rather than millions of small str objects; each product's text
+        # runs from its offset to the next, the score goes in at its split point and the
+        # units sold at its end
+        offsets = np.zeros(len(fragments) + 1, dtype=np.int64)
+        np.cumsum([len(fragment) for fragment in fragments], out=offsets[1:])
+        self.data = memoryview(b''.join(fragments))
+        self.offsets = memoryview(offsets)
+        self.splits = memoryview(offsets[:-1] + np.array(splits, dtype=np.int64))
+
+    def record(self, idx, fields):
+        # The record keeps these fragments, so it serializes correctly after a model reload
+        record = ProductRecord(fields)
+        record.fragments = self
+        record.row = idx
+        return record
+
+def write(value, parts):
+    """Append the JSON bytes of value to parts"""
+    if isinstance(value, ProductRecord):
+        fragments = value.fragments
+        row = value.row
+        similarity = value['similarity']
+        if isinstance(similarity, float) and math.isfinite(similarity):
+            similarity = float.__repr__(similarity)
+        else:
+            similarity = ENCODER.encode(similarity)
+        split = fragments.splits[row]
+        parts.append(fragments.data[fragments.offsets[row]:split])
+        parts.append(similarity.encode())
+        parts.append(fragments.data[split:fragments.offsets[row + 1]])
+        parts.append(f"{ENCODER.encode(value['units_sold'])}}}".encode())
+    elif isinstance(value, dict):
+        parts.append(b'{')
+        for position, (key, item) in enumerate(sorted(value.items())):
+            parts.append(f'{"," if position else ""}{encode_basestring_ascii(key)}:'.encode())
+            write(item, parts)
+        parts.append(b'}')
+    elif isinstance(value, list):
+        parts.append(b'[')
+        for position, item in enumerate(value):
+            if position:
+                parts.append(b',')
+            write(item, parts)
+        parts.append(b']')
+    else:
+        parts.append(ENCODER.encode(value).encode())
+
+def encode(payload):
+    """Response body for a payload, byte for byte what jsonify produces"""
+    parts = []
+    write(payload, parts)
+    parts.append(b'\n')
+    return b''.join(parts)
@@ -0,0 +1,189 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import sparse
+from model_store import load_catalog, load_manifest, load_tfidf_matrix
+
+# Scatter-gather scoring for the 'exact' mode: the catalog rows are split into
+# contiguous shards, each scored by its own worker process. A worker memory-maps
+# the model artifact and keeps only its own rows of the normalized matrix in
+# memory. For a cart it scores and boosts its rows and returns those that can
+# still make the final ranking; the coordinator runs the diversity pass on the
+# merged candidates, which gives the same result as scoring the whole catalog.
+
+# Shard held by this worker process, set up by init_shard
+shard = None
+
+def row_block(matrix, start, stop):
+    """Rows [start, stop) of a CSR matrix, as views of its data and index arrays"""
+    indptr = np.asarray(matrix.indptr[start:stop + 1])
+    first, last = indptr[0], indptr[-1]
+    return sparse.csr_matrix(
+        (matrix.data[first:last], matrix.indices[first:last], indptr - first),
+        shape=(stop - start, matrix.shape[1])
+    )
+
+class Shard:
+    """Rows [start, stop) of a model artifact, scored inside one worker process"""
+    def __init__(self, model_path, model_version, start, stop):
+        # Imported here so the module stays importable by app itself
+        from app import ProductRecommender, normalized_matrix
+        manifest = load_manifest(model_path)
+        # A model published since the coordinator loaded its own must not be mixed in
+        if manifest['model_version'] != model_version:
+            raise ValueError(f"Model at {model_path} is version {manifest['model_version']}, expected {model_version}")
+        self.start = start
+        self.stop = stop
+
+        # Cart rows can come from any shard, so the raw matrix stays mapped in full
+        self.raw_matrix = load_tfidf_matrix(model_path, manifest)
+        self.tfidf_matrix = normalized_matrix(row_block(self.raw_matrix, start, stop))
+
+        # The boosts read the catalog columns of the candidates and of the cart
+        self.recommender = ProductRecommender()
+        self.recommender.catalog = load_catalog(model_path, manifest)
+
+        # Shard rows grouped by category, in row order within each group
+        codes = np.asarray(self.recommender.catalog.category_codes[start:stop])
+        self.category_order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[self.category_order]
+        self.group_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        self.group_sizes = np.diff(np.r_[self.group_starts, len(codes)])
+
+    def score(self, cart_indices, num_recommendations, max_per_category):
+        """Rows of this shard that can make the final ranking, with their boosted scores"""
+        from app import normalized_matrix, recency_weights
+
+        # Same query vector and products as ProductRecommender.similarity, on this shard's rows
+        weights = recency_weights(len(cart_indices))
+        query = normalized_matrix(self.raw_matrix[cart_indices]).T @ weights[None, :].T
+        similarity = np.ascontiguousarray((self.tfidf_matrix @ query).T)[0]
+
+        # Cart items are no candidates; they keep a score of -inf
+        cart = np.asarray(cart_indices)
+        cart = cart[(cart >= self.start) & (cart < self.stop)] - self.start
+        candidates = np.ones(self.stop - self.start, dtype=bool)
+        candidates[cart] = False
+        scores = np.full(self.stop - self.start, -np.inf)
+        rows = np.flatnonzero(candidates) + self.start
+        scores[candidates] = self.recommender.boost_scores(similarity[candidates], rows, cart_indices)
+
+        positions = self.leading_positions(scores, num_recommendations, max_per_category)
+        return positions + self.start, scores[positions]
+
+    def leading_positions(self, scores, num_recommendations, max_per_category):
+        """Positions among the overall top num_recommendations or their category's top
+        max_per_category, best score first and ties by position, as the diversity pass ranks"""
+        from app import top_k_positions
+
+        # Whatever the diversity pass keeps is in its category's top, and the products
+        # that fill up a short result are in the overall top
+        positions = [top_k_positions(scores, num_recommendations) if num_recommendations > 0 else np.empty(0, dtype=np.intp)]
+        grouped = scores[self.category_order]
+        for _ in range(max_per_category):
+            group_max = np.maximum.reduceat(grouped, self.group_starts)
+            if not np.isfinite(group_max).any():
+                break
+            # First occurrence of each group's maximum, i.e. its lowest row
+            hits = np.flatnonzero(grouped == np.repeat(group_max, self.group_sizes))
+            first = hits[np.searchsorted(hits, self.group_starts)]
+            positions.append(self.category_order[first[np.isfinite(group_max)]])
+            grouped[first] = -np.inf
+
+        positions = np.unique(np.concatenate(positions))
+        return positions[np.isfinite(scores[positions])]
+
+    def update_units_sold(self, rows, values):
+        catalog = self.recommender.catalog
+        if not catalog.units_sold.flags.writeable:
+            catalog.units_sold = np.array(catalog.units_sold)
+        catalog.units_sold[rows] = values
+
+def init_shard(model_path, model_version, start, stop):
+    global shard
+    shard = Shard(model_path, model_version, start, stop)
+
+def shard_ready():
+    return shard.stop - shard.start
+
+def score_shard(cart_indices, num_recommendations, max_per_category):
+    return shard.score(cart_indices, num_recommendations, max_per_category)
+
+def update_shard_units_sold(rows, values):
+    shard.update_units_sold(rows, values)
+
+class ShardPool:
+    """One worker process per row shard of a model artifact"""
+    def __init__(self, model_path, model_version, num_products, num_shards):
+        self.model_path = model_path
+        self.model_version = model_version
+        num_shards = max(1, min(num_shards, num_products))
+        self.bounds = np.linspace(0, num_products, num_shards + 1).astype(int).tolist()
+        self.executors = None
+        self.pid = None
+        # Live units sold sent to the shards, so shards started later get them too
+        self.units_sold = {}
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the shard processes; they load their rows in the background"""
+        with self.lock:
+            # Worker processes and the executors' threads don't survive a fork, so a
+            # forked server worker starts its own
+            if self.closed or (self.executors is not None and self.pid == os.getpid()):
+                return
+            context = multiprocessing.get_context('spawn')
+            self.executors = [
+                ProcessPoolExecutor(1, mp_context=context, initializer=init_shard,
+                                    initargs=(self.model_path, self.model_version, start, stop))
+                for start, stop in zip(self.bounds[:-1], self.bounds[1:])
+            ]
+            self.pid = os.getpid()
+            for executor in self.executors:
+                executor.submit(shard_ready)
+                if self.units_sold:
+                    executor.submit(update_shard_units_sold, list(self.units_sold), list(self.units_sold.values()))
+
+    def update_units_sold(self, rows, values):
+        """Send live units sold to the shards; requests submitted after this see them"""
+        with self.lock:
+            self.units_sold.update(zip(rows, values))
+            if self.closed or self.executors is None or self.pid != os.getpid():
+                return
+            for executor in self.executors:
+                try:
+                    executor.submit(update_shard_units_sold, rows, values)
+                except RuntimeError:
+                    # A broken pool is noticed, and given up on, by the next request
+                    pass
+
+    def score(self, cart_indices, num_recommendations, max_per_category):
+        """Merged candidate rows, in row order, and their boosted scores; None if the
+        shards cannot score"""
+        if self.closed:
+            return None
+        self.start()
+        try:
+            futures = [
+                executor.submit(score_shard, cart_indices, num_recommendations, max_per_category)
+                for executor in self.executors
+            ]
+            results = [future.result() for future in futures]
+        except RuntimeError as e:
+            # Closed by a model reload, or a worker died; a broken pool stays broken
+            if not self.closed:
+                print(f"WARNING: Scoring shards unavailable, scoring in-process: {e}")
+                self.close()
+            return None
+        return np.concatenate([rows for rows, _ in results]), np.concatenate([scores for _, scores in results])
+
+    def close(self):
+        """Stop the shard processes once the work already submitted is done"""
+        with self.lock:
+            self.closed = True
+            if self.executors is not None and self.pid == os.getpid():
+                for executor in self.executors:
+                    executor.shutdown(wait=False)
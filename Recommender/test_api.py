@@ -44,6 +44,33 @@ def test_recommend_endpoint():
     else:
         print("Error:", empty_response.text)
 
+def test_recommend_batch_endpoint():
+    """Test the /recommend/batch endpoint"""
+    url = "http://localhost:5000/recommend/batch"
+    
+    # Test with several carts, including an empty one
+    payload = {
+        "requests": [
+            {"id": "lane-1", "cart_barcodes": ["505628956376", "443957769084"]},
+            {"id": "lane-2", "cart_barcodes": ["167540820391"], "num_recommendations": 5},
+            {"id": "lane-3", "cart_barcodes": []}
+        ],
+        "num_recommendations": 10
+    }
+    
+    # Make POST request
+    response = requests.post(url, json=payload)
+    
+    # Print results
+    print("\nBatch Recommendation Test:")
+    print("Status Code:", response.status_code)
+    if response.status_code == 200:
+        data = response.json()
+        for request_id, result in data['results'].items():
+            print(f"{request_id}: {result['num_recommendations']} recommendations")
+    else:
+        print("Error:", response.text)
+
 def test_top_products_endpoint():
     """Test the /top-products endpoint"""
     url = "http://localhost:5000/top-products?num=5"
@@ -78,11 +105,13 @@ def test_health_endpoint():
         data = response.json()
         print(f"Status: {data['status']}")
         print(f"Model loaded: {data['model_loaded']}")
+        print(f"Model version: {data.get('model_version')}")
     else:
         print("Error:", response.text)
 
 if __name__ == "__main__":
     print("Testing Product Recommender API...")
     test_recommend_endpoint()
+    test_recommend_batch_endpoint()
     test_top_products_endpoint()
     test_health_endpoint()
\ No newline at end of file
@@ -0,0 +1,30 @@
+import pytest
+from app import ProductRecommender
+from benchmark import synthetic_catalog
+from build_model import build_full
+from model_store import save_model_artifact
+
+# A seeded synthetic catalog, built once per test run and stored as a model artifact
+NUM_PRODUCTS = 1200
+CATALOG_SEED = 7
+
+@pytest.fixture(scope='session')
+def catalog():
+    """(product_data, product_keys, vectorizer, tfidf_matrix) of a seeded synthetic catalog"""
+    product_data, product_keys = synthetic_catalog(NUM_PRODUCTS, CATALOG_SEED)
+    return build_full([[product_data[barcode] for barcode in product_keys]])
+
+@pytest.fixture(scope='session')
+def artifact(tmp_path_factory, catalog):
+    product_data, product_keys, vectorizer, tfidf_matrix = catalog
+    path = str(tmp_path_factory.mktemp('models') / 'model')
+    save_model_artifact(path, product_data, product_keys, vectorizer, tfidf_matrix,
+                        model_version='test', sales_through=1000.0)
+    return path
+
+@pytest.fixture
+def model(artifact):
+    """The artifact loaded for in-process scoring, without a results cache"""
+    recommender = ProductRecommender.load_model(artifact, scoring_shards=0)
+    recommender.cache.max_entries = 0
+    return recommender
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import pytest
+import app
+import asgi
+from benchmark_invoice import sample_order
+from invoice_jobs import AsyncInvoiceJobQueue
+from invoice_outbox import NotificationOutbox
+from sales_counters import SalesCounters
+
+async def call(method, path, body=None, headers=None):
+    """(status, headers, body) of one request through the ASGI application"""
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+             'headers': [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]}
+    messages = [{'type': 'http.request', 'body': json.dumps(body).encode() if body is not None else b'',
+                 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.application(scope, receive, send)
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+@pytest.fixture
+def serving(tmp_path, monkeypatch, model):
+    """Both front ends serving the test model, with the stores in temporary files"""
+    outbox = NotificationOutbox(path=str(tmp_path / 'outbox.db'), send=lambda phone, link: True, rate_limit=0,
+                                poll_interval=0.05)
+    monkeypatch.setattr(app, 'recommender', model)
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', 'secret')
+    monkeypatch.setattr(app, 'invoice_outbox', outbox)
+    monkeypatch.setattr(app, 'sales_counters', SalesCounters(path=str(tmp_path / 'sales.db')))
+    return model
+
+def test_routes_answer_like_the_flask_app(catalog, serving):
+    _, product_keys, _, _ = catalog
+    requests = [
+        ('POST', '/recommend', {'cart_barcodes': product_keys[:3]}, {}),
+        ('POST', '/recommend', {'cart_barcodes': product_keys[:2], 'num_recommendations': 5, 'session_id': 's1'}, {}),
+        ('POST', '/recommend', {'cart_barcodes': 'not-a-list'}, {}),
+        ('POST', '/recommend', {}, {}),
+        ('POST', '/recommend/batch', {'requests': [{'id': 1, 'cart_barcodes': product_keys[:2]},
+                                                   {'id': 'b', 'cart_barcodes': [], 'num_recommendations': 3}]}, {}),
+        ('POST', '/recommend/batch', {'requests': [{'id': 1, 'cart_barcodes': []}, {'id': 1, 'cart_barcodes': []}]}, {}),
+        ('GET', '/top-products?num=4', None, {}),
+        ('GET', '/top-products?num=x', None, {}),
+        ('POST', '/admin/reload-model', {}, {'X-Admin-Token': 'wrong'}),
+        ('POST', '/admin/reload-model', {'model_path': '/no/such/model'}, {'X-Admin-Token': 'secret'}),
+        ('POST', '/sales', {'order_items': 'not-a-list'}, {'X-Admin-Token': 'secret'}),
+        ('POST', '/generate-invoice', {'userName': 'No Phone'}, {}),
+        ('GET', '/invoice-jobs/unknown', None, {}),
+    ]
+    client = app.app.test_client()
+
+    async def run():
+        return [await call(method, path, body, headers) for method, path, body, headers in requests]
+
+    for (method, path, body, headers), (status, _, asgi_body) in zip(requests, asyncio.run(run())):
+        response = client.open(path, method=method, json=body, headers=headers)
+        assert (status, asgi_body) == (response.status_code, response.get_data()), (method, path, body)
+
+def test_methods_preflight_and_unknown_paths(serving):
+    async def run():
+        return [
+            await call('GET', '/recommend'),
+            await call('OPTIONS', '/recommend', headers={'Access-Control-Request-Headers': 'content-type'}),
+            await call('HEAD', '/top-products'),
+            await call('GET', '/no-such-route'),
+            await call('GET', '/metrics'),
+        ]
+
+    not_allowed, preflight, head, missing, metrics = asyncio.run(run())
+    assert not_allowed[0] == 405 and not_allowed[1][b'allow'] == b'POST'
+    assert preflight[0] == 200 and preflight[1][b'access-control-allow-headers'] == b'content-type'
+    assert head[0] == 200 and head[2] == b''
+    assert missing[0] == 404
+    assert metrics[0] == 200 and b'recommender_model_loaded 1' in metrics[2]
+
+def test_generate_invoice_runs_on_the_event_loop(tmp_path, serving, monkeypatch):
+    uploads, messages = [], []
+
+    async def upload(session, pdf_bytes, file_name):
+        uploads.append(file_name)
+        return f'https://dl.example.com/{file_name}'
+
+    async def notify(session, phone_number, download_link):
+        messages.append((phone_number, download_link))
+        return True
+
+    jobs = AsyncInvoiceJobQueue(upload=upload, notify=notify, path=str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(asgi, 'invoice_jobs', jobs)
+
+    async def run():
+        status, _, body = await call('POST', '/generate-invoice', sample_order(3))
+        assert status == 202
+        job_id = json.loads(body)['job_id']
+        for _ in range(200):
+            status, _, body = await call('GET', f'/invoice-jobs/{job_id}')
+            job = json.loads(body)
+            if job['status'] in ('completed', 'failed'):
+                break
+            await asyncio.sleep(0.02)
+        await jobs.close()
+        return job
+
+    job = asyncio.run(run())
+    assert (job['status'], job['sms_sent']) == ('completed', True)
+    assert job['download_link'] == f'https://dl.example.com/{uploads[0]}'
+    assert messages == [(sample_order(3)['phone_number'], job['download_link'])]
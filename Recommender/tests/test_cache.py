@@ -0,0 +1,66 @@
+import app
+from app import RecommendationCache
+
+class FakeClock:
+    """Stands in for time.monotonic so entries can be aged without sleeping"""
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RecommendationCache(max_entries=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'size': 2, 'max_entries': 2,
+                             'ttl_seconds': 60}
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(app.time, 'monotonic', clock)
+    cache = RecommendationCache(max_entries=10, ttl=30)
+    cache.put('cart', ['result'])
+    clock.now += 29.9
+    assert cache.get('cart') == ['result']
+    clock.now += 0.1
+    assert cache.get('cart') is None
+    assert cache.stats()['size'] == 0
+
+def test_zero_entries_disables_the_cache():
+    cache = RecommendationCache(max_entries=0)
+    cache.put('cart', ['result'])
+    assert cache.get('cart') is None
+    assert cache.stats()['size'] == 0
+
+def test_clear_drops_every_entry():
+    cache = RecommendationCache(max_entries=10)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.clear()
+    assert cache.get('a') is None and cache.get('b') is None
+
+def test_recommend_serves_repeat_carts_from_the_cache(catalog, model):
+    _, product_keys, _, _ = catalog
+    model.cache.max_entries = 100
+    cart = product_keys[:3]
+    first = model.recommend(cart, 12)
+    # Unknown barcodes don't change the result, so they share the entry
+    assert model.recommend(cart + ['not-a-barcode'], 12) is first
+    assert model.cache.stats()['hits'] == 1
+
+    # Order changes the recency weights, and the count changes the result
+    assert model.recommend(cart[::-1], 12) is not first
+    assert model.recommend(cart, 5) is not first
+    assert model.cache.stats()['size'] == 3
+
+def test_each_loaded_model_starts_with_an_empty_cache(catalog, artifact, model):
+    _, product_keys, _, _ = catalog
+    model.cache.max_entries = 100
+    model.recommend(product_keys[:2], 12)
+    reloaded = app.ProductRecommender.load_model(artifact, scoring_shards=0)
+    assert reloaded.cache.stats()['size'] == 0
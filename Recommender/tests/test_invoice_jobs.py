@@ -0,0 +1,166 @@
+import queue
+import time
+import pytest
+import app
+from benchmark_invoice import sample_order
+from invoice_jobs import InvoiceJobQueue
+from invoice_outbox import NotificationOutbox
+from sales_counters import SalesCounters
+
+def wait_for(condition, timeout=10):
+    """Poll until condition() returns something truthy and return it"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(0.02)
+    raise AssertionError('condition not met in time')
+
+class FakeDropbox:
+    """Stand-in for upload_to_dropbox; fails the first `failures` uploads"""
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.uploads = []
+
+    def __call__(self, pdf_bytes, file_name):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('dropbox unavailable')
+        self.uploads.append((file_name, pdf_bytes))
+        return f'https://dl.example.com/{file_name}'
+
+class FakeTwilio:
+    """Stand-in for send_invoice_via_twilio; fails the first `failures` messages"""
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.messages = []
+
+    def __call__(self, phone_number, download_link):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('twilio unavailable')
+        self.messages.append((phone_number, download_link))
+        return True
+
+@pytest.fixture
+def invoice_app(tmp_path, monkeypatch):
+    """The Flask app with its invoice pipeline on local stand-ins and temporary SQLite files"""
+    dropbox, twilio = FakeDropbox(failures=1), FakeTwilio(failures=1)
+    outbox = NotificationOutbox(path=str(tmp_path / 'outbox.db'), send=twilio, rate_limit=0, retry_delay=0.01,
+                                poll_interval=0.05)
+    jobs = InvoiceJobQueue(upload=dropbox, notify=twilio, warm_up=None, outbox=outbox, workers=1,
+                           retry_delay=0.01, path=str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(app, 'invoice_outbox', outbox)
+    monkeypatch.setattr(app, 'invoice_jobs', jobs)
+    monkeypatch.setattr(app, 'sales_counters', SalesCounters(path=str(tmp_path / 'sales.db')))
+    return app.app.test_client(), jobs, dropbox, twilio
+
+def test_generate_invoice_runs_through_to_a_sent_sms(invoice_app):
+    client, jobs, dropbox, twilio = invoice_app
+    data = sample_order(5)
+    response = client.post('/generate-invoice', json=data)
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    def delivered_job():
+        job = client.get(f'/invoice-jobs/{job_id}').get_json()
+        return job if job['sms_sent'] else None
+
+    job = wait_for(delivered_job)
+    assert job['status'] == 'completed'
+    assert job['attempts'] == {'rendering': 1, 'uploading': 2, 'notifying': 1}
+    assert job['download_link'] == f'https://dl.example.com/{dropbox.uploads[0][0]}'
+    assert dropbox.uploads[0][1].startswith(b'%PDF')
+
+    # The outbox retried the failed message and recorded the delivery
+    assert job['sms']['status'] == 'sent' and job['sms']['attempts'] == 2
+    assert twilio.messages == [(data['phone_number'], job['download_link'])]
+    assert jobs.outbox.status(data['razorpay_order_id'])['status'] == 'sent'
+
+def test_generate_invoice_rejects_incomplete_requests(invoice_app):
+    client, _, _, _ = invoice_app
+    response = client.post('/generate-invoice', json={'userName': 'No Phone'})
+    assert response.status_code == 400
+    assert client.get('/invoice-jobs/not-a-job').status_code == 404
+
+def render(data):
+    """Stand-in for generate_invoice_pdf"""
+    return f"invoice_{data['razorpay_order_id']}.pdf", b'%PDF-1.3 stand-in'
+
+def stored_payload(jobs, job_id):
+    return jobs.connect().execute('SELECT payload, owner FROM invoice_jobs WHERE job_id = ?', (job_id,)).fetchone()
+
+def test_job_moves_through_its_stages(tmp_path):
+    stages = []
+    def upload(pdf_bytes, file_name):
+        stages.append(jobs.get(job_id)['status'])
+        return f'https://dl.example.com/{file_name}'
+    jobs = InvoiceJobQueue(render=render, upload=upload, notify=FakeTwilio(), warm_up=None, workers=0,
+                           path=str(tmp_path / 'jobs.db'))
+    job_id = jobs.create_job(sample_order(2))
+    job = jobs.get(job_id)
+    assert (job['status'], job['stage'], job['attempts']) == ('queued', None, {})
+
+    jobs.run_job(job_id, sample_order(2))
+    job = jobs.get(job_id)
+    assert stages == ['uploading']
+    assert (job['status'], job['stage'], job['sms_sent']) == ('completed', None, True)
+    assert job['attempts'] == {'rendering': 1, 'uploading': 1, 'notifying': 1}
+    # The request is only kept until the job is done
+    assert stored_payload(jobs, job_id)[0] is None
+
+def test_job_fails_after_its_stage_attempts(tmp_path):
+    jobs = InvoiceJobQueue(render=render, upload=FakeDropbox(failures=5), warm_up=None, workers=1, attempts=2,
+                           retry_delay=0.01, path=str(tmp_path / 'jobs.db'))
+    job_id = jobs.submit(sample_order(2))
+    job = wait_for(lambda: jobs.get(job_id)['status'] == 'failed' and jobs.get(job_id))
+    assert job['attempts'] == {'rendering': 1, 'uploading': 2}
+    assert job['error'] == 'uploading failed after 2 attempts: dropbox unavailable'
+    assert jobs.stats()['failed'] == 1
+
+def test_full_or_stopping_queue_refuses_jobs(tmp_path):
+    jobs = InvoiceJobQueue(render=render, warm_up=None, workers=0, queue_size=1, sweep_interval=3600,
+                           path=str(tmp_path / 'jobs.db'))
+    jobs.submit(sample_order(1))
+    with pytest.raises(queue.Full):
+        jobs.submit(sample_order(1))
+    # The refused job leaves no record behind
+    assert jobs.statuses() == {'queued': 1}
+
+    jobs.stop(timeout=0)
+    jobs.pending.get_nowait()
+    with pytest.raises(queue.Full):
+        jobs.submit(sample_order(1))
+
+def test_released_jobs_are_resumed_by_another_worker(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    # A worker that queued jobs but shuts down before running them
+    stopping = InvoiceJobQueue(render=render, warm_up=None, workers=0, sweep_interval=3600, path=path)
+    job_ids = [stopping.submit(dict(sample_order(1), razorpay_order_id=f'order-{i}')) for i in range(3)]
+    stopping.stop(timeout=0)
+    assert all(stored_payload(stopping, job_id)[1] is None for job_id in job_ids)
+
+    dropbox = FakeDropbox()
+    other = InvoiceJobQueue(render=render, upload=dropbox, notify=FakeTwilio(), warm_up=None, workers=1,
+                            sweep_interval=3600, path=path)
+    other.start()
+    wait_for(lambda: other.statuses() == {'completed': 3})
+    assert sorted(name for name, _ in dropbox.uploads) == [f'invoice_order-{i}.pdf' for i in range(3)]
+
+def test_jobs_of_a_silent_worker_are_taken_over(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    # A worker killed mid-job: its rows stay claimed, and nothing marks them alive any more
+    killed = InvoiceJobQueue(render=render, warm_up=None, workers=0, path=path)
+    job_id = killed.create_job(sample_order(1))
+    killed.start_attempt(job_id, 'uploading', 1)
+
+    other = InvoiceJobQueue(render=render, warm_up=None, workers=0, stale_after=0.2, path=path)
+    own_job = other.create_job(sample_order(2))
+    assert other.sweep(10) == []
+    time.sleep(0.3)
+    # The sweep marks the other worker's own job alive, so only the silent worker's is taken over
+    assert other.sweep(10) == [(job_id, sample_order(1))]
+    owners = dict(other.connect().execute('SELECT job_id, owner FROM invoice_jobs').fetchall())
+    assert owners == {job_id: other.owner, own_job: other.owner}
+    assert other.get(job_id)['status'] == 'queued'
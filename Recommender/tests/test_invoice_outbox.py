@@ -0,0 +1,111 @@
+import time
+import pytest
+from invoice_outbox import NotificationOutbox
+
+class FlakySender:
+    """Stand-in for send_invoice_via_twilio; fails for the phone numbers in `failing`"""
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    def __call__(self, phone_number, download_link):
+        if phone_number in self.failing:
+            raise ConnectionError('provider unavailable')
+        self.sent.append((phone_number, time.monotonic()))
+        return True
+
+@pytest.fixture
+def outbox_path(tmp_path):
+    return str(tmp_path / 'outbox.db')
+
+def make_outbox(path, send, **options):
+    """An outbox whose dispatcher thread is never started; tests drive it step by step"""
+    outbox = NotificationOutbox(path=path, send=send, **options)
+    outbox.start = lambda: None
+    return outbox
+
+def due_now(outbox):
+    outbox.connect().execute('UPDATE notifications SET next_attempt_at = 0')
+
+def test_one_notification_per_order(outbox_path):
+    outbox = make_outbox(outbox_path, FlakySender())
+    assert outbox.enqueue('order-1', '111', 'https://dl/1')
+    assert not outbox.enqueue('order-1', '111', 'https://dl/1-again')
+    assert outbox.stats() == {'pending': 1, 'sent': 0, 'failed': 0}
+
+def test_failed_sends_back_off_then_give_up(outbox_path):
+    sender = FlakySender(failing={'222'})
+    outbox = make_outbox(outbox_path, sender, max_attempts=3, retry_delay=10, max_retry_delay=15)
+    outbox.enqueue('order-ok', '111', 'https://dl/ok')
+    outbox.enqueue('order-bad', '222', 'https://dl/bad')
+
+    before = time.time()
+    outbox.send_batch(outbox.claim_batch())
+    assert outbox.status('order-ok')['status'] == 'sent'
+    bad = outbox.status('order-bad')
+    assert (bad['status'], bad['attempts'], bad['error']) == ('pending', 1, 'provider unavailable')
+    # Not due again until the backoff has passed
+    assert outbox.claim_batch() == []
+    next_attempt = outbox.connect().execute(
+        "SELECT next_attempt_at FROM notifications WHERE order_id = 'order-bad'").fetchone()[0]
+    assert before + 10 <= next_attempt <= time.time() + 10
+
+    for _ in range(2):
+        due_now(outbox)
+        outbox.send_batch(outbox.claim_batch())
+    assert outbox.status('order-bad')['status'] == 'failed'
+    assert outbox.status('order-bad')['attempts'] == 3
+    assert [phone for phone, _ in sender.sent] == ['111']
+
+def test_a_claimed_batch_is_not_claimed_again(outbox_path):
+    first = make_outbox(outbox_path, FlakySender())
+    second = make_outbox(outbox_path, FlakySender())
+    for i in range(5):
+        first.enqueue(f'order-{i}', str(i), f'https://dl/{i}')
+    assert len(first.claim_batch()) == 5
+    assert second.claim_batch() == []
+
+def test_sends_are_spaced_by_the_rate_limit(outbox_path):
+    sender = FlakySender()
+    outbox = make_outbox(outbox_path, sender, rate_limit=50)
+    for i in range(6):
+        outbox.enqueue(f'order-{i}', str(i), f'https://dl/{i}')
+    assert outbox.acquire_lease()
+    outbox.send_batch(outbox.claim_batch())
+    times = [sent_at for _, sent_at in sender.sent]
+    assert len(times) == 6
+    assert all(later - earlier >= 0.019 for earlier, later in zip(times, times[1:]))
+
+def test_only_the_lease_holder_dispatches(outbox_path):
+    first = make_outbox(outbox_path, FlakySender(), lease_timeout=0.2)
+    second = make_outbox(outbox_path, FlakySender(), lease_timeout=0.2)
+    assert first.acquire_lease()
+    assert not second.acquire_lease()
+    # The holder renews its own lease
+    assert first.acquire_lease()
+
+    # An expired lease is taken over by the next dispatcher that asks
+    time.sleep(0.25)
+    assert second.acquire_lease()
+    assert not first.acquire_lease()
+
+    # A stopping dispatcher hands it over at once
+    second.stop()
+    assert first.acquire_lease()
+
+def test_a_lost_lease_hands_the_rest_of_the_batch_back(outbox_path):
+    sender = FlakySender()
+    first = make_outbox(outbox_path, sender, lease_timeout=30)
+    second = make_outbox(outbox_path, FlakySender(), lease_timeout=30)
+    for i in range(3):
+        first.enqueue(f'order-{i}', str(i), f'https://dl/{i}')
+    rows = first.claim_batch()
+
+    # The lease went to another dispatcher before this batch started
+    second.acquire_lease()
+    first.lease_renewed_at = 0
+    first.send_batch(rows)
+    assert sender.sent == []
+    assert first.stats() == {'pending': 3, 'sent': 0, 'failed': 0}
+    assert [status['attempts'] for status in map(first.status, ['order-0', 'order-1', 'order-2'])] == [0, 0, 0]
+    assert len(second.claim_batch()) == 3
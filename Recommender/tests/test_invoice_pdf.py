@@ -0,0 +1,41 @@
+import re
+import threading
+import zlib
+import send_invoice
+from benchmark_invoice import sample_order
+from send_invoice import render_invoice
+
+def page_count(pdf_bytes):
+    return int(re.search(rb'/Type /Pages\n/Kids \[[^\]]*\]\n/Count (\d+)', pdf_bytes).group(1))
+
+def page_text(pdf_bytes):
+    """Text shown on the pages, in drawing order"""
+    streams = re.findall(rb'/Filter /FlateDecode /Length \d+>>\nstream\n(.*?)\nendstream', pdf_bytes, re.S)
+    text = b''.join(zlib.decompress(stream) for stream in streams)
+    return re.findall(rb'\((.*?)\) Tj', text)
+
+def test_invoices_render_directly_by_default(monkeypatch):
+    monkeypatch.setattr(send_invoice, 'TEMPLATE_BLOCKS', {})
+    pdf_bytes = render_invoice(sample_order(5))
+    assert pdf_bytes.startswith(b'%PDF') and page_text(pdf_bytes)
+    assert send_invoice.TEMPLATE_BLOCKS == {}
+
+def test_template_renders_the_same_text_from_many_threads(monkeypatch):
+    monkeypatch.setattr(send_invoice, 'TEMPLATE_BLOCKS', {})
+    data = sample_order(60)
+    direct = render_invoice(data, use_template=False)
+
+    rendered = []
+    threads = [threading.Thread(target=lambda: rendered.append(render_invoice(data, use_template=True)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert send_invoice.TEMPLATE_BLOCKS
+    # The invoice number differs between invoices; everything else must not
+    expected = [text for text in page_text(direct) if not text.startswith(b'No: INV-')]
+    for pdf_bytes in rendered + [render_invoice(data, use_template=True)]:
+        assert page_count(pdf_bytes) == page_count(direct)
+        assert [text for text in page_text(pdf_bytes) if not text.startswith(b'No: INV-')] == expected
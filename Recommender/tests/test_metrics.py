@@ -0,0 +1,64 @@
+import os
+import metrics
+from metrics import Histogram, MetricsStore
+
+def make_histogram(registry):
+    histogram = Histogram('test_seconds', 'Test timings.', ('route',), buckets=(0.1, 1))
+    metrics.REGISTRY.remove(histogram)
+    registry.append(histogram)
+    return histogram
+
+def sample(lines, text):
+    return next(float(line.rsplit(' ', 1)[1]) for line in lines if line.startswith(text + ' '))
+
+def test_a_scrape_covers_every_worker(tmp_path):
+    path = str(tmp_path / 'metrics.db')
+    # Two workers, each with its own copy of the histograms
+    first_registry, second_registry = [], []
+    first, second = make_histogram(first_registry), make_histogram(second_registry)
+    first_store = MetricsStore(path=path, registry=first_registry)
+    second_store = MetricsStore(path=path, registry=second_registry)
+
+    first.observe(0.05, '/recommend')
+    first.observe(0.5, '/recommend')
+    second.observe(2, '/recommend')
+    second.observe(0.05, '/health')
+    second_store.publish()
+
+    lines = first.render(first_store.collect()['test_seconds'])
+    assert sample(lines, 'test_seconds_bucket{route="/recommend",le="0.1"}') == 1
+    assert sample(lines, 'test_seconds_bucket{route="/recommend",le="1"}') == 2
+    assert sample(lines, 'test_seconds_count{route="/recommend"}') == 3
+    assert sample(lines, 'test_seconds_sum{route="/recommend"}') == 2.55
+    assert sample(lines, 'test_seconds_count{route="/health"}') == 1
+
+def test_an_exited_worker_still_counts(tmp_path):
+    path = str(tmp_path / 'metrics.db')
+    registry = []
+    histogram = make_histogram(registry)
+    worker = MetricsStore(path=path, registry=registry)
+    master = MetricsStore(path=path, registry=[])
+
+    histogram.observe(0.5, '/recommend')
+    worker.publish()
+    master.retire(os.getpid())
+    # A recycled worker's replacement publishes from zero under the same pid
+    histogram.reset()
+    histogram.observe(0.05, '/recommend')
+    worker.connection = None
+    worker.publish()
+    master.retire(os.getpid())
+
+    rows = master.connect().execute('SELECT owner FROM metric_snapshots').fetchall()
+    assert rows == [('exited',)]
+    lines = histogram.render(master.collect()['test_seconds'])
+    assert sample(lines, 'test_seconds_count{route="/recommend"}') == 2
+
+    master.reset()
+    assert master.collect() == {}
+
+def test_render_without_a_shared_file_is_per_process(monkeypatch):
+    monkeypatch.setattr(metrics, 'STORE', MetricsStore(path=''))
+    text = metrics.render(['extra 1'])
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert text.endswith('extra 1\n')
@@ -0,0 +1,235 @@
+import json
+from collections import defaultdict
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+import app
+import serializer
+from app import ProductRecommender
+from build_model import product_text
+from model_store import load_model_artifact, save_model_artifact
+
+# Every scoring path must rank a cart exactly as the original scorer did: dense cosine
+# similarity, per-product boosts, sigmoid normalization, a stable sort and the category
+# cap. reference_recommendations below is that scorer, kept as it was written. The
+# catalog, artifact and model fixtures are in conftest.py.
+SEED = 7
+
+def reference_top_selling(product_data, num_recommendations, exclude_barcodes=()):
+    products = sorted(
+        [p for barcode, p in product_data.items() if barcode not in exclude_barcodes],
+        key=lambda x: x.get('units_sold', 0),
+        reverse=True
+    )
+    return [dict(barcode=p['barcode'], similarity=0.5) for p in products[:num_recommendations]]
+
+def reference_recommendations(product_data, product_keys, tfidf_matrix, cart_barcodes,
+                              num_recommendations=12, max_per_category=3):
+    """Recommendations of the original dense scorer, as (barcode, similarity) records"""
+    idx_map = {barcode: i for i, barcode in enumerate(product_keys)}
+    cart_indices = [idx_map[barcode] for barcode in cart_barcodes if barcode in idx_map]
+    if not cart_indices:
+        return reference_top_selling(product_data, num_recommendations)
+
+    cosine_sim = cosine_similarity(tfidf_matrix[cart_indices], tfidf_matrix)
+    weighted = np.average(cosine_sim, axis=0, weights=np.linspace(0.8, 1.0, len(cart_indices)))
+
+    cart = [product_data[b] for b in cart_barcodes]
+    avg_cart_price = sum(p['price'] for p in cart) / len(cart)
+    recommended = []
+    for i, score in enumerate(weighted):
+        product = product_data[product_keys[i]]
+        if product['barcode'] in cart_barcodes:
+            continue
+        if product['category'] in [p['category'] for p in cart]:
+            score *= 1.3
+        if product['sub_category'] in [p['sub_category'] for p in cart]:
+            score *= 1.2
+        score *= min(1 + product['units_sold'] / 1000, 1.5)
+        price_ratio = min(product['price'], avg_cart_price) / max(product['price'], avg_cart_price)
+        score *= 0.7 + 0.3 * price_ratio
+        recommended.append({'barcode': product['barcode'], 'category': product['category'], 'similarity': score})
+
+    similarities = np.array([rec['similarity'] for rec in recommended])
+    normalized = 1 / (1 + np.exp(-5 * (similarities / similarities.max() - 0.5)))
+    for rec, value in zip(recommended, normalized):
+        rec['similarity'] = value
+    recommended.sort(key=lambda x: x['similarity'], reverse=True)
+
+    category_counts = defaultdict(int)
+    final = []
+    for rec in recommended:
+        if category_counts[rec['category']] < max_per_category:
+            final.append(rec)
+            category_counts[rec['category']] += 1
+        if len(final) == num_recommendations:
+            break
+    if len(final) < num_recommendations:
+        chosen = {rec['barcode'] for rec in final}
+        final.extend([rec for rec in recommended if rec['barcode'] not in chosen][:num_recommendations - len(final)])
+    if len(final) < num_recommendations:
+        final.extend(reference_top_selling(
+            product_data, num_recommendations - len(final),
+            exclude_barcodes=list(cart_barcodes) + [rec['barcode'] for rec in final]
+        ))
+    return [{'barcode': rec['barcode'], 'similarity': rec['similarity']} for rec in final[:num_recommendations]]
+
+def assert_same_ranking(recommendations, expected, product_data):
+    assert [rec['barcode'] for rec in recommendations] == [rec['barcode'] for rec in expected]
+    for rec, ref in zip(recommendations, expected):
+        assert rec['similarity'] == pytest.approx(ref['similarity'], rel=1e-5)
+        product = product_data[rec['barcode']]
+        assert rec['units_sold'] == product['units_sold']
+        assert (rec['name'], rec['price'], rec['category']) == (product['name'], product['price'], product['category'])
+
+def seeded_carts(product_keys, count=40, seed=SEED):
+    rng = np.random.default_rng(seed)
+    carts = []
+    for size in rng.integers(1, 7, count):
+        carts.append([product_keys[i] for i in rng.choice(len(product_keys), size, replace=False)])
+    nums = rng.choice([1, 5, 12, 30], count).tolist()
+    return carts, nums
+
+def test_single_cart_matches_reference(catalog, model):
+    product_data, product_keys, _, tfidf_matrix = catalog
+    carts, nums = seeded_carts(product_keys)
+    for cart, num in zip(carts, nums):
+        expected = reference_recommendations(product_data, product_keys, tfidf_matrix, cart, num)
+        assert_same_ranking(model.recommend(cart, num), expected, product_data)
+
+def test_empty_and_unknown_carts_return_top_sellers(catalog, model):
+    product_data, _, _, _ = catalog
+    expected = reference_top_selling(product_data, 12)
+    assert_same_ranking(model.recommend([], 12), expected, product_data)
+    assert_same_ranking(model.recommend(['not-a-barcode'], 12), expected, product_data)
+    excluded = [rec['barcode'] for rec in expected[:3]]
+    assert_same_ranking(model.get_top_selling_products(12, exclude_barcodes=excluded),
+                        reference_top_selling(product_data, 12, excluded), product_data)
+
+def test_batch_matches_reference(catalog, model):
+    product_data, product_keys, _, tfidf_matrix = catalog
+    carts, nums = seeded_carts(product_keys, seed=SEED + 1)
+    carts.append([])
+    nums.append(12)
+    for cart, num, recommendations in zip(carts, nums, model.recommend_batch(carts, nums)):
+        expected = reference_recommendations(product_data, product_keys, tfidf_matrix, cart, num)
+        assert_same_ranking(recommendations, expected, product_data)
+
+def test_session_matches_reference(catalog, model):
+    product_data, product_keys, _, tfidf_matrix = catalog
+    rng = np.random.default_rng(SEED + 2)
+    # A shopper scanning items one by one, then removing one from the middle
+    scans = [product_keys[i] for i in rng.choice(len(product_keys), 6, replace=False)]
+    carts = [scans[:size] for size in range(1, len(scans) + 1)] + [scans[:2] + scans[3:]]
+    for cart in carts:
+        expected = reference_recommendations(product_data, product_keys, tfidf_matrix, cart, 12)
+        assert_same_ranking(model.recommend(cart, 12, session_id='shopper'), expected, product_data)
+
+def test_session_keeps_sums_and_computes_only_added_rows(catalog, model):
+    _, product_keys, _, _ = catalog
+    computed = []
+    def compute_rows(indices):
+        computed.append(list(indices))
+        return model.row_similarity(indices)
+
+    session = app.CartSession(len(product_keys))
+    session.update([3, 5], compute_rows)
+    session.update([3, 5, 9], compute_rows)
+    assert computed == [[3, 5], [9]]
+    # A removal starts over from the cart
+    session.update([3, 9], compute_rows)
+    assert computed[-1] == [3, 9]
+    assert np.allclose(session.weighted_similarity(), app.recency_weights(2) @ np.array(model.row_similarity([3, 9])))
+
+def test_session_store_is_bounded_by_memory():
+    # Two float64 rows of 1000 products are 16000 bytes per session
+    store = app.CartSessionStore(max_sessions=100, max_bytes=50000)
+    sessions = [store.get(f'shopper-{i}', 1000) for i in range(5)]
+    assert list(store.sessions) == ['shopper-2', 'shopper-3', 'shopper-4']
+    assert store.get('shopper-4', 1000) is sessions[4]
+
+def test_full_neighbor_index_matches_reference(catalog, artifact):
+    product_data, product_keys, _, tfidf_matrix = catalog
+    # With every other product as a neighbor the index holds every positive similarity
+    recommender = ProductRecommender.load_model(artifact, similarity_mode='neighbors',
+                                                num_neighbors=len(product_keys) - 1)
+    recommender.cache.max_entries = 0
+    carts, nums = seeded_carts(product_keys, seed=SEED + 3)
+    for cart, num in zip(carts, nums):
+        expected = reference_recommendations(product_data, product_keys, tfidf_matrix, cart, num)
+        assert_same_ranking(recommender.recommend(cart, num), expected, product_data)
+
+def test_sharded_scoring_matches_reference(catalog, artifact):
+    product_data, product_keys, _, tfidf_matrix = catalog
+    recommender = ProductRecommender.load_model(artifact, scoring_shards=3)
+    recommender.cache.max_entries = 0
+    try:
+        carts, nums = seeded_carts(product_keys, count=15, seed=SEED + 4)
+        for cart, num in zip(carts, nums):
+            expected = reference_recommendations(product_data, product_keys, tfidf_matrix, cart, num)
+            assert_same_ranking(recommender.recommend(cart, num), expected, product_data)
+        # Served by the shards rather than the in-process fallback
+        assert not recommender.shards.closed
+    finally:
+        recommender.shards.close()
+
+def test_live_sales_rank_like_updated_units(catalog, model):
+    product_data, product_keys, _, tfidf_matrix = catalog
+    rng = np.random.default_rng(SEED + 5)
+    sold = {product_keys[i]: int(q) for i, q in zip(rng.choice(len(product_keys), 50, replace=False),
+                                                       rng.integers(1, 3000, 50))}
+    model.apply_sales(sold)
+    updated = {barcode: dict(product, units_sold=product['units_sold'] + sold.get(barcode, 0))
+               for barcode, product in product_data.items()}
+
+    assert_same_ranking(model.recommend([], 30), reference_top_selling(updated, 30), updated)
+    carts, nums = seeded_carts(product_keys, count=20, seed=SEED + 6)
+    for cart, num in zip(carts, nums):
+        expected = reference_recommendations(updated, product_keys, tfidf_matrix, cart, num)
+        assert_same_ranking(model.recommend(cart, num), expected, updated)
+
+def test_model_artifact_round_trip(catalog, artifact):
+    product_data, product_keys, vectorizer, tfidf_matrix = catalog
+    model_data = load_model_artifact(artifact)
+    manifest = model_data['manifest']
+    assert (manifest['model_version'], manifest['sales_through']) == ('test', 1000.0)
+    assert manifest['num_products'] == len(product_keys)
+
+    assert model_data['catalog'].records() == [product_data[barcode] for barcode in product_keys]
+    assert model_data['catalog'].rows(product_keys[::-1]) == list(range(len(product_keys)))[::-1]
+    assert (model_data['tfidf_matrix'] != tfidf_matrix).nnz == 0
+
+    texts = [product_text(product_data[barcode]) for barcode in product_keys[:50]]
+    loaded = model_data['vectorizer']
+    assert loaded.vocabulary_ == vectorizer.vocabulary_
+    assert np.allclose(loaded.transform(texts).toarray(), vectorizer.transform(texts).toarray())
+
+def test_neighbor_index_round_trip(catalog, tmp_path):
+    product_data, product_keys, vectorizer, tfidf_matrix = catalog
+    recommender = ProductRecommender()
+    recommender.tfidf_matrix = app.normalized_matrix(tfidf_matrix)
+    recommender.build_neighbor_index(20)
+    path = str(tmp_path / 'model')
+    save_model_artifact(path, product_data, product_keys, vectorizer, tfidf_matrix,
+                        neighbor_indices=recommender.neighbor_indices, neighbor_scores=recommender.neighbor_scores)
+    model_data = load_model_artifact(path)
+    assert model_data['manifest']['num_neighbors'] == 20
+    assert np.array_equal(model_data['neighbor_indices'], recommender.neighbor_indices)
+    assert np.array_equal(model_data['neighbor_scores'], recommender.neighbor_scores)
+
+def test_serializer_matches_jsonify(catalog, model):
+    _, product_keys, _, _ = catalog
+    carts, nums = seeded_carts(product_keys, count=5, seed=SEED + 7)
+    model.apply_sales({product_keys[0]: 5})
+    payloads = [
+        app.recommend_payload(carts[0], model.recommend(carts[0], nums[0])),
+        app.batch_payload(['a', 'b'], carts[1:3], model.recommend_batch(carts[1:3], 12)),
+        app.top_products_payload(model.get_top_selling_products(40)),
+        {'text': 'café ☃ "quoted"', 'values': [1, 2.5, None, True], 'nested': {'b': 1, 'a': [float('nan')]}}
+    ]
+    with app.app.app_context():
+        for payload in payloads:
+            body = serializer.encode(payload)
+            assert body == app.jsonify(payload).get_data()
+            if 'nested' not in payload:
+                assert json.loads(body) == json.loads(json.dumps(payload))
@@ -0,0 +1,76 @@
+import os
+import time
+import pytest
+import app
+from sales_counters import SalesCounters
+
+def wait_for(condition, timeout=10):
+    """Poll until condition() returns something truthy and return it"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(0.02)
+    raise AssertionError('condition not met in time')
+
+@pytest.fixture
+def serving(tmp_path, monkeypatch, model):
+    """app serving the test model, with its reload requests and sales in temporary files"""
+    monkeypatch.setattr(app, 'MODEL_RELOAD_PATH', str(tmp_path / 'model_reload.json'))
+    monkeypatch.setattr(app, 'sales_counters', SalesCounters(path=str(tmp_path / 'sales.db')))
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', 'secret')
+    monkeypatch.setattr(app, 'recommender', model)
+    monkeypatch.setattr(app, 'applied_reload', None)
+    return model
+
+def test_reload_swaps_in_a_validated_model(serving, artifact, tmp_path):
+    serving.cache.max_entries = 100
+    assert app.reload_recommender_model(artifact)
+    assert app.recommender is not serving
+    assert app.recommender.cache.stats()['size'] == 0
+
+    # A model that fails to load leaves the current one serving
+    current = app.recommender
+    assert not app.reload_recommender_model(str(tmp_path / 'missing'))
+    assert app.recommender is current
+
+def test_reload_request_needs_the_admin_token(serving, tmp_path):
+    assert app.start_model_reload(None, {})[1] == 403
+    assert app.start_model_reload('secret', {'model_path': str(tmp_path / 'model.pkl')})[1] == 400
+    assert app.read_reload_request() is None
+
+def test_reload_request_reaches_the_other_workers(serving, artifact):
+    payload, status = app.start_model_reload('secret', {'model_path': artifact})
+    assert status == 202
+    reload_request = app.read_reload_request()
+    assert (reload_request['id'], reload_request['model_path']) == (app.applied_reload, artifact)
+    # The worker that took the request reloads at once
+    wait_for(lambda: app.recommender is not serving)
+
+    # Another worker, which hasn't seen the request yet, picks it up on its watcher's next poll
+    reloaded = app.recommender
+    app.applied_reload = None
+    app.poll_model_updates(artifact, app.watched_signature(artifact))
+    assert app.recommender is not reloaded
+    assert app.applied_reload == reload_request['id']
+
+    # Acted on once only
+    current = app.recommender
+    app.poll_model_updates(artifact, app.watched_signature(artifact))
+    assert app.recommender is current
+
+def test_worker_forked_after_a_publish_catches_up(serving, artifact):
+    last_signature = app.watched_signature(artifact)
+    assert app.poll_model_updates(artifact, last_signature) == last_signature
+    assert app.recommender is serving
+
+    # The model was published again after the master loaded the one this worker inherited
+    manifest = os.path.join(artifact, 'manifest.json')
+    published = os.stat(manifest)
+    try:
+        os.utime(manifest, (published.st_atime, published.st_mtime + 5))
+        assert app.poll_model_updates(artifact, app.watched_signature(artifact)) == published.st_mtime + 5
+        assert app.recommender is not serving
+    finally:
+        os.utime(manifest, (published.st_atime, published.st_mtime))
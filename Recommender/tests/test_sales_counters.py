@@ -0,0 +1,76 @@
+import time
+import numpy as np
+import pytest
+from sales_counters import SalesCounters, TopSellingRanking, order_lines
+
+@pytest.fixture
+def sales_path(tmp_path):
+    return str(tmp_path / 'sales.db')
+
+def make_counters(path, **options):
+    """Counters whose flush thread is never started; tests flush them directly"""
+    counters = SalesCounters(path=path, **options)
+    counters.start = lambda: None
+    return counters
+
+def test_order_lines_skip_items_that_cannot_be_counted():
+    items = [{'product_barcode': 'a', 'quantity': 2}, {'product_barcode': 'a'}, {'product_barcode': 'b', 'quantity': 1.0},
+             {'product_barcode': 'c', 'quantity': 0}, {'product_barcode': 'd', 'quantity': True},
+             {'product_barcode': 'e', 'quantity': 1.5}, {'quantity': 3}, 'not-an-item']
+    assert order_lines(items) == {'a': 3, 'b': 1}
+    assert order_lines(None) == {}
+
+def test_an_order_is_counted_once_across_workers(sales_path):
+    applied = []
+    first = make_counters(sales_path, apply=applied.append)
+    second = make_counters(sales_path)
+    assert first.record('order-1', [{'product_barcode': 'a', 'quantity': 2}])
+    assert second.record('order-1', [{'product_barcode': 'a', 'quantity': 2}])
+    assert second.record(None, [{'product_barcode': 'b'}])
+    assert not first.record('order-2', [])
+    first.flush()
+    second.flush()
+
+    # Each worker reads back the other's lines, and the repeated order id counts once
+    first.flush()
+    assert first.counts == second.counts == {'a': 2, 'b': 1}
+    assert applied == [{'a': 2}, {'b': 1}]
+    assert first.stats()['pending_orders'] == 0
+
+def test_only_sales_since_the_model_export_count(sales_path):
+    counters = make_counters(sales_path)
+    counters.record('old', [{'product_barcode': 'a', 'quantity': 5}])
+    counters.flush()
+    cutoff = time.time()
+    counters.record('new', [{'product_barcode': 'a', 'quantity': 1}, {'product_barcode': 'b', 'quantity': 2}])
+    counters.flush()
+    assert counters.counts == {'a': 6, 'b': 2}
+
+    # A model exported at cutoff already includes the older order
+    with counters.apply_lock:
+        assert counters.since(cutoff) == {'a': 1, 'b': 2}
+    counters.pending.put_nowait(('late', {'a': 4}, cutoff - 1))
+    counters.record('later', [{'product_barcode': 'b', 'quantity': 1}])
+    counters.flush()
+    assert counters.counts == {'a': 1, 'b': 3}
+
+def test_old_orders_are_purged(sales_path):
+    counters = make_counters(sales_path, retention=60)
+    counters.pending.put_nowait(('old', {'a': 1}, time.time() - 120))
+    counters.record('new', [{'product_barcode': 'a', 'quantity': 1}])
+    counters.flush()
+    counters.purge()
+    connection = counters.connect()
+    assert connection.execute('SELECT order_id FROM sales_orders').fetchall() == [('new',)]
+    assert connection.execute('SELECT SUM(units) FROM sales_lines').fetchone()[0] == 1
+
+def test_ranking_matches_a_full_sort_as_counts_change():
+    rng = np.random.default_rng(7)
+    units_sold = rng.integers(0, 20, size=200)
+    ranking = TopSellingRanking(units_sold, 10)
+    for _ in range(100):
+        rows = rng.choice(200, size=3, replace=False)
+        # Mostly sales, now and then a correction downwards
+        units_sold[rows] = np.maximum(units_sold[rows] + rng.integers(-3, 8, size=3), 0)
+        ranking.update(units_sold, rows.tolist())
+        assert ranking.rows == np.argsort(-units_sold, kind='stable')[:10].tolist()
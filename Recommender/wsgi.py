@@ -0,0 +1,16 @@
+import gc
+from app import app, load_recommender_model, MODEL_PATH
+
+# With gunicorn's preload_app this runs once in the master process. Workers are
+# forked afterwards and share the loaded model copy-on-write.
+print(f"Loading recommender model from {MODEL_PATH}...")
+if load_recommender_model(MODEL_PATH):
+    print("Model loaded successfully!")
+else:
+    print("WARNING: Failed to load model. API will attempt to load it on first request.")
+
+# Move the loaded objects out of the garbage collector's reach, so collections
+# in the workers don't write to (and thereby copy) the shared pages
+gc.freeze()
+
+application = app